@@ -0,0 +1,406 @@
+import os
+import csv
+import time
+import resource
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+import matplotlib
+# no display needed, must be selected before pyplot is imported by the figure scripts
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from collections import Counter, defaultdict
+from sqlalchemy import MetaData, Table, Column, String, Date, insert
+from sqlalchemy.engine import make_url
+import db_connection
+import included_papers
+import search_term_index
+import figure_aggregations
+import create_figures
+import dpsir_analysis
+import render_figures
+from ugc_sources import canonical_ugc_source, split_ugc_sources
+'''
+measures how the analysis data preparation scales with the size of the literature table. Synthetic literature tables are
+generated from the distributions of the included papers of the appendix (sdg, ugc sources, source and query are drawn
+together per paper, dates around the appendix dates), loaded into a database and every data preparation stage of the
+figures is timed with its peak memory. The plot functions of the figures built from the included papers run last, their
+figures are built but not written (output_figure is replaced by skip_output). A figure that has no colour or label for
+a source drawn into its top sources (small tables) is reported and skipped, e.g.:
+
+    python benchmark_analysis.py --rows 1000 10000 100000 1000000
+    python benchmark_analysis.py --rows 100000 --db postgresql://postgres:pw@127.0.0.1:5432/slr_bench --output bench.csv
+    python benchmark_analysis.py --rows 100000 --legacy
+
+--legacy times the count tables of the sankey, stacked bar and by-year figures again next to their former loop
+implementations (legacy_* functions, kept as reference) and checks that both count the same.
+
+The literature and included_papers tables of the benchmark database are replaced, never point --db to slr_final.
+Peak memory is traced with tracemalloc, which slows down python level allocations, use --no-memory for plain timings.
+Memory outside of python's allocators (e.g. arrow backed string columns) only shows in the peak resident set size of
+the process, which is reported after each stage as well.
+'''
+PATH_APPENDIX = './slr_included_papers_appendix.csv'
+# columns of the appendix drawn together per synthetic paper
+APPENDIX_COLUMNS = ['doi', 'title', 'author', 'sdg', 'ugc_source', 'paperurl', 'source', 'query']
+# share of screened papers that were included, the others have no screening annotations
+INCLUDED_SHARE = 0.2
+REVIEW_SHARE = 0.05
+# the appendix has no DPSIR annotation, share of each class (dk: don't know), one class per paper like the papers the
+# DPSIR sankey is drawn from
+DPSIR_SHARES = {'D': 0.25, 'P': 0.2, 'S': 0.2, 'I': 0.15, 'R': 0.15, 'dk': 0.05}
+# rows per insert statement when loading the synthetic table
+LOAD_CHUNK_SIZE = 10000
+# the database of the analysis, its tables must not be replaced
+PROTECTED_DATABASES = ['slr_final']
+# topics of the DPSIR figures
+DPSIR_TOPICS = ['11.5', '3.9', '11.3', '11.7', '3.3']
+# name -> build function of the aggregates computed by the last figure run (record_aggregate)
+AGGREGATES = {}
+# plot functions of the figures built from the included papers, the synthetic table has no study area annotations
+FIGURE_STAGES = {name: function for name, (function, sources, files) in render_figures.FIGURES.items() if sources == render_figures.PAPERS}
+
+metadata = MetaData()
+literature_table = Table('literature', metadata,
+                         Column('eid', String, primary_key=True),
+                         *[Column(column, String) for column in APPENDIX_COLUMNS],
+                         Column('date', Date),
+                         Column('subtype', String),
+                         Column('decision_r_1', String),
+                         Column('decision_r_2', String),
+                         Column('dpsir', String))
+
+
+def load_appendix(path):
+    with open(path, 'rt', encoding='utf-8') as f:
+        # plain python strings, empty fields as None
+        appendix = pd.DataFrame([{key: value or None for key, value in row.items()} for row in csv.DictReader(f, delimiter=';')], dtype=object)
+    appendix['date'] = pd.to_datetime(appendix['date'], errors='coerce')
+    # papers of the sdg sections without target (e.g. '<SDG3>') have no label in the figures, they are not drawn
+    return appendix[appendix['sdg'].str.match(r'\d+\.\w$', na=False)].reset_index(drop=True)
+
+def synthetic_literature(rows, appendix, seed=0):
+    '''
+    :param rows: number of papers of the literature table
+    :param appendix: included papers of the appendix the distributions are drawn from
+    :return: DataFrame with the columns of literature_table
+    '''
+    random = np.random.default_rng(seed)
+    picks = random.integers(0, len(appendix), rows)
+    literature = appendix[APPENDIX_COLUMNS].iloc[picks].reset_index(drop=True)
+    literature.insert(0, 'eid', [f'2-s2.0-{85000000000 + number}' for number in range(rows)])
+    # dates scattered within a year around the date of the drawn paper
+    offsets = pd.to_timedelta(random.integers(-182, 183, rows), unit='D')
+    literature['date'] = (appendix['date'].iloc[picks].reset_index(drop=True) + offsets).dt.date
+    literature['subtype'] = np.where(random.random(rows) < REVIEW_SHARE, 'Review', 'Article')
+    included = random.random(rows) < INCLUDED_SHARE
+    # either reviewer included the paper
+    first = random.random(rows) < 0.5
+    literature['decision_r_1'] = np.where(included & first, '1', '0')
+    literature['decision_r_2'] = np.where(included & ~first, '1', '0')
+    literature['dpsir'] = random.choice(list(DPSIR_SHARES), rows, p=list(DPSIR_SHARES.values()))
+    # screening annotations only exist for included papers
+    for column in ['ugc_source', 'dpsir']:
+        literature[column] = literature[column].where(included, None)
+    return literature
+
+def load_literature(engine, literature):
+    '''
+    replace the literature table of the benchmark database with the synthetic one
+    '''
+    included_papers.included_papers_table.drop(engine, checkfirst=True)
+    literature_table.drop(engine, checkfirst=True)
+    literature_table.create(engine)
+    with engine.begin() as conn:
+        for start in range(0, len(literature), LOAD_CHUNK_SIZE):
+            chunk = literature.iloc[start:start + LOAD_CHUNK_SIZE].astype(object)
+            conn.execute(insert(literature_table), chunk.where(chunk.notna(), None).to_dict('records'))
+
+def stage(results, rows, name, function, *args, trace_memory=True):
+    '''
+    run one stage and record its wall time and peak memory (of python allocations during the stage)
+
+    :return: return value of function
+    '''
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        value = function(*args)
+    except Exception:
+        if trace_memory:
+            tracemalloc.stop()
+        raise
+    took = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    # kilobytes on linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+    results.append({'rows': rows, 'stage': name, 'seconds': round(took, 4), 'peak_mb': None if peak is None else round(peak, 1),
+                    'max_rss_mb': round(max_rss, 1)})
+    print(f"[+] {rows:>9} {name:<44} {took:9.3f}s {'' if peak is None else f'{peak:9.1f} MB'} {max_rss:9.1f} MB rss")
+    return value
+
+def legacy_sankey_counts():
+    '''
+    former count table of create_figures.plot_ugc_sources_by_topic_revamped_sankeyplot (iterrows over the papers)
+    '''
+    term_citizen_science = 'citizen science'
+    top_sources_in_figure = 13
+    papers = included_papers.load_included_papers(db_connection.get_raw_connection())
+    rows = papers.loc[papers['sdg'].notna(), ['ugc_sources', 'sdg']].to_numpy()
+    overall_most_common_ugc_list = [source[0] for source in Counter([item for list_ in rows for item in list_[0]]).most_common(top_sources_in_figure)]
+    if term_citizen_science not in overall_most_common_ugc_list:
+        overall_most_common_ugc_list += [term_citizen_science]
+    df = pd.DataFrame(rows, columns=['ugc_sources', 'target'])
+    targets_to_exclude = ['3.1', '3.2', '3.b', '3.5', '3.a', '3.7', '3.8', '3.c', '3.d']
+    ugc_per_target_dict = defaultdict(lambda: 0)
+    for row_index, row in df.iterrows():
+        # positional access by iloc, plain row[0] fails on pandas 3
+        if row.iloc[0]:
+            ugc_sources = row.iloc[0]
+            target = row.iloc[1]
+            if target not in targets_to_exclude:
+                for ugc_source in ugc_sources:
+                    if ugc_source in overall_most_common_ugc_list:
+                        ugc_per_target_dict[(ugc_source, target)] += 1
+                    else:
+                        ugc_per_target_dict[('other', target)] += 1
+    rows_to_insert_into_df = []
+    for k, v in ugc_per_target_dict.items():
+        rows_to_insert_into_df.append([k[0], k[1], v])
+    return pd.DataFrame(rows_to_insert_into_df, columns=['ugc_sources', 'target', 'count'])
+
+def legacy_stackedbar_counts():
+    '''
+    former count table of create_figures.plot_ugc_sources_by_topic_revamped_stackedbar (one df.loc append per count)
+    '''
+    term_citizen_science = 'citizen science'
+    top_sources_in_figure = 10
+    papers = included_papers.load_included_papers(db_connection.get_raw_connection())
+    sdg_terms_of_accepted_papers = papers.loc[papers['sdg_term'].notna(), ['ugc_sources', 'sdg_term', 'target']].to_numpy()
+    overall_most_common_ugc_list = [source[0] for source in Counter([item for list_ in sdg_terms_of_accepted_papers for item in list_[0]]).most_common(top_sources_in_figure)]
+    if term_citizen_science not in overall_most_common_ugc_list:
+        overall_most_common_ugc_list += [term_citizen_science]
+    papers_per_target = defaultdict(lambda: {'count': 0, 'ugc_sources': []})
+    for (ugc_sources, term, target_str) in sdg_terms_of_accepted_papers:
+        if pd.isna(target_str):
+            continue
+        papers_per_target[target_str]['count'] += 1
+        papers_per_target[target_str]['ugc_sources'] += ugc_sources
+    df = pd.DataFrame(columns=['target', 'ugc_sources', 'count'])
+    index = 0
+    targets_to_exclude = ['3.1', '3.2', '3.3', '3.b', '3.5', '3.a', '3.7', '3.8', '3.c', '3.d']
+    for target, target_dict in papers_per_target.items():
+        if target not in targets_to_exclude:
+            top_ugc_sources_counter = Counter(target_dict['ugc_sources'])
+            total_ugc_sources_count = len(target_dict['ugc_sources'])
+            total_top_ugc_sources_count = 0
+            for top_source in overall_most_common_ugc_list:
+                top_source_count_in_this_target = top_ugc_sources_counter[top_source]
+                total_top_ugc_sources_count += top_source_count_in_this_target
+                df.loc[index] = [target, top_source, top_source_count_in_this_target]
+                index += 1
+            df.loc[index] = [target, 'other', (total_ugc_sources_count - total_top_ugc_sources_count)]
+            index += 1
+    return df
+
+def legacy_by_year_counts():
+    '''
+    former count table of create_figures.plot_ugc_sources_by_year (one list comprehension over all papers per year),
+    without the colour column
+    '''
+    term_citizen_science = 'citizen science'
+    top_sources_in_figure = 5
+    papers = included_papers.load_included_papers(db_connection.get_raw_connection())
+    sdg_terms_of_accepted_papers = papers.loc[papers['sdg_term'].notna() & papers['year'].notna(), ['ugc_sources', 'sdg_term', 'year']].to_numpy()
+    overall_most_common_ugc_list = [source[0] for source in Counter([item for list_ in sdg_terms_of_accepted_papers for item in list_[0]]).most_common(top_sources_in_figure)]
+    if term_citizen_science not in overall_most_common_ugc_list:
+        overall_most_common_ugc_list += [term_citizen_science]
+    years = set([item[2] for item in sdg_terms_of_accepted_papers])
+    ugc_per_year_dict = {}
+    for year in years:
+        ugc_per_year = [item for row in sdg_terms_of_accepted_papers for item in row[0] if row[2] == year]
+        ugc_per_year_dict[year] = Counter(ugc_per_year).most_common(top_sources_in_figure)
+    df = pd.DataFrame(columns=['year', 'ugc_sources', 'count'])
+    index = 0
+    years_to_skip = [2021]
+    exclude_years_below = 2005
+    for year, ugc_counter in ugc_per_year_dict.items():
+        if year in years_to_skip or year < exclude_years_below:
+            continue
+        other_sources_count = 0
+        for ugc_source, ugc_count in ugc_counter:
+            if ugc_source in overall_most_common_ugc_list:
+                df.loc[index] = [year, ugc_source, ugc_count]
+            else:
+                other_sources_count += ugc_count
+            index += 1
+        df.loc[index] = [year, 'other', other_sources_count]
+        index += 1
+    return df
+
+def legacy_dpsir_counts(df):
+    # one groupby of all topics per topic of the figures, DPSIR classes counted per topic
+    df = df.drop(df[df.dpsir == 'dk'].index)
+    df['dpsir'] = df['dpsir'].apply(lambda x: x.upper())
+    counts = []
+    for topic in DPSIR_TOPICS:
+        for index, (label, label_df) in enumerate(df.groupby('topic')):
+            if label == topic:
+                label_df_grouped = label_df.groupby('dpsir').count()
+                for dpsir, row in label_df_grouped.iterrows():
+                    counts.append([topic, dpsir, row.iloc[0]])
+    return pd.DataFrame(counts, columns=['topic', 'dpsir', 'count'])
+
+def legacy_dpsir_sankey_counts():
+    '''
+    former count table of dpsir_analysis.DPSIR_per_paper_type_sankeyplot
+    '''
+    papers = included_papers.load_included_papers(db_connection.get_raw_connection())
+    rows = papers.loc[papers['dpsir'].notna(), ['dpsir', 'sdg']].to_numpy()
+    return legacy_dpsir_counts(pd.DataFrame(rows, columns=['dpsir', 'topic']))
+
+def legacy_dpsir_stackedbar_counts():
+    '''
+    former count table of dpsir_analysis.DPSIR_per_paper_type_stackedbar (first DPSIR class of the paper)
+    '''
+    papers = included_papers.load_included_papers(db_connection.get_raw_connection())
+    papers = papers[papers['dpsir'].notna() & papers['target'].notna()]
+    dpsir_with_target = np.array([[dpsir.lower().replace(' ', '').split(';')[0], target] for dpsir, target in zip(papers['dpsir'], papers['target'])])
+    return legacy_dpsir_counts(pd.DataFrame(dpsir_with_target, columns=['dpsir', 'topic']))
+
+def same_counts(new, old, keys):
+    '''
+    :return: True if both count tables hold the same counts per keys (in any order)
+    '''
+    new, old = [frame.astype({key: str for key in keys}).set_index(keys)['count'].astype(int).sort_index() for frame in (new, old)]
+    return new.index.equals(old.index) and (new.to_numpy() == old.to_numpy()).all()
+
+def figure_topics(counts):
+    # the former DPSIR loops only counted the topics of the figures
+    return counts[counts['topic'].isin(DPSIR_TOPICS)]
+
+# name of the aggregate (cached_aggregate of the figure) -> (former implementation, key columns of the counts, function
+# selecting the counts of the aggregate the former implementation computed)
+LEGACY_AGGREGATES = {
+    'ugc_sources_by_topic_sankeyplot': (legacy_sankey_counts, ['ugc_sources', 'target'], None),
+    'ugc_sources_by_topic_stackedbar': (legacy_stackedbar_counts, ['target', 'ugc_sources'], None),
+    'ugc_sources_by_year': (legacy_by_year_counts, ['year', 'ugc_sources'], None),
+    'dpsir_by_paper_topic_sankeyplot': (legacy_dpsir_sankey_counts, ['topic', 'dpsir'], figure_topics),
+    'dpsir_by_paper_topic_stackedbar': (legacy_dpsir_stackedbar_counts, ['topic', 'dpsir'], figure_topics),
+}
+
+def skip_output(fig, name, *args, **kwargs):
+    '''
+    replaces output_figure and output_matplotlib of the figure scripts, the figure is neither shown nor written
+    '''
+    if isinstance(fig, plt.Figure):
+        plt.close(fig)
+
+def record_aggregate(name, build, *args, **kwargs):
+    '''
+    replaces cached_aggregate of the figure scripts, keeps the build function of the aggregate to time it on its own
+    '''
+    AGGREGATES[name] = build
+    return build()
+
+def stub_figure_output():
+    create_figures.output_figure = skip_output
+    dpsir_analysis.output_figure = skip_output
+    dpsir_analysis.output_matplotlib = skip_output
+    create_figures.cached_aggregate = record_aggregate
+    dpsir_analysis.cached_aggregate = record_aggregate
+
+def quiet(function):
+    '''
+    :return: function running function without its prints (the figures print their counts and every paper without target)
+    '''
+    def run():
+        with open(os.devnull, 'wt') as devnull, contextlib.redirect_stdout(devnull):
+            return function()
+    return run
+
+def clear_caches():
+    # memoised per distinct string, every size starts cold
+    canonical_ugc_source.cache_clear()
+    search_term_index.query_sdg_term.cache_clear()
+
+def run_size(rows, appendix, engine, trace_memory=True, seed=0, legacy=False):
+    '''
+    :param legacy: time the former implementations of the count tables next to the current ones (LEGACY_AGGREGATES)
+    :return: list of result dicts of all stages for one table size
+    '''
+    results = []
+    run = lambda name, function, *args: stage(results, rows, name, function, *args, trace_memory=trace_memory)
+    literature = run('generate literature', synthetic_literature, rows, appendix, seed)
+    clear_caches()
+    run('sdg_terms', search_term_index.sdg_terms, literature['query'], literature['source'])
+    run('split_ugc_sources', lambda: [split_ugc_sources(sources) for sources in literature['ugc_source']])
+    run('load literature', load_literature, engine, literature)
+    del literature
+    clear_caches()
+    conn = db_connection.get_raw_connection()
+    run('build included_papers', included_papers.build_included_papers, conn)
+    run('refresh included_papers', included_papers.refresh_included_papers, conn)
+    papers = run('load included_papers', included_papers.load_included_papers, conn)
+    long = run('explode_sources', figure_aggregations.explode_sources, papers, ['target', 'sdg', 'year'])
+    top = run('most_common_sources', figure_aggregations.most_common_sources, long, 10)
+    long = run('bucket_sources', figure_aggregations.bucket_sources, long, top)
+    run('pair_counts source x sdg', figure_aggregations.pair_counts, long, ['ugc_source', 'sdg'])
+    run('crosstab target x source', figure_aggregations.crosstab, long[long['target'].notna()], 'target', 'ugc_source')
+    run('top_per_group year', figure_aggregations.top_per_group, long[long['year'].notna()], 'year', 5)
+    run('dpsir_classes', figure_aggregations.dpsir_classes, papers, 'target', True)
+    # the same path as render_figures.py, on the included papers loaded above
+    create_figures.conn = conn
+    for name, function in FIGURE_STAGES.items():
+        try:
+            run(f'figure {name}', quiet(function))
+        except Exception as e:
+            # e.g. a source drawn into the top sources that has no colour in the figure
+            print(f'[-] {rows:>9} figure {name}: {e!r}')
+    if legacy:
+        for name, (legacy_function, keys, select_counts) in LEGACY_AGGREGATES.items():
+            counts = run(f'aggregate {name}', quiet(AGGREGATES[name]))
+            legacy_counts = run(f'legacy {name}', legacy_function)
+            if select_counts is not None:
+                counts = select_counts(counts)
+            if not same_counts(counts, legacy_counts, keys):
+                print(f'[-] {rows:>9} {name}: the former implementation counts differently')
+    db_connection.close_db()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the analysis data preparation on synthetic literature tables')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000, 1000000], help='sizes of the literature table')
+    parser.add_argument('--db', default=None, help='sqlalchemy connection string, defaults to a temporary sqlite file')
+    parser.add_argument('--appendix', default=PATH_APPENDIX, help='csv of the included papers the distributions are drawn from')
+    parser.add_argument('--search-terms', default='./search_terms.txt', help='search term file with the sdg targets')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace the peak memory (plain timings)')
+    parser.add_argument('--legacy', action='store_true', help='also time the former loop implementations of the count tables and compare their counts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='csv file for the results')
+    args = parser.parse_args()
+
+    conn_string = args.db or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    if make_url(conn_string).database in PROTECTED_DATABASES:
+        raise SystemExit(f'[-] {make_url(conn_string).database} is the analysis database, use another one for the benchmark')
+    # the analysis scripts read the benchmark database
+    db_connection.ANALYSIS_URL = conn_string
+    included_papers.PATH_SEARCH_TERMS = args.search_terms
+    stub_figure_output()
+    engine = db_connection.get_analysis_engine()
+    appendix = load_appendix(args.appendix)
+    print(f'[*] {len(appendix)} appendix papers, database {engine.url.render_as_string(hide_password=True)}')
+
+    results = []
+    for rows in args.rows:
+        results += run_size(rows, appendix, engine, trace_memory=not args.no_memory, seed=args.seed, legacy=args.legacy)
+    if args.output:
+        pd.DataFrame(results).to_csv(args.output, index=False)
+        print(f'[+] results written to {args.output}')
@@ -0,0 +1,88 @@
+import os
+import time
+import random
+import argparse
+import datetime
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from dbclasses import Base, ScopusEntry, EntryWriter
+'''
+compares the former per row session.add/commit (with rollback as duplicate detection) with the batched EntryWriter when
+storing harvested search results, e.g.:
+
+    python benchmark_db_writes.py --rows 20000 --duplicates 0.3
+    python benchmark_db_writes.py --db postgresql://postgres:pw@127.0.0.1:5432/slr_bench
+'''
+
+
+def synthetic_entries(rows, duplicate_share, seed=0):
+    random.seed(seed)
+    unique = int(rows * (1 - duplicate_share))
+    entries = []
+    for index in range(rows):
+        number = index if index < unique else random.randrange(unique)
+        entries.append({
+            'eid': f'2-s2.0-{85000000000 + number}',
+            'doi': f'10.0000/bench.{number}',
+            'title': f'Benchmark paper {number}',
+            'subtype': 'Article',
+            'date': datetime.date(2005 + number % 17, 1 + number % 12, 1),
+            'author': f'Author {number % 97}',
+            'openaccess': bool(number % 2),
+            'publicationname': f'Journal {number % 31}',
+            'paperurl': f'https://www.scopus.com/inward/record.uri?eid={number}',
+            'abstracturl': f'https://api.elsevier.com/content/abstract/eid/{number}',
+        })
+    return entries
+
+def new_session(conn_string):
+    engine = create_engine(conn_string)
+    Base.metadata.drop_all(engine, tables=[ScopusEntry.__table__])
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+def per_row_commit(session, entries, page_size):
+    inserted = 0
+    duplicates = 0
+    for fields in entries:
+        entry = ScopusEntry(fields['eid'], fields['doi'], fields['title'], fields['subtype'], fields['date'],
+                            fields['author'], fields['openaccess'], fields['publicationname'], fields['paperurl'],
+                            fields['abstracturl'], 'request', 'scopus', 'TITLE', 'query', '<SDG3>')
+        try:
+            session.add(entry)
+            session.commit()
+            inserted += 1
+        except Exception:
+            duplicates += 1
+            session.rollback()
+    return inserted, duplicates
+
+def batched_writer(session, entries, page_size):
+    writer = EntryWriter(session)
+    for index, fields in enumerate(entries, 1):
+        writer.add(fields, 'request', 'TITLE', 'query', '<SDG3>')
+        # the pipelines flush once per result page
+        if index % page_size == 0:
+            writer.flush()
+    writer.flush()
+    return writer.inserted, writer.duplicates
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark per row commits against batched inserts')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--duplicates', type=float, default=0.3, help='share of rows with an already stored eid')
+    parser.add_argument('--page-size', type=int, default=25, help='rows per scopus result page')
+    parser.add_argument('--db', default=None, help='sqlalchemy connection string, defaults to a temporary sqlite file')
+    args = parser.parse_args()
+
+    entries = synthetic_entries(args.rows, args.duplicates)
+    conn_string = args.db or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    print(f'[*] {args.rows} rows ({args.duplicates * 100:.0f}% duplicates) against {conn_string.split(":")[0]}')
+    for name, write in [('per row commit', per_row_commit), ('batched insert', batched_writer)]:
+        session = new_session(conn_string)
+        start = time.perf_counter()
+        inserted, duplicates = write(session, entries, args.page_size)
+        duration = time.perf_counter() - start
+        print(f'[+] {name}: {duration:.2f} s ({args.rows / duration:.0f} rows/s), {inserted} inserted, {duplicates} duplicates')
+        session.close()
@@ -0,0 +1,90 @@
+import re
+import csv
+import time
+import argparse
+from ugc_sources import canonical_ugc_source, split_ugc_sources
+'''
+checks that the compiled ugc source canonicaliser returns the same names as the former per source if/elif chain of
+re.search calls and compares their speed on the ugc sources of the appendix, e.g.:
+
+    python benchmark_ugc_sources.py --repeat 200
+'''
+PATH_APPENDIX = './slr_included_papers_appendix.csv'
+
+
+def legacy_check_cs(sources):
+    pattern = r'(citizen|crowed|crowd)'
+    new_source = []
+    for element in sources:
+        try:
+            re.search(pattern, element, re.IGNORECASE).group(0)
+            new_source.append('citizen science')
+        except Exception as e:
+            new_source.append(element)
+    return new_source
+
+def legacy_canonical_ugc_source(source):
+    if bool(re.search(r'(weibo|sina)', source)):
+        source = 'sina weibo'
+    elif bool(re.search(r'(google)', source)) or bool(re.search(r'(trend|search)', source)):
+        source = 'google trends'
+    elif bool(re.search(r'(geo)', source)) or bool(re.search(r'(wiki)', source)):
+        source = 'geo wiki'
+    elif bool(re.search(r'(openstreet)', source)):
+        source = 'openstreetmap (osm)'
+    elif bool(re.search(r'(strava)', source)):
+        source = 'strava'
+    elif bool(re.search(r'(facebook)', source)):
+        source = 'facebook'
+    elif bool(re.search(r'(tencent)', source)):
+        source = 'tencent'
+    elif bool(re.search(r'(twitter)', source)):
+        source = 'twitter'
+    elif bool(re.search(r'(healthmap)', source)):
+        source = 'healthmap'
+    elif bool(re.search(r'(flickr)', source)):
+        source = 'flickr'
+    elif bool(re.search(r'(wikiloc)', source)):
+        source = 'wikiloc'
+    elif bool(re.search(r'(wikidata)', source)):
+        source = 'wikidata'
+    return source
+
+def legacy_split_ugc_sources(ugc_source):
+    sources = [source.strip() for source in ugc_source.lower().replace(' ', '').split(';')]
+    return [legacy_canonical_ugc_source(source) for source in legacy_check_cs(sources) if source != '']
+
+def load_ugc_sources(path):
+    with open(path, 'rt', encoding='utf-8') as f:
+        return [row['ugc_source'] for row in csv.DictReader(f, delimiter=';') if row['ugc_source']]
+
+def edge_cases():
+    # sources matching the aliases of several canonical names, in both orders and in other cases
+    return ['wikiloc', 'wikidata', 'geowiki.org', 'googlesearch', 'sinaweibo', 'twitter;flickr', 'crowdsourcing',
+            'CrowdMap', 'Citizen Science', 'twitterandweibo', 'flickrsearch', 'openstreetmap(osm)', 'stravametro',
+            'tencentgeo', ' ; ;twitter ', 'instagram', '']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare the compiled ugc source canonicaliser with the former if/elif chain')
+    parser.add_argument('--path', default=PATH_APPENDIX, help='csv file with a ugc_source column')
+    parser.add_argument('--repeat', type=int, default=100, help='passes over the ugc sources per timing')
+    args = parser.parse_args()
+
+    ugc_sources = load_ugc_sources(args.path)
+    mismatches = [ugc_source for ugc_source in ugc_sources + edge_cases()
+                  if split_ugc_sources(ugc_source) != legacy_split_ugc_sources(ugc_source)]
+    for ugc_source in mismatches:
+        print(f'[-] {ugc_source!r}: {split_ugc_sources(ugc_source)} != {legacy_split_ugc_sources(ugc_source)}')
+    distinct = set(source for ugc_source in ugc_sources for source in split_ugc_sources(ugc_source))
+    print(f'[*] {len(ugc_sources)} papers, {len(distinct)} canonical sources, {len(mismatches)} mismatches')
+
+    for name, function in [('if/elif chain', legacy_split_ugc_sources), ('compiled', split_ugc_sources)]:
+        canonical_ugc_source.cache_clear()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for ugc_source in ugc_sources:
+                function(ugc_source)
+        took = time.perf_counter() - start
+        print(f'[+] {name:<14} {took:.3f}s ({took / (args.repeat * len(ugc_sources)) * 1e6:.1f} us per paper)')
+    if mismatches:
+        raise SystemExit(1)
@@ -1,64 +1,23 @@
-import os
-import re
 import csv
-import numpy as np
 import pandas as pd
 from collections import Counter
 from collections import defaultdict
 # plotting
-import plotly
 import plotly.express as px
 import plotly.graph_objs as go
 
 from db_querier import connect_db
-from db_querier import query_result_return
+from db_connection import close_db
+from included_papers import load_included_papers, load_search_terms_per_target
+import search_term_index
+from figure_output import output_figure
+from figure_cache import cached_aggregate
+from figure_aggregations import OTHER, explode_sources, most_common_sources, bucket_sources, pair_counts, crosstab, top_per_group
+# treemap data of the search terms (no restrictions / adapted terms without abstract search)
+PATH_TREEMAP_ALL_TERMS = './treemap_data_no_restrictions.csv'
+PATH_TREEMAP_INCLUDED_TERMS = './20200820_treemap_adapted_searchterms_no_abs.csv'
 
 
-def load_search_terms_per_target(PATH_SEARCH_TERMS = './sdg_search_terms_extended_w_manual_terms.txt', sections=['<SDG3>', '<SDG11>']):
-    '''
-    load the used search terms for ugc terms and sdg target related terms. they are used to be compared with the results to
-    evaluate for which targets applicable papers were found and were a possible research gab for UGC exists.
-
-    :param PATH_SEARCH_TERMS:
-    :param sections:
-    :return:
-    '''
-    current_section = None
-    active_target = None
-    target_pattern = r'target'
-    search_terms_per_target_dict = {}
-    with open(PATH_SEARCH_TERMS, 'rt') as f:
-        content = f.readlines()
-        for line in content:
-            line = line.strip('\n')
-            if line in sections:
-                current_section = line
-                continue
-            else:
-                # check if a section is assigned (only true when reading the file header)
-                if current_section is not None:
-                    # check if line stands for a sdg target (e.g. target 3.2)
-                    try:
-                        re.search(target_pattern, line).group(0)
-                        active_target = line.lstrip('target ')
-                        continue
-                    except AttributeError:
-                        if active_target != None and line != '':
-                            # relate search term to its target
-                            search_terms_per_target_dict[line] = active_target
-                        else:
-                            continue
-                else:
-                    active_target = None
-
-    return search_terms_per_target_dict
-
-def query_result_return(conn, query):
-    with conn.cursor() as cursor:
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        return np.array(rows)
-
 def ugc_sources_to_latex(ugc_source_counter):
     OUTPUT_PATH_UGC_SOURCES_TO_LATEX = './ugc_sources_to_latex.txt'
 
@@ -79,136 +38,35 @@ def ugc_sources_to_latex(ugc_source_counter):
         f.write(r"\label{tab:my_label}" + "\n")
         f.write(r"\end{table}" + "\n")
 
-def data_polishing_w_year(rows):
-    # first clear rows with empty ugc source
-    rows = np.array([[row[0].lower().replace(' ', '').split(';'), row[1]] for row in rows if row[0] is not None])
-    rows = np.array([[row[1].year, list(map(str.strip, row[0]))] for row in rows if row[1] is not None])
-    # ignore empty strings
-    rows = np.array([[row[0], row[1]] for row in rows if row[1] != ['']])
-    return rows
-
-def fix_different_data_source_names(rows):
-    '''
-    if ugc sources appear in different variations and names it will be homonised here.
-    E.g. sina weibo, weibo, sina..
-    also fix empty string data sources
-    :return:
-    '''
-    weibo_pattern = r'(weibo|sina)'
-    google_pattern_1 = r'(google)'
-    google_pattern_2 = r'(trend|search)'
-    geo_wiki_pattern_1 = r'(geo)'
-    geo_wiki_pattern_2 = r'(wiki)'
-    osm_pattern = r'(openstreet)'
-    strava_pattern = r'(strava)'
-    facebook_pattern = r'(facebook)'
-    tecent_pattern = r'(tencent)'
-    twitter_pattern = r'(twitter)'
-    healthmap_pattern = r'(healthmap)'
-    flickr_pattern = r'(flickr)'
-    wikidata_pattern = r'(wikidata)'
-    wikiloc_pattern = r'(wikiloc)'
-
-    fixed_rows = []
-    for row in rows:
-        ugc_sources = row[0]
-        sdg_term = row[1]
-        year = row[2]
-        fixed_ugc_sources = []
-        for source in ugc_sources:
-            if source != '':
-                if bool(re.search(weibo_pattern, source)):
-                    # homogeniase to sina weibo
-                    source = 'sina weibo'
-                elif bool(re.search(google_pattern_1, source)) or bool(re.search(google_pattern_2, source)):
-                    # homogeniase to google
-                    source = 'google trends'
-                elif bool(re.search(geo_wiki_pattern_1, source)) or bool(re.search(geo_wiki_pattern_2, source)):
-                    # homogeniase to geo-wiki.org
-                    source = 'geo wiki'
-                elif bool(re.search(osm_pattern, source)):
-                    # homogeniase to osm
-                    source = 'openstreetmap (osm)'
-                elif bool(re.search(strava_pattern, source)):
-                    # homogeniase to strava
-                    source = 'strava'
-                elif bool(re.search(facebook_pattern, source)):
-                    # homogeniase to facebook
-                    source = 'facebook'
-                elif bool(re.search(tecent_pattern, source)):
-                    # homogeniase to tecent
-                    source = 'tencent'
-                elif bool(re.search(twitter_pattern, source)):
-                    # homogeniase to twitter
-                    source = 'twitter'
-                elif bool(re.search(healthmap_pattern, source)):
-                    # homogeniase to healthmap
-                    source = 'healthmap'
-                elif bool(re.search(flickr_pattern, source)):
-                    # homogeniase to flickr
-                    source = 'flickr'
-                elif bool(re.search(wikiloc_pattern, source)):
-                    # homogeniase to wikiloc
-                    source = 'wikiloc'
-                elif bool(re.search(wikidata_pattern, source)):
-                    # homogeniase to wikidata
-                    source = 'wikidata'
-
-                fixed_ugc_sources.append(source)
-        fixed_row = [fixed_ugc_sources, sdg_term, year] # year
-        fixed_rows.append(fixed_row)
-    fixed_rows = np.array(fixed_rows)
-    return fixed_rows
-
 def plot_ugc_sources_overview():
     '''
     simple figure that plots the occurrences of the found ugc sources
 
     :return:
     '''
-    rows = query_result_return(conn, "select ugc_source, date from literature where decision_r_1 = '1' or decision_r_2 = '1' and subtype != 'Review';")
-    rows = np.array([[row[0].lower().split(';'), row[1]] for row in rows])
-    rows = np.array([[list(map(str.strip, row[0])), row[1]] for row in rows])
-    ugc_source_list = np.concatenate(np.array([row[0] for row in rows]))
-    ugc_source_counter = Counter(ugc_source_list)
-    # transform Counter object to dataframe for visualisation
-    # most_common = ugc_source_counter.most_common()
-    df = pd.DataFrame.from_dict(ugc_source_counter, orient='index').reset_index()
-    # rename columns
-    df = df.rename(columns={'index': 'ugc', 0: 'count'})
-    # sort by count
-    df.sort_values(by='count', inplace=True, ascending=False)
+    papers = load_included_papers(conn)
+    # one row per ugc source of a paper
+    ugc_sources = papers['ugc_sources'].explode().dropna()
+    # count and sort by count
+    df = ugc_sources.value_counts().rename_axis('ugc').reset_index(name='count')
     fig = px.bar(df, x='ugc', y='count')
-    fig.show()
+    output_figure(fig, 'ugc_sources_overview')
 
 def plot_included_papers_by_year():
-    rows = query_result_return(conn, "select ugc_source, date from literature where decision_r_1 = '1' or decision_r_2 = '1' and subtype != 'Review';")
-    years = [row[1].year for row in rows if row[1] is not None]
-    year_counter = Counter(years)
-    # transform Counter object to dataframe for visualisation
-    # most_common = ugc_source_counter.most_common()
-    df = pd.DataFrame.from_dict(year_counter, orient='index').reset_index()
-    # rename columns
-    df = df.rename(columns={'index': 'year', 0: 'count'})
-    # sort by count
-    df.sort_values(by='count', inplace=True, ascending=False)
+    papers = load_included_papers(conn)
+    years = papers['year'].dropna()
+    # count and sort by count
+    df = years.value_counts().rename_axis('year').reset_index(name='count')
     fig = px.bar(df, x='year', y='count')
-    fig.show()
+    output_figure(fig, 'included_papers_by_year')
 
 def plot_top_ugc_sources_per_year(most_common_terms = 5):
-    rows = query_result_return(conn, "select ugc_source, date from literature where decision_r_1 = '1' or decision_r_2 = '1' and subtype != 'Review';")
-    rows = data_polishing_w_year(rows)
-    # merge ugc_source lists by year
+    papers = load_included_papers(conn)
+    # merge ugc_source lists by year, papers without year or ugc source are ignored
     year_dict = {}
-    for row in rows:
-        year = row[0]
-        ugc_sources = row[1]
-        if year not in year_dict.keys() and ugc_sources != '':
-            year_dict[year] = ugc_sources
-        else:
-            # merge on existing
-            existing_ugc_sources = year_dict[year]
-            year_dict[year] = existing_ugc_sources + ugc_sources
+    for year, ugc_sources in zip(papers['year'], papers['ugc_sources']):
+        if pd.notna(year) and ugc_sources:
+            year_dict[year] = year_dict.get(year, []) + ugc_sources
 
     for key in year_dict.keys():
         year_dict[key] = Counter(year_dict[key]).most_common(most_common_terms)
@@ -227,7 +85,7 @@ def plot_top_ugc_sources_per_year(most_common_terms = 5):
     fig.update_layout(
         font_size=17
     )
-    fig.show()
+    output_figure(fig, 'top_ugc_sources_per_year')
 
 def plot_ugc_sources_by_topic():
     '''
@@ -240,43 +98,20 @@ def plot_ugc_sources_by_topic():
     3.
     :return:
     '''
-    def query_extract(query, source):
-        # check if source is from the initial data pool (which was automated) or from the later iterations (webofknowledge) which was manually
-        if source == 'webofknowledge':
-            return query
-        else:
-            # used in map function on np array to extract search query of the paper
-            patter = r'[A-Z]+\({2}(\({0,1}.+)(?=\) AND \(\(citizen science collective sens\*\))'
-            try:
-                match = re.match(patter, query).group(1)
-            except:
-                pass
-            return match
-
-    rows = query_result_return(conn, "select ugc_source, query, source from literature where (decision_r_1 = '1' or decision_r_2 = '1') and subtype != 'Review';")
-    rows = np.array([[row[0].lower().replace(' ', '').split(';'), row[1], row[2]] for row in rows])
-    rows = np.array([[list(map(str.strip, row[0])), row[1], row[2]] for row in rows if row[1] is not None])
-    # extract query term which resembles the sdg relevant keyword for which the paper was extracted
-    sdg_terms_of_accepted_papers = np.array([[row[0], query_extract(row[1], row[2])] for row in rows])
-    sdg_terms_of_accepted_papers = fix_different_data_source_names(sdg_terms_of_accepted_papers)
+    papers = load_included_papers(conn)
     '''
     1. match sdg search terms of accepted papers with the complete list used for querying Scopus and see where gaps exist
     '''
-    search_terms_per_target_dict = load_search_terms_per_target()
     # creates a nested default dictionary
     papers_per_target = defaultdict(lambda: {'count': 0, 'ugc_sources': []})
-    #papers_per_target = dict.fromkeys(search_terms_per_target_dict.values())
-    for (ugc_sources, term) in sdg_terms_of_accepted_papers:
-        try:
-            target_str = search_terms_per_target_dict[term]
-            #current_count = papers_per_target[target_str]['count']
-            papers_per_target[target_str]['count'] += 1
-            current_ugc_sources = papers_per_target[target_str]['ugc_sources']
-            papers_per_target[target_str]['ugc_sources'] = current_ugc_sources + ugc_sources
-        except Exception as e:
+    for ugc_sources, term, target_str in zip(papers['ugc_sources'], papers['sdg_term'], papers['target']):
+        if pd.isna(target_str):
             # excepted will be terms that were manually added during the iteration of found LR
             # the terms therefore do not originate from the initial scopus api search
             print(f'here {term}')
+            continue
+        papers_per_target[target_str]['count'] += 1
+        papers_per_target[target_str]['ugc_sources'] += ugc_sources
 
     df = pd.DataFrame(columns=['target', 'ugc_sources', 'count'])
     top_ugc_sources = 3
@@ -306,7 +141,7 @@ def plot_ugc_sources_by_topic():
     fig = px.bar(df, x='target', y='count', color='ugc_sources', title=f"top {top_ugc_sources} UGC sources per SDG target")
     # change layout to descending order
     fig.update_layout(barmode='stack', xaxis={'categoryorder': 'total descending'})
-    fig.show()
+    output_figure(fig, 'ugc_sources_by_topic')
 
 
 def load_search_terms(PATH_SEARCH_TERMS = './sdg_search_terms_extended_w_manual_terms.txt', sections=['<SDG3>', '<SDG11>']):
@@ -316,25 +151,9 @@ def load_search_terms(PATH_SEARCH_TERMS = './sdg_search_terms_extended_w_manual_
 
     :param PATH_SEARCH_TERMS:
     :param sections:
-    :return:
+    :return: dict of section -> list of search terms
     '''
-    current_section = None
-    search_terms = {}
-    # assign empty lists to all sections of the file
-    for section in sections:
-        search_terms[section] = []
-    with open(PATH_SEARCH_TERMS, 'rt') as f:
-        content = f.readlines()
-        for line in content:
-            line = line.strip('\n')
-            if line in sections:
-                current_section = line
-                continue
-            else:
-                # check if a section is assigned (only true when reading the file header)
-                if current_section is not None and line != '':
-                    search_terms[current_section].append(line)
-    return search_terms
+    return search_term_index.load_search_terms(PATH_SEARCH_TERMS, sections)
 
 def plot_ugc_sources_by_topic_revamped_sankeyplot():
     '''
@@ -351,79 +170,25 @@ def plot_ugc_sources_by_topic_revamped_sankeyplot():
     3.
     :return:
     '''
-    OUTPUT_HTML = './plots/ugc_sources_by_topic_sankeyplot.html'
-    OUTPUT_PNG = './plots/ugc_sources_by_topic_sankeyplot.jpg'
-
     term_citizen_science = 'citizen science'
     top_sources_in_figure = 13 # + citizen science added separatly below
-    def query_extract(query, source):
-        # check if source is from the initial data pool (which was automated) or from the later iterations (webofknowledge) which was manually
-        if source == 'webofknowledge':
-            return query
-        else:
-            # used in map function on np array to extract search query of the paper
-            patter = r'[A-Z]+\({2}(\({0,1}.+)(?=\) AND \(\(citizen science collective sens\*\))'
-            try:
-                match = re.match(patter, query).group(1)
-            except:
-                pass
-            return match
-
-    def check_cs(ugc_form):
-        pattern = r'(citizen|crowed|crowd)'
-        new_source = []
-        for ugc in ugc_form:
-            try:
-                re.search(pattern, ugc, re.IGNORECASE).group(0)
-                new_source.append(term_citizen_science)
-            except Exception as e:
-                new_source.append(ugc)
-        return new_source
-
-    rows = query_result_return(conn, "select ugc_source, sdg from literature where (decision_r_1 = '1' or decision_r_2 = '1') and subtype != 'Review';")
-
-    rows = np.array([[row[0].lower().replace(' ', '').split(';'), row[1]] for row in rows])
-    rows = np.array([[list(map(str.strip, row[0])), row[1]] for row in rows if row[1] is not None])
-    # if citizen science is mentioned in remark or ugc_source it should be homogenised as 'CS' (citizen science)
-    rows = np.array([[check_cs(row[0]), row[1]] for row in rows])
-    rows = fix_different_data_source_names(rows)
-    overall_most_common_ugc_list = [source[0] for source in Counter([item for list_ in rows for item in list_[0]]).most_common(top_sources_in_figure)]
-
-    # add citizen science also to the categories that should appear in the figure if not already present
-    if term_citizen_science not in overall_most_common_ugc_list:
-        overall_most_common_ugc_list += [term_citizen_science]
-
-    df = pd.DataFrame(rows, columns=['ugc_sources', 'target'])
     '''
     some targets will be excluded because they were originally not included in the SLR
     some papers from these targets were only included during the following iterations
     when other relevant reviews were screened
     '''
     targets_to_exclude = ['3.1', '3.2', '3.b', '3.5', '3.a', '3.7', '3.8', '3.c', '3.d']
-    # tuple with ugc source and target as key, value is the recorded count
-    ugc_per_target_dict = defaultdict(lambda: 0)
-    for row_index, row in df.iterrows():
-        # check if ugc source list not empty
-        if row[0]:
-            ugc_sources = row[0]
-            target = row[1]
-            if target not in targets_to_exclude:
-                for ugc_source in ugc_sources:
-                    if ugc_source == 'hardwarezone(forumhosting)':
-                        print('here')
-                        pass
-                    if ugc_source in overall_most_common_ugc_list:
-                        ugc_per_target_dict[(ugc_source, target)] += 1
-                    else:
-                        ugc_per_target_dict[('other', target)] += 1
-
-    # convert final dict to df for further manipulation
-    rows_to_insert_into_df = []
-    for k, v in ugc_per_target_dict.items():
-        row = [k[0], k[1], v]
-        rows_to_insert_into_df.append(row)
-
-    df_final = pd.DataFrame(rows_to_insert_into_df, columns=['ugc_sources', 'target', 'count'])
+    def count_sources():
+        papers = load_included_papers(conn)
+        # one row per ugc source of a paper
+        long = explode_sources(papers[papers['sdg'].notna()], ['sdg'])
+        # citizen science is added to the categories that should appear in the figure if not already present
+        overall_most_common_ugc_list = most_common_sources(long, top_sources_in_figure, always=[term_citizen_science])
+        # count per ugc source and target, sources outside of the most common ones are counted as 'other'
+        long = bucket_sources(long[~long['sdg'].isin(targets_to_exclude)], overall_most_common_ugc_list)
+        return pair_counts(long, ['ugc_source', 'sdg']).rename(columns={'ugc_source': 'ugc_sources', 'sdg': 'target'})
+    df_final = cached_aggregate('ugc_sources_by_topic_sankeyplot', count_sources,
+                                params=[top_sources_in_figure, term_citizen_science, targets_to_exclude])
     # excepted will be terms that were manually added during the iteration of found LR
     # the terms therefore do not originate from the initial scopus api search
     # sort df
@@ -619,13 +384,7 @@ def plot_ugc_sources_by_topic_revamped_sankeyplot():
         tickangle=90,
         ticklabelposition='outside right'
     )
-    fig.show()
-
-    print('saving figures in different formats..')
-    fig.write_html(OUTPUT_HTML)
-    plotly.io.write_image(fig, format='png', file=OUTPUT_PNG, width=1900, height=800, engine='auto')
-    # fig.write_image(OUTPUT_PNG, )
-    # fig.write_image(OUTPUT_SVG )
+    output_figure(fig, 'ugc_sources_by_topic_sankeyplot', width=1900, height=800)
 
 def plot_ugc_sources_by_topic_revamped_stackedbar():
     '''
@@ -642,75 +401,38 @@ def plot_ugc_sources_by_topic_revamped_stackedbar():
     3.
     :return:
     '''
-    OUTPUT_HTML = './plots/ugc_sources_by_topic_stackedbar.html'
-    OUTPUT_PNG = './plots/ugc_sources_by_topic_stackedbar.jpg'
-
     term_citizen_science = 'citizen science'
     top_sources_in_figure = 10 # + citizen science added seperatly below
-    def query_extract(query, source):
-        # check if source is from the initial data pool (which was automated) or from the later iterations (webofknowledge) which was manually
-        if source == 'webofknowledge':
-            return query
-        else:
-            # used in map function on np array to extract search query of the paper
-            patter = r'[A-Z]+\({2}(\({0,1}.+)(?=\) AND \(\(citizen science collective sens\*\))'
-            try:
-                match = re.match(patter, query).group(1)
-            except:
-                pass
-            return match
-
-    def check_cs(source):
-        pattern = r'(citizen|crowed)'
-        new_source = []
-        for element in source:
-            try:
-                re.search(pattern, element, re.IGNORECASE).group(0)
-                new_source.append(term_citizen_science)
-            except Exception as e:
-                new_source.append(element)
-        return new_source
-
-    rows = query_result_return(conn, "select ugc_source, query, source from literature where (decision_r_1 = '1' or decision_r_2 = '1') and subtype != 'Review';")
-
-    rows = np.array([[row[0].lower().replace(' ', '').split(';'), row[1], row[2]] for row in rows])
-    rows = np.array([[list(map(str.strip, row[0])), row[1], row[2]] for row in rows if row[1] is not None])
-    # extract query term which resembles the sdg relevant keyword for which the paper was extracted
-    sdg_terms_of_accepted_papers = np.array([[row[0], query_extract(row[1], row[2])] for row in rows])
-    # if citizen science is mentioned in remark or ugc_source it should be homogeniased as 'CS' (citizen science)
-    sdg_terms_of_accepted_papers = np.array([[check_cs(row[0]), row[1]] for row in sdg_terms_of_accepted_papers])
-    sdg_terms_of_accepted_papers = fix_different_data_source_names(sdg_terms_of_accepted_papers)
-    # just for fetching the overall most common data sources
-    overall_most_common_ugc_list = [source[0] for source in Counter([item for list_ in sdg_terms_of_accepted_papers for item in list_[0]]).most_common(top_sources_in_figure)]
-    # ugc_sources_to_latex(overall_most_common_ugc_list_counter)
-    # add citizen science also to the categories that should appear in the figure if not already present
-    if term_citizen_science not in overall_most_common_ugc_list:
-        overall_most_common_ugc_list += [term_citizen_science]
     '''
-    1. match sdg search terms of accepted papers with the complete list used for querying Scopus and see where gaps exist
+    some targets will be excluded because they were originally not included in the SLR
+    some papers from these targets were only included during the following iterations
+    when other relevant reviews were screened
     '''
-    search_terms_per_target_dict = load_search_terms_per_target()
-    # creates a nested default dictionary
-    papers_per_target = defaultdict(lambda: {'count': 0, 'ugc_sources': []})
-    papers_with_multiple_data_source = 0
-    papers_with_multiple_data_source_list = []
-
-    #papers_per_target = dict.fromkeys(search_terms_per_target_dict.values())
-    for (ugc_sources, term) in sdg_terms_of_accepted_papers:
-        try:
-            target_str = search_terms_per_target_dict[term]
-            #current_count = papers_per_target[target_str]['count']
-            papers_per_target[target_str]['count'] += 1 #
-            current_ugc_sources = papers_per_target[target_str]['ugc_sources']
-            if len(ugc_sources) > 1:
-                papers_with_multiple_data_source += 1
-                papers_with_multiple_data_source_list.append(ugc_sources)
-            papers_per_target[target_str]['ugc_sources'] = current_ugc_sources + ugc_sources
-        except Exception as e:
+    targets_to_exclude = ['3.1', '3.2', '3.3', '3.b', '3.5', '3.a', '3.7', '3.8', '3.c', '3.d']
+    def count_sources():
+        papers = load_included_papers(conn)
+        papers = papers[papers['sdg_term'].notna()]
+        # one row per ugc source of a paper
+        long = explode_sources(papers, ['target'])
+        # just for fetching the overall most common data sources
+        # citizen science is added to the categories that should appear in the figure if not already present
+        overall_most_common_ugc_list = most_common_sources(long, top_sources_in_figure, always=[term_citizen_science])
+        '''
+        1. match sdg search terms of accepted papers with the complete list used for querying Scopus and see where gaps exist
+        '''
+        for term in papers.loc[papers['target'].isna(), 'sdg_term']:
             # excepted will be terms that were manually added during the iteration of found LR
             # the terms therefore do not originate from the initial scopus api search
             print(f'here {term}')
-    print(f'papers with multiple data sources: {papers_with_multiple_data_source}')
+        papers = papers[papers['target'].notna()]
+        print(f"papers with multiple data sources: {(papers['ugc_sources'].map(len) > 1).sum()}")
+        targets = [target for target in papers['target'].drop_duplicates() if target not in targets_to_exclude]
+        # count of every top source per target (also 0) and the 'other' class - data sources that are not in the top X
+        table = crosstab(bucket_sources(long, overall_most_common_ugc_list), 'target', 'ugc_source', index_order=targets,
+                         column_order=overall_most_common_ugc_list + [OTHER])
+        return table.stack().reset_index(name='count').rename(columns={'ugc_source': 'ugc_sources'})
+    df = cached_aggregate('ugc_sources_by_topic_stackedbar', count_sources,
+                          params=[top_sources_in_figure, term_citizen_science, targets_to_exclude])
 
     color_pallet = px.colors.qualitative.Pastel
     step = int(len(color_pallet) / (top_sources_in_figure + 1))
@@ -727,32 +449,6 @@ def plot_ugc_sources_by_topic_revamped_stackedbar():
         'foursquare': color_pallet[9 * step],
         'other': color_pallet[10 * step]
     }
-
-    df = pd.DataFrame(columns=['target', 'ugc_sources', 'count'])
-    # append years and their top ugc sources as rows to df
-    index = 0
-    '''
-    some targets will be excluded because they were originally not included in the SLR
-    some papers from these targets were only included during the following iterations
-    when other relevant reviews were screened
-    '''
-    targets_to_exclude = ['3.1', '3.2', '3.3', '3.b', '3.5', '3.a', '3.7', '3.8', '3.c', '3.d']
-    for target, target_dict in papers_per_target.items():
-        if target not in targets_to_exclude:
-            top_ugc_sources_counter = Counter(target_dict['ugc_sources'])
-            total_ugc_sources_count = len(target_dict['ugc_sources'])
-            total_top_ugc_sources_count = 0
-            for top_source in overall_most_common_ugc_list:
-                top_source_count_in_this_target = top_ugc_sources_counter[top_source]
-                # add it to the total_top_ugc_sources_count to substract it later from the overall total count of ugc sources for the given target
-                total_top_ugc_sources_count += top_source_count_in_this_target
-                row = [target, top_source, top_source_count_in_this_target]  # IMPORTANT: ugc_source is a list, taking only the first element is an approximation
-                df.loc[index] = row
-                index += 1
-            # add the 'other' class to the bar graph - data sources that are not in the top X
-            row = [target, 'other', (total_ugc_sources_count - total_top_ugc_sources_count)]
-            df.loc[index] = row
-            index += 1
     # excepted will be terms that were manually added during the iteration of found LR
     # the terms therefore do not originate from the initial scopus api search
     # sort df
@@ -824,69 +520,35 @@ def plot_ugc_sources_by_topic_revamped_stackedbar():
                     yaxis_title='count'
                     )
     # fig.update_xaxes(categoryorder='category descending')
-    fig.show()
-
-    print('saving figures in different formats..')
-    fig.write_html(OUTPUT_HTML)
-    plotly.io.write_image(fig, format='png', file=OUTPUT_PNG, width=1900, height=800, engine='auto')
-    # fig.write_image(OUTPUT_PNG, )
-    # fig.write_image(OUTPUT_SVG )
+    output_figure(fig, 'ugc_sources_by_topic_stackedbar', width=1900, height=800)
 
 def plot_ugc_sources_by_year():
     '''
     Analyse the temporal change in data sources used, when did new ones emerge, when did they disappear?
     :return:
     '''
-    OUTPUT_HTML = './plots/ugc_sources_by_year_unstacked__.html'
-    OUTPUT_PNG = './plots/ugc_sources_by_year_unstacked__.jpg'
-    OUTPUT_SVG = './plots/ugc_sources_by_year.svg'
-
     term_citizen_science = 'citizen science'
     top_sources_in_figure = 5 # + citizen science added seperatly below
-
-    def query_extract(query, source):
-        # check if source is from the initial data pool (which was automated) or from the later iterations (webofknowledge) which was manually
-        if source == 'webofknowledge':
-            return query
-        else:
-            # used in map function on np array to extract search query of the paper
-            patter = r'[A-Z]+\({2}(\({0,1}.+)(?=\) AND \(\(citizen science collective sens\*\))'
-            try:
-                match = re.match(patter, query).group(1)
-            except:
-                pass
-            return match
-
-    def check_cs(source):
-        pattern = r'citizen'
-        new_source = []
-        for element in source:
-            try:
-                re.search(pattern, element, re.IGNORECASE).group(0)
-                new_source.append(term_citizen_science)
-            except Exception as e:
-                new_source.append(element)
-        return new_source
-
-    rows = query_result_return(conn, "select ugc_source, query, source, date from literature where (decision_r_1 = '1' or decision_r_2 = '1') and subtype != 'Review';")
-    rows = np.array([[row[0].lower().replace(' ', '').split(';'), row[1], row[2], row[3]] for row in rows])
-    rows = np.array([[list(map(str.strip, row[0])), row[1], row[2], row[3]] for row in rows if row[1] is not None])
-    # extract query term which resembles the sdg relevant keyword for which the paper was extracted
-    sdg_terms_of_accepted_papers = np.array([[row[0], query_extract(row[1], row[2]), row[3]] for row in rows])
-    # if citizen science is mentioned in remark or ugc_source it should be homogenised as 'CS' (citizen science)
-    sdg_terms_of_accepted_papers = np.array([[check_cs(row[0]), row[1], row[2].year] for row in sdg_terms_of_accepted_papers if row[2] is not None])
-    sdg_terms_of_accepted_papers = fix_different_data_source_names(sdg_terms_of_accepted_papers)
-    overall_most_common_ugc_list = [source[0] for source in Counter([item for list_ in sdg_terms_of_accepted_papers for item in list_[0]]).most_common(top_sources_in_figure)]
-    # add citizen science if not already among the top x sources
-    if term_citizen_science not in overall_most_common_ugc_list:
-        overall_most_common_ugc_list += [term_citizen_science]
-    # get years
-    years = set([item[2] for item in sdg_terms_of_accepted_papers])
-    ugc_per_year_dict = {}
-    for year in years:
-        ugc_per_year = [item for row in sdg_terms_of_accepted_papers for item in row[0] if row[2] == year]
-        ugc_per_year_counter = Counter(ugc_per_year).most_common(top_sources_in_figure)
-        ugc_per_year_dict[year] = ugc_per_year_counter
+    # years that shall not appear in the figure
+    years_to_skip = [2021]
+    exclude_years_below = 2005
+    def count_sources():
+        papers = load_included_papers(conn)
+        papers = papers[papers['sdg_term'].notna() & papers['year'].notna()]
+        # one row per ugc source of a paper
+        long = explode_sources(papers, ['year'])
+        # add citizen science if not already among the top x sources
+        overall_most_common_ugc_list = most_common_sources(long, top_sources_in_figure, always=[term_citizen_science])
+        years = [year for year in papers['year'].drop_duplicates() if year not in years_to_skip and year >= exclude_years_below]
+        # top x sources per year, the ones that are not among the overall most common sources are summed up as 'other'
+        top_per_year = bucket_sources(top_per_group(long[long['year'].isin(years)], 'year', top_sources_in_figure), overall_most_common_ugc_list)
+        table = top_per_year.pivot_table(index='year', columns='ugc_source', values='count', aggfunc='sum', fill_value=0)
+        table = table.reindex(index=years, columns=overall_most_common_ugc_list + [OTHER], fill_value=0).astype(int)
+        df = table.stack().reset_index(name='count').rename(columns={'ugc_source': 'ugc_sources'})
+        # every year has an 'other' bar, the other sources only appear in the years they are among the top sources
+        return df[(df['count'] > 0) | (df['ugc_sources'] == OTHER)]
+    df = cached_aggregate('ugc_sources_by_year', count_sources, params=[top_sources_in_figure, term_citizen_science,
+                                                                        years_to_skip, exclude_years_below])
 
     color_pallet = px.colors.qualitative.Pastel
     step = int(len(color_pallet) / 6)
@@ -904,32 +566,7 @@ def plot_ugc_sources_by_year():
         }
         return ugc_color_dict
     ugc_source_figure_color_dict = get_ugc_color(1)
-
-    df = pd.DataFrame(columns=['year', 'ugc_sources', 'count', 'color'])
-    # append years and their top ugc sources as rows to df
-    index = 0
-    # years that shall not appear in the figure
-    years_to_skip = [2021]
-    exclude_years_below = 2005
-    for year, ugc_counter in ugc_per_year_dict.items():
-        if year in years_to_skip or year < exclude_years_below:
-            continue
-        other_sources_count = 0
-        other_sources_list = []
-        for ugc_item in ugc_counter:
-            ugc_source = ugc_item[0]
-            ugc_count = ugc_item[1]
-            if ugc_source in overall_most_common_ugc_list:
-                ugc_figure_color = ugc_source_figure_color_dict[ugc_source]
-                row = [year, ugc_source, ugc_count, ugc_figure_color]
-                df.loc[index] = row
-            else:
-                other_sources_count += ugc_count
-                other_sources_list.append(ugc_source)
-            index += 1
-        row = [year, 'other', other_sources_count, ugc_source_figure_color_dict['other']]
-        df.loc[index] = row
-        index += 1
+    df['color'] = df['ugc_sources'].map(ugc_source_figure_color_dict)
     # excepted will be terms that were manually added during the iteration of found LR
     # the terms therefore do not originate from the initial scopus api search
     # sort df
@@ -959,12 +596,7 @@ def plot_ugc_sources_by_year():
 
     # barmode='stack',
     # fig.update_xaxes(categoryorder='category descending')
-    fig.show()
-
-    print('saving figures in different formats..')
-    # fig.write_html(OUTPUT_HTML)
-    # plotly.io.write_image(fig, format='png', file=OUTPUT_PNG, width=1900, height=800, engine='auto')
-    # fig.write_image(OUTPUT_PNG)
+    output_figure(fig, 'ugc_sources_by_year', width=1900, height=800)
 
 def ugc_titles_per_target(TARGET='3.9'):
     '''
@@ -973,33 +605,16 @@ def ugc_titles_per_target(TARGET='3.9'):
 
     :return:
     '''
-    def query_extract(query, source):
-        # check if source is from the initial data pool (which was automated) or from the later iterations (webofknowledge) which was manually
-        if source == 'webofknowledge':
-            return query
-        else:
-            # used in map function on np array to extract search query of the paper
-            patter = r'[A-Z]+\({2}(\({0,1}.+)(?=\) AND \(\(citizen science collective sens\*\))'
-            try:
-                match = re.match(patter, query).group(1)
-            except:
-                return None
-            return match
     PATH = f'./plots/{TARGET.replace(".","_")}_wordcloud.txt'
     target_titles = []
-    rows = query_result_return(conn, "select title, query, source from literature where (decision_r_1 = '1' or decision_r_2 = '1') and subtype != 'Review';")
-    search_terms_per_target_dict = load_search_terms_per_target()
-    sdg_terms_of_accepted_papers = np.array([(row[0], query_extract(row[1], row[2])) for row in rows])
-    # papers_per_target = dict.fromkeys(search_terms_per_target_dict.values()
-    for (title, term) in sdg_terms_of_accepted_papers:
-        try:
-            target_str = search_terms_per_target_dict[term]
-            if target_str == TARGET:
-                target_titles.append(title)
-        except Exception as e:
+    papers = load_included_papers(conn)
+    for (title, term, target_str) in papers[['title', 'sdg_term', 'target']].to_numpy():
+        if pd.isna(target_str):
             # excepted will be terms that were manually added during the iteration of found LR
             # the terms therefore do not originate from the initial scopus api search
             print(f'here {term}')
+        elif target_str == TARGET:
+            target_titles.append(title)
 
     # save to disk
     with open(PATH, 'wt', encoding='utf-8') as f:
@@ -1007,11 +622,11 @@ def ugc_titles_per_target(TARGET='3.9'):
             f.write(f'{title}\n')
 
     print(f'[*] Done. {len(target_titles)} titles under target {TARGET} included.')
-    print(f'[*] total papers: {len(sdg_terms_of_accepted_papers)}')
+    print(f'[*] total papers: {len(papers)}')
 
 def plot_initial_query_treemap():
     # from csv file no_restriciton
-    INPUT_FILE = r"C:\Users\mhartman\PycharmProjects\SLR\treemap_data_no_restrictions.csv"
+    INPUT_FILE = PATH_TREEMAP_ALL_TERMS
 
     labels = []
     values = []
@@ -1044,9 +659,7 @@ def plot_initial_query_treemap():
         font_size=20
     )
 
-    fig.show()
-    fig.write_html(os.path.join(r"C:\Users\mhartman\PycharmProjects\SLR_analysis\final_plots",
-                                "treemap_all_terms.html"))
+    output_figure(fig, 'treemap_all_terms')
 
 
 '''
@@ -1054,7 +667,7 @@ FALSE: SEE reconstruct_initial_corpus_treemap.py for correct treemap of only the
 '''
 def plot_final_query_treemap():
     # from csv file no_restriciton
-    INPUT_FILE = r"C:\Users\mhartman\PycharmProjects\SLR\20200820_treemap_adapted_searchterms_no_abs.csv"
+    INPUT_FILE = PATH_TREEMAP_INCLUDED_TERMS
 
     labels = []
     values = []
@@ -1086,9 +699,7 @@ def plot_final_query_treemap():
         margin=dict(t=50, l=25, r=25, b=25),
         font_size=20
     )
-    fig.show()
-    fig.write_html(os.path.join(r"C:\Users\mhartman\PycharmProjects\SLR_analysis\final_plots",
-                                "treemap_only_included_terms_BUT_FALSE.html"))
+    output_figure(fig, 'treemap_only_included_terms_BUT_FALSE')
 
 
 if __name__ == '__main__':
@@ -1096,3 +707,4 @@ if __name__ == '__main__':
     # plot_initial_query_treemap()
     plot_ugc_sources_by_year()
     # plot_ugc_sources_by_topic_revamped_sankeyplot()
+    close_db()
@@ -0,0 +1,97 @@
+import os
+import sys
+import atexit
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
+from sqlalchemy.orm import close_all_sessions
+'''
+shared database connections of the harvesting (dbclasses.connect_to_db) and analysis (db_querier.connect_db) scripts.
+One pooled engine per database is created on first use and reused by every later call, the ORM sessions and the raw
+psycopg2 connection are both checked out of its pool. Everything is closed by close_db, which runs at the latest when
+the interpreter exits.
+'''
+# connection string of the harvesting database (sqlalchemy format)
+PATH_DATABASE = './database.txt'
+# password of the analysis database, asked for if the file does not exist
+PATH_DB_PASSWORD = './db_password.txt'
+# size of the connection pool per database and connections opened beyond it under load
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+# engines by connection string, created on first use
+ENGINES = {}
+# connection string of the analysis database, built from the password on first use (can be set to another database)
+ANALYSIS_URL = None
+# raw DBAPI connection shared by the analysis queries, created on first use
+RAW_CONNECTION = None
+
+
+def harvest_db_url():
+    with open(PATH_DATABASE, 'rt') as f:
+        return f.readline().strip()
+
+def analysis_db_url():
+    # check if db password file exists, otherwise manual entry
+    if os.path.isfile(PATH_DB_PASSWORD):
+        with open(PATH_DB_PASSWORD, 'r') as f:
+            password = f.read().strip()
+    else:
+        password = input("Input database password: ")
+    return URL.create('postgresql+psycopg2', username='postgres', password=password, host='127.0.0.1', port=5432, database='slr_final')
+
+def get_engine(conn_string):
+    '''
+    :param conn_string: sqlalchemy connection string or URL
+    :return: the pooled engine of this database, created on the first call
+    '''
+    key = str(conn_string)
+    if key not in ENGINES:
+        options = {}
+        if not key.startswith('sqlite'):
+            # pre ping: connections that were closed by the server while idle in the pool are replaced
+            options = {'pool_size': POOL_SIZE, 'max_overflow': MAX_OVERFLOW, 'pool_pre_ping': True}
+        ENGINES[key] = create_engine(conn_string, **options)
+    return ENGINES[key]
+
+def get_analysis_engine():
+    global ANALYSIS_URL
+    if ANALYSIS_URL is None:
+        ANALYSIS_URL = analysis_db_url()
+    return get_engine(ANALYSIS_URL)
+
+def get_raw_connection():
+    '''
+    :return: DBAPI (psycopg2) connection of the analysis database, the same one for every call until close_db
+    '''
+    global RAW_CONNECTION
+    if RAW_CONNECTION is None:
+        try:
+            RAW_CONNECTION = get_analysis_engine().raw_connection()
+            print('[+] Connection established')
+        except Exception as e:
+            print(f"Error {e}. Try again.")
+            sys.exit(1)
+    return RAW_CONNECTION
+
+def close_db():
+    '''
+    close all sessions, return the shared raw connection to its pool and close all pooled connections. The engines
+    stay usable and open new connections when they are used again
+    '''
+    global RAW_CONNECTION
+    close_all_sessions()
+    if RAW_CONNECTION is not None:
+        RAW_CONNECTION.close()
+        RAW_CONNECTION = None
+    for engine in ENGINES.values():
+        engine.dispose()
+
+def reset_after_fork():
+    '''
+    drop the pooled connections inherited from the parent process without closing them, the parent still uses them
+    '''
+    global RAW_CONNECTION
+    RAW_CONNECTION = None
+    for engine in ENGINES.values():
+        engine.dispose(close=False)
+
+atexit.register(close_db)
@@ -1,31 +1,109 @@
-import os
-import sys
-import psycopg2
+import datetime
+import itertools
 import numpy as np
+import pandas as pd
+from db_connection import get_raw_connection
+'''
+query results of the analysis database. Rows are read through a server-side cursor in chunks, so a large result is never
+held as one list of tuples next to its converted copy. query_dataframe and query_arrow return typed columns (dates as
+datetime64, text as string, nullable integers and booleans) on which the analyses can work vectorised.
+'''
+# rows transferred per round trip from the server-side cursor
+CHUNK_SIZE = 10000
+# server-side cursors need unique names, several chunked results can be open on the shared connection at once
+CURSOR_NUMBERS = itertools.count()
 
 
 def connect_db():
-    while True:
-        #check if db password file exists, otherwise manual entry
-        if os.path.isfile('./db_password.txt'):
-            with open('./db_password.txt', 'r') as f:
-                password = f.read()
+    # the connection is shared by all callers and closed by db_connection.close_db
+    return get_raw_connection()
+
+def open_cursor(conn):
+    '''
+    named (server-side) cursor of psycopg2, other DBAPI connections (e.g. sqlite3) fall back to a client-side cursor
+    '''
+    try:
+        return conn.cursor(name=f'query_result_{next(CURSOR_NUMBERS)}')
+    except TypeError:
+        return conn.cursor()
+
+def iter_rows(conn, query, chunksize=CHUNK_SIZE, params=None, yield_empty=False):
+    '''
+    :param yield_empty: yield (column names, []) once if the result has no rows
+    :return: yields (column names, list of at most chunksize row tuples)
+    '''
+    cursor = open_cursor(conn)
+    try:
+        if params is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query, params)
+        empty = True
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows and not (empty and yield_empty):
+                return
+            empty = False
+            yield [description[0] for description in cursor.description], rows
+            if not rows:
+                return
+    except Exception:
+        # the shared connection would stay in the aborted transaction for all following queries
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def column_dtypes(df):
+    '''
+    :param df: DataFrame of the rows as read
+    :return: dict of column name -> dtype (datetime64 if all values are dates, otherwise the dtype of convert_dtypes)
+    '''
+    dtypes = {}
+    for name in df.columns:
+        values = df[name].dropna()
+        if df[name].dtype == object and len(values) and values.map(lambda value: isinstance(value, datetime.date)).all():
+            dtypes[name] = pd.to_datetime(values).dtype
         else:
-            password = input("Input database password: ")
-        try:
-            conn = psycopg2.connect("host=127.0.0.1 dbname=slr_final user=postgres port=5432 password={}".format(password))
-            print('[+] Connection established')
-            return conn
-        except Exception as e:
-            print(f"Error {e}. Try again.")
-            sys.exit(1)
+            dtypes[name] = df[name].convert_dtypes().dtype
+    return dtypes
+
+def typed_chunks(chunks):
+    '''
+    :param chunks: (column names, rows) of iter_rows
+    :return: yields a typed DataFrame per chunk, all with the dtypes of the first chunk (a column without values in the
+             first chunk stays object)
+    '''
+    dtypes = None
+    for columns, rows in chunks:
+        df = pd.DataFrame.from_records(rows, columns=columns)
+        if dtypes is None:
+            dtypes = column_dtypes(df)
+        yield df.astype(dtypes)
+
+def query_dataframe(conn, query, chunksize=None, params=None):
+    '''
+    :param chunksize: None returns the whole result as one DataFrame, otherwise an iterator over DataFrames of at most
+                      chunksize rows is returned (like pandas.read_sql)
+    :return: typed pandas DataFrame(s)
+    '''
+    if chunksize is not None:
+        return typed_chunks(iter_rows(conn, query, chunksize, params))
+    # the chunks are typed once they are joined, so a column that is NULL in one chunk gets the dtype of the others
+    # (an empty result keeps its columns)
+    frames = [pd.DataFrame.from_records(rows, columns=columns) for columns, rows in iter_rows(conn, query, CHUNK_SIZE, params, yield_empty=True)]
+    df = pd.concat(frames, ignore_index=True)
+    return df.astype(column_dtypes(df))
+
+def query_arrow(conn, query, chunksize=CHUNK_SIZE, params=None):
+    '''
+    :return: yields pyarrow.RecordBatch of at most chunksize rows, the column types are inferred per batch
+    '''
+    import pyarrow as pa
+    for columns, rows in iter_rows(conn, query, chunksize, params):
+        yield pa.RecordBatch.from_arrays([pa.array(values) for values in zip(*rows)], names=columns)
 
 def query_result_return(conn, query):
-    with conn.cursor() as cursor:
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        # copy query to CSV output
-        # with open(self.csv_output_path, 'w', encoding='utf-8') as f:
-        #     cursor.copy_expert(outputquery, f)
-        # print("Export file created at: {}".format(self.csv_output_path))
-        return np.array(rows)
\ No newline at end of file
+    # rows as numpy array like the figure scripts expect them, prefer query_dataframe for new analyses
+    rows = [row for columns, chunk in iter_rows(conn, query) for row in chunk]
+    return np.array(rows)
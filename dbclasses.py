@@ -1,7 +1,10 @@
-from sqlalchemy import Column, Integer, Date, String, ForeignKey, Boolean
+import datetime
+from sqlalchemy import Column, Integer, Date, DateTime, String, ForeignKey, Boolean
+from sqlalchemy import insert, select, update, delete, values, column, bindparam, func, and_, exists
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from db_connection import get_engine, harvest_db_url
 
 
 '''
@@ -9,6 +12,8 @@ defined tables for the database: slr
 '''
 
 Base = declarative_base()
+# session factory bound to the shared engine, created by the first connect_to_db
+Session = None
 
 class ScopusEntry(Base):
     # Tell SQLAlchemy what the table name is and if there's any table-specific arguments it should know about
@@ -55,15 +60,354 @@ class ScopusEntry(Base):
         self.decision = decision
 
 
-def connect_to_db():
-    # Create the database
-    with open('./database.txt', 'rt') as f:
-        conn_string = f.readline()
-    engine = create_engine(conn_string)
-    Base.metadata.create_all(engine)
+class HarvestCheckpoint(Base):
+    # journal of finished work units of a harvest run, used to resume interrupted runs
+    __tablename__ = 'harvest_checkpoint'
+    __table_args__ = {'extend_existing': True}
+    run = Column(String, primary_key=True)
+    # '<sdg>|<query>' for a query, '<sdg>|<query>#<start index>' for a result page, the eid for an abstract
+    unit = Column(String, primary_key=True)
+    kind = Column(String)
+    # next cursor of a cursor paginated query
+    cursor = Column(String, default=None)
+    # opensearch:totalResults and opensearch:itemsPerPage of the first page of a query
+    total = Column(Integer, default=None)
+    page_size = Column(Integer, default=None)
+    done = Column(Boolean, default=False)
+    updated = Column(DateTime)
+
+
+class HarvestWatermark(Base):
+    # high-water mark of a query, incremental harvests only request what is new since then
+    __tablename__ = 'harvest_watermark'
+    __table_args__ = {'extend_existing': True}
+    # '<sdg>|<search field>(<query>)' like the query units of harvest_checkpoint
+    unit = Column(String, primary_key=True)
+    # latest prism:coverDate among the results of the query
+    cover_date = Column(Date, default=None)
+    # day the last completed harvest of the query started
+    harvested = Column(Date)
+
 
+class ShardEntry(Base):
+    # staging table of the sharded harvest (see scopus_shards.py), the rows are merged into literature once all shards finished
+    __tablename__ = 'literature_shard'
+    __table_args__ = {'extend_existing': True}
+    # number of the (search field, sdg) shard in the order of the serial query_pipeline
+    shard = Column(Integer, primary_key=True)
+    eid = Column(String, primary_key=True)
+    doi = Column(String)
+    title = Column(String)
+    subtype = Column(String)
+    date = Column(Date)
+    author = Column(String)
+    openaccess = Column(Boolean)
+    publicationname = Column(String)
+    paperurl = Column(String)
+    abstracturl = Column(String)
+    request = Column(String)
+    source = Column(String)
+    searchfield = Column(String)
+    query = Column(String)
+    sdg = Column(String)
+
+
+def connect_to_db():
+    global Session
+    if Session is None:
+        # pooled engine shared with the analysis scripts (see db_connection.py), the tables are created once
+        engine = get_engine(harvest_db_url())
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
     # Create the session
-    session = sessionmaker()
-    session.configure(bind=engine)
-    s = session()
-    return s
\ No newline at end of file
+    return Session()
+
+
+# metadata columns of literature that an upsert overwrites
+UPSERT_COLUMNS = ['doi', 'title', 'subtype', 'date', 'author', 'openaccess', 'publicationname', 'paperurl', 'abstracturl']
+# bound parameters per statement of the multi-row inserts (sqlite builds before 3.32 allow 999)
+MAX_PARAMS = {'postgresql': 32767, 'sqlite': 999}
+
+
+def param_batches(rows, dialect):
+    '''
+    :return: rows split into lists that each bind at most MAX_PARAMS[dialect] parameters as one multi-row statement
+    '''
+    size = max(1, MAX_PARAMS[dialect] // max(len(row) for row in rows))
+    return [rows[start:start + size] for start in range(0, len(rows), size)]
+
+
+class EntryWriter:
+    '''
+    buffers literature rows and writes them with multi-row INSERT ... ON CONFLICT (eid) DO NOTHING statements (as many
+    rows as the parameter limit of the database allows) and one commit per batch instead of one transaction per row. Duplicates are counted from the number of rows the insert actually wrote.
+    With table=ShardEntry.__table__ the rows are written to the staging table of the given shard instead.
+    With upsert the metadata of already stored eids is overwritten (ON CONFLICT (eid) DO UPDATE), e.g. when an article
+    in press got its final cover date. Abstracts, keywords, decisions and the query an article was first found with
+    are kept.
+    '''
+    def __init__(self, session, batch_size=200, table=None, shard=None, upsert=False):
+        self.session = session
+        self.batch_size = batch_size
+        self.table = table if table is not None else ScopusEntry.__table__
+        self.shard = shard
+        self.upsert = upsert
+        self.buffer = {}
+        self.inserted = 0
+        self.updated = 0
+        self.duplicates = 0
+
+    def add(self, fields, request, search_field, query, sdg):
+        row = dict(fields)
+        # the Date column needs date objects on sqlite
+        if isinstance(row['date'], str):
+            row['date'] = datetime.date.fromisoformat(row['date'])
+        row.update({'request': request, 'source': 'scopus', 'searchfield': search_field, 'query': query, 'sdg': sdg})
+        if self.shard is not None:
+            row['shard'] = self.shard
+        if row['eid'] in self.buffer:
+            # duplicate within the same batch, the first occurrence is kept like with the per row commit
+            self.duplicates += 1
+        else:
+            self.buffer[row['eid']] = row
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        write all buffered rows in one statement and commit
+
+        :return: number of rows inserted by this flush
+        '''
+        if not self.buffer:
+            return 0
+        rows = list(self.buffer.values())
+        self.buffer = {}
+        table = self.table
+        key = [c.name for c in table.primary_key]
+        dialect = self.session.get_bind().dialect.name
+        try:
+            if self.upsert:
+                updated = self.upsert_rows(rows, key, dialect)
+                self.session.commit()
+                self.inserted += len(rows) - updated
+                self.updated += updated
+                return len(rows) - updated
+            if dialect in ('postgresql', 'sqlite'):
+                dialect_insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+                inserted = 0
+                for batch in param_batches(rows, dialect):
+                    result = self.session.execute(dialect_insert(table).values(batch).on_conflict_do_nothing(index_elements=key))
+                    inserted += result.rowcount
+            else:
+                # generic fallback: skip existing eids and insert the rest with executemany
+                existing = self.existing_eids(rows)
+                rows_to_insert = [row for row in rows if row['eid'] not in existing]
+                if rows_to_insert:
+                    self.session.execute(insert(table), rows_to_insert)
+                inserted = len(rows_to_insert)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        self.inserted += inserted
+        self.duplicates += len(rows) - inserted
+        return inserted
+
+    def existing_eids(self, rows):
+        query = select(self.table.c.eid).where(self.table.c.eid.in_([row['eid'] for row in rows]))
+        if self.shard is not None:
+            query = query.where(self.table.c.shard == self.shard)
+        return set(self.session.execute(query).scalars())
+
+    def upsert_rows(self, rows, key, dialect):
+        '''
+        :return: number of rows that updated an existing eid
+        '''
+        table = self.table
+        existing = self.existing_eids(rows)
+        if dialect in ('postgresql', 'sqlite'):
+            for batch in param_batches(rows, dialect):
+                statement = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table).values(batch)
+                statement = statement.on_conflict_do_update(index_elements=key, set_={name: statement.excluded[name] for name in UPSERT_COLUMNS})
+                self.session.execute(statement)
+        else:
+            rows_to_insert = [row for row in rows if row['eid'] not in existing]
+            if rows_to_insert:
+                self.session.execute(insert(table), rows_to_insert)
+            rows_to_update = [{'b_eid': row['eid'], **{f'b_{name}': row[name] for name in UPSERT_COLUMNS}} for row in rows if row['eid'] in existing]
+            if rows_to_update:
+                self.session.execute(update(table).
+                                     where(table.c.eid == bindparam('b_eid')).
+                                     values({name: bindparam(f'b_{name}') for name in UPSERT_COLUMNS}),
+                                     rows_to_update)
+        return len(existing)
+
+
+class CheckpointJournal:
+    '''
+    records finished work units (queries, result pages, abstracts) of a run in the harvest_checkpoint table, so that a
+    crashed or quota limited run can be resumed without repeating api calls
+    '''
+    def __init__(self, session, run):
+        self.session = session
+        self.run = run
+        self.units = {row.unit: row for row in session.query(HarvestCheckpoint).filter(HarvestCheckpoint.run == run)}
+
+    def get(self, unit):
+        return self.units.get(unit)
+
+    def is_done(self, unit):
+        row = self.units.get(unit)
+        return row is not None and row.done
+
+    def done_units(self, kind):
+        return set(unit for unit, row in self.units.items() if row.kind == kind and row.done)
+
+    def record(self, unit, kind, done=False, cursor=None, total=None, page_size=None, commit=True):
+        row = self.units.get(unit)
+        if row is None:
+            row = HarvestCheckpoint(run=self.run, unit=unit, kind=kind)
+            self.session.add(row)
+            self.units[unit] = row
+        row.done = done
+        row.cursor = cursor
+        if total is not None:
+            row.total = total
+        if page_size is not None:
+            row.page_size = page_size
+        row.updated = datetime.datetime.now()
+        if commit:
+            self.session.commit()
+
+    def reset(self):
+        # forget all units of this run, the next run starts from the beginning
+        self.session.query(HarvestCheckpoint).filter(HarvestCheckpoint.run == self.run).delete()
+        self.session.commit()
+        self.units = {}
+
+
+def iter_chunks(query, key, chunk_size=1000):
+    '''
+    iterate over the rows of a query in chunks, ordered by the unique column key (keyset pagination). Only one chunk is
+    held in memory and no cursor stays open between the chunks, so the session can commit updates of the scanned rows
+    while iterating
+
+    :param query: orm query that selects key
+    :param key: unique column, e.g. ScopusEntry.eid
+    :return: yields lists of at most chunk_size rows
+    '''
+    last = None
+    while True:
+        chunk_query = query
+        if last is not None:
+            chunk_query = chunk_query.filter(key > last)
+        chunk = chunk_query.order_by(key).limit(chunk_size).all()
+        if not chunk:
+            return
+        yield chunk
+        last = getattr(chunk[-1], key.key)
+
+
+class WatermarkStore:
+    '''
+    per query high-water marks of the harvest_watermark table
+    '''
+    def __init__(self, session):
+        self.session = session
+        self.units = {row.unit: row for row in session.query(HarvestWatermark)}
+
+    def get(self, unit):
+        return self.units.get(unit)
+
+    def record(self, unit, cover_date, harvested):
+        '''
+        :param cover_date: latest cover date seen by this harvest of the query, the mark never moves backwards
+        :param harvested: day the harvest started
+        '''
+        row = self.units.get(unit)
+        if row is None:
+            row = HarvestWatermark(unit=unit)
+            self.session.add(row)
+            self.units[unit] = row
+        if isinstance(cover_date, str):
+            cover_date = datetime.date.fromisoformat(cover_date)
+        if row.cover_date is None or (cover_date is not None and cover_date > row.cover_date):
+            row.cover_date = cover_date
+        row.harvested = harvested
+        self.session.commit()
+
+
+class DeferredWatermarks(WatermarkStore):
+    '''
+    reads the marks of the harvest_watermark table but only collects the new ones in pending, e.g. until the staged rows
+    of a sharded harvest are merged into literature
+    '''
+    def __init__(self, session):
+        super().__init__(session)
+        self.pending = []
+
+    def record(self, unit, cover_date, harvested):
+        self.pending.append((unit, cover_date, harvested))
+
+
+def update_abstracts(session, rows):
+    '''
+    write abstracts and keywords of many articles with a single UPDATE statement and commit
+
+    :param rows: list of dictionaries with the keys eid, abstract and keywords
+    '''
+    if not rows:
+        return
+    table = ScopusEntry.__table__
+    if session.get_bind().dialect.name == 'postgresql':
+        # UPDATE literature SET ... FROM (VALUES (...), (...)) AS new WHERE literature.eid = new.eid
+        new = values(column('eid', String), column('abstract', String), column('keywords', String), name='new'). \
+            data([(row['eid'], row['abstract'], row['keywords']) for row in rows])
+        session.execute(update(table).
+                        where(table.c.eid == new.c.eid).
+                        values(abstract=new.c.abstract, keywords=new.c.keywords))
+    else:
+        # one statement executed for all parameter sets (executemany)
+        session.execute(update(table).
+                        where(table.c.eid == bindparam('b_eid')).
+                        values(abstract=bindparam('b_abstract'), keywords=bindparam('b_keywords')),
+                        [{'b_eid': row['eid'], 'b_abstract': row['abstract'], 'b_keywords': row['keywords']} for row in rows])
+    session.commit()
+
+
+def merge_shards(session, upsert=False):
+    '''
+    move the rows of a sharded harvest from literature_shard into literature. An eid found by several shards is taken
+    from the shard with the lowest number, i.e. the row the serial query_pipeline would have kept. Eids that are
+    already in literature are not touched, unless upsert overwrites their metadata (see EntryWriter)
+
+    :return: (inserted, updated, duplicates) rows written to literature, rows of literature that were updated and
+             staged rows that were dropped as duplicates
+    '''
+    shard_table = ShardEntry.__table__
+    table = ScopusEntry.__table__
+    columns = [c.name for c in shard_table.columns if c.name != 'shard']
+    first = select(shard_table.c.eid, func.min(shard_table.c.shard).label('shard')).group_by(shard_table.c.eid).subquery()
+    rows = select(*[shard_table.c[name] for name in columns]) \
+        .select_from(shard_table.join(first, and_(shard_table.c.eid == first.c.eid, shard_table.c.shard == first.c.shard)))
+    stored = exists().where(table.c.eid == shard_table.c.eid)
+    try:
+        staged = session.execute(select(func.count()).select_from(shard_table)).scalar()
+        updated = 0
+        if upsert:
+            rows_to_update = [{'b_eid': row['eid'], **{f'b_{name}': row[name] for name in UPSERT_COLUMNS}}
+                              for row in session.execute(rows.where(stored)).mappings()]
+            if rows_to_update:
+                session.execute(update(table).
+                                where(table.c.eid == bindparam('b_eid')).
+                                values({name: bindparam(f'b_{name}') for name in UPSERT_COLUMNS}),
+                                rows_to_update)
+            updated = len(rows_to_update)
+        inserted = session.execute(insert(table).from_select(columns, rows.where(~stored))).rowcount
+        session.execute(delete(shard_table))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return inserted, updated, staged - inserted - updated
@@ -1,11 +1,13 @@
 from db_querier import connect_db
 from db_querier import query_result_return
-from create_figures import load_search_terms_per_target
+from db_connection import close_db
+from included_papers import load_included_papers
+from figure_aggregations import dpsir_classes
+from figure_output import output_figure, output_matplotlib
+from figure_cache import cached_aggregate
 from collections import Counter
 import matplotlib.pyplot as plt
 import numpy as np
-import re
-import os
 import pandas as pd
 from collections import defaultdict
 # plotting
@@ -16,6 +18,11 @@ import plotly.graph_objs as go
 DPSIR classification was conducted for all included papers
 Study area and author origin was only annotated for included citizen science projects
 '''
+# author and study area countries of the annotated citizen science projects
+STUDY_COUNTRY_QUERY = """select author_country_list, study_area_country
+                         from literature
+                         where study_area_country is not null;"""
+
 def DPSIR_per_paper_type_sankeyplot():
     '''
     REVAMPTED:
@@ -28,47 +35,16 @@ def DPSIR_per_paper_type_sankeyplot():
 
     :return:
     '''
-    OUTPUT_HTML = './plots/ugc_sources_by_topic.html'
-    OUTPUT_PNG = './plots/ugc_sources_by_topic.jpg'
-    OUTPUT_SVG = './plots/ugc_sources_by_topic.svg'
-
     term_citizen_science = 'citizen science'
     top_sources_in_figure = 10  # + citizen science added separately below
 
-    def query_extract(query, source):
-        # check if source is from the initial data pool (which was automated) or from the later iterations (webofknowledge) which was manually
-        if source == 'webofknowledge':
-            return query
-        else:
-            # used in map function on np array to extract search query of the paper
-            patter = r'[A-Z]+\({2}(\({0,1}.+)(?=\) AND \(\(citizen science collective sens\*\))'
-            try:
-                match = re.match(patter, query).group(1)
-            except:
-                pass
-            return match
-
-    def check_cs(source):
-        pattern = r'(citizen|crowed|crowd)'
-        new_source = []
-        for element in source:
-            try:
-                re.search(pattern, element, re.IGNORECASE).group(0)
-                new_source.append(term_citizen_science)
-            except Exception as e:
-                new_source.append(element)
-        return new_source
-
-    conn = connect_db()
-    rows = query_result_return(conn, "select dpsir, sdg from literature where (decision_r_1 = '1' or decision_r_2 = '1') and subtype != 'Review' and dpsir is not Null;")
-    # add in the query above directly the 'sdg' column instead of recreating it here!!
-
-    # convert nparray into df
-    df = pd.DataFrame(rows, columns=['dpsir', 'topic'])
-    # drop dk dpsir classifications
-    df = df.drop(df[df.dpsir == 'dk'].index)
-    # make DPSIR upper case
-    df['dpsir'] = df['dpsir'].apply(lambda x: x.upper())
+    def count_classes():
+        papers = load_included_papers(connect_db())
+        # upper case DPSIR class and sdg of the papers, dk (don't know) classifications are dropped
+        df = dpsir_classes(papers, 'sdg').rename(columns={'sdg': 'topic'})
+        # papers per topic and DPSIR class
+        return df.groupby(['topic', 'dpsir']).size().reset_index(name='count')
+    counts = cached_aggregate('dpsir_by_paper_topic_sankeyplot', count_classes).set_index(['topic', 'dpsir'])['count']
     # link target names to topic names
     target_name_dict = {
         '11.1': 'urban inequality',
@@ -110,19 +86,15 @@ def DPSIR_per_paper_type_sankeyplot():
     link_sources = []
     link_targets = []
     link_values = []
-    for topic_index, topic in enumerate(topics):
-        for index, (label, label_df) in enumerate(df.groupby('topic')):
-            if label == topic:
-                label_df_grouped = label_df.groupby('dpsir').count()
-                # only include topics with total count of X or greater
-                # if label_df_grouped["topic"].sum() >= 20: # redundant since only labels are included that alread fulful this condition (here for legibility)
-                #iterate over rows
-                for dpsir, row in label_df_grouped.iterrows():
-                    link_sources.append(node_labels.index(topic))
-                    link_targets.append(node_labels.index(dpsir))
-                    link_values.append(row[0])
-                    # color based on link source
-                    link_colors.append(node_colors[node_labels.index(topic)])
+    for topic in topics:
+        if topic not in counts.index:
+            continue
+        for dpsir, count in counts[topic].items():
+            link_sources.append(node_labels.index(topic))
+            link_targets.append(node_labels.index(dpsir))
+            link_values.append(count)
+            # color based on link source
+            link_colors.append(node_colors[node_labels.index(topic)])
 
     # adapt node labels for visualisation
     node_labels = [f'{target_name_dict[e]} ({e})' if e in target_name_dict.keys() else e for e in node_labels]
@@ -143,8 +115,7 @@ def DPSIR_per_paper_type_sankeyplot():
         ))])
 
     fig.update_layout(font_size=20) # title_text="Attribution of top 5 SDG topic related publications by DPSIR framework"
-    fig.show()
-    fig.write_html(os.path.join(r"C:\Users\mhartman\PycharmProjects\SLR_analysis\dpsir_plots", "dpsir_by_paper_topic_sankeyplot.html"))
+    output_figure(fig, 'dpsir_by_paper_topic_sankeyplot')
 
 
 
@@ -160,54 +131,16 @@ def DPSIR_per_paper_type_stackedbar():
 
     :return:
     '''
-    OUTPUT_HTML = './plots/ugc_sources_by_topic.html'
-    OUTPUT_PNG = './plots/ugc_sources_by_topic.jpg'
-    OUTPUT_SVG = './plots/ugc_sources_by_topic.svg'
-
     term_citizen_science = 'citizen science'
     top_sources_in_figure = 10  # + citizen science added seperatly below
 
-    def query_extract(query, source):
-        # check if source is from the initial data pool (which was automated) or from the later iterations (webofknowledge) which was manually
-        if source == 'webofknowledge':
-            return query
-        else:
-            # used in map function on np array to extract search query of the paper
-            patter = r'[A-Z]+\({2}(\({0,1}.+)(?=\) AND \(\(citizen science collective sens\*\))'
-            try:
-                match = re.match(patter, query).group(1)
-            except:
-                pass
-            return match
-
-    def check_cs(source):
-        pattern = r'(citizen|crowed)'
-        new_source = []
-        for element in source:
-            try:
-                re.search(pattern, element, re.IGNORECASE).group(0)
-                new_source.append(term_citizen_science)
-            except Exception as e:
-                new_source.append(element)
-        return new_source
-
-    conn = connect_db()
-    rows = query_result_return(conn, "select dpsir, query, source from literature where (decision_r_1 = '1' or decision_r_2 = '1') and subtype != 'Review' and DPSIR is not Null;")
-
-    rows = np.array([[row[0].lower().replace(' ', '').split(';'), row[1], row[2]] for row in rows])
-    rows = np.array([[list(map(str.strip, row[0])), row[1], row[2]] for row in rows if row[1] is not None])
-    # extract query term which resembles the sdg relevant keyword for which the paper was extracted
-    dpsir_with_query = np.array([[row[0][0], query_extract(row[1], row[2])] for row in rows])
-    # import sdg target search terms that were used for the SLR
-    search_terms_per_target_dict = load_search_terms_per_target()
-    dpsir_with_target = np.array([[row[0], search_terms_per_target_dict[row[1]]] for row in dpsir_with_query])
-
-    # convert nparray into df
-    df = pd.DataFrame(dpsir_with_target, columns=['dpsir', 'topic'])
-    # drop dk dpsir classifications
-    df = df.drop(df[df.dpsir == 'dk'].index)
-    # make DPSIR upper case
-    df['dpsir'] = df['dpsir'].apply(lambda x: x.upper())
+    def count_classes():
+        papers = load_included_papers(connect_db())
+        # first (upper case) DPSIR class of the paper with the sdg target of its search term, dk classifications are dropped
+        df = dpsir_classes(papers, 'target', first_only=True).rename(columns={'target': 'topic'})
+        # papers per topic and DPSIR class
+        return df.groupby(['topic', 'dpsir']).size().reset_index(name='count')
+    counts = cached_aggregate('dpsir_by_paper_topic_stackedbar', count_classes).set_index(['topic', 'dpsir'])['count']
     # link target names to topic names
     target_name_dict = {
         '11.1': 'urban inequality',
@@ -232,15 +165,15 @@ def DPSIR_per_paper_type_stackedbar():
     fig = go.Figure()
     order = ['11.5', '3.9', '11.3', '11.7', '3.3']
     total_count = 0
-    for item in order:
-        for index, (label, label_df) in enumerate(df.groupby('topic')):
-            if label == item:
-                label_df_grouped = label_df.groupby('dpsir').count()
-                # only include topics with total count of X or greater
-                if label_df_grouped["topic"].sum() >= 20:
-                    fig.add_trace(go.Bar(x=label_df_grouped.index.values, y=label_df_grouped['topic'], name=target_name_dict[label] + f' ({label})'))
-                    print(f'[*] topic: {label}, count: {label_df_grouped["topic"].sum()}')
-                    total_count += label_df_grouped["topic"].sum()
+    for label in order:
+        if label not in counts.index:
+            continue
+        label_counts = counts[label]
+        # only include topics with total count of X or greater
+        if label_counts.sum() >= 20:
+            fig.add_trace(go.Bar(x=label_counts.index.values, y=label_counts.values, name=target_name_dict[label] + f' ({label})'))
+            print(f'[*] topic: {label}, count: {label_counts.sum()}')
+            total_count += label_counts.sum()
     print(f'[*] total_count: {total_count}')
     # change layout to descending order
     fig.update_layout(barmode='stack',
@@ -254,8 +187,7 @@ def DPSIR_per_paper_type_stackedbar():
                           x=0.01
                       ))
 
-    fig.show()
-    fig.write_html(os.path.join(r"C:\Users\mhartman\PycharmProjects\SLR_analysis\dpsir_plots", "dpsir_by_paper_topic_stackedbar.html"))
+    output_figure(fig, 'dpsir_by_paper_topic_stackedbar')
 
 
 def study_country_with_match_no_match_dist():
@@ -270,12 +202,8 @@ def study_country_with_match_no_match_dist():
 
     # taken from author origin - study origin match code
 
-    query = """select author_country_list, study_area_country  
-                                from literature 
-                                where study_area_country is not null;"""
-
     conn = connect_db()
-    results = query_result_return(conn, query)
+    results = query_result_return(conn, STUDY_COUNTRY_QUERY)
 
     # take care of UK, if both countries compared are in here, its a match
     UK_list = ['UK', 'England', 'Wales', 'Ireland', 'Scotland']
@@ -351,11 +279,7 @@ def study_country_with_match_no_match_dist():
                           xanchor="right",
                           x=0.99
                       ))
-    fig.show()
-    # fig.write_html(os.path.join(r"C:\Users\mhartman\PycharmProjects\SLR_analysis\final_plots",
-    #                             "continent_w_author_match.html"))
-    fig.write_image(os.path.join(r"C:\Users\mhartman\PycharmProjects\SLR_analysis\final_plots",
-                                "continent_w_author_match.jpg"))
+    output_figure(fig, 'continent_w_author_match')
 
 
 def author_country_study_country_rel():
@@ -370,12 +294,8 @@ def author_country_study_country_rel():
     :return:
     '''
 
-    query = """select author_country_list, study_area_country  
-                            from literature 
-                            where study_area_country is not null;"""
-
     conn = connect_db()
-    results = query_result_return(conn, query)
+    results = query_result_return(conn, STUDY_COUNTRY_QUERY)
 
     total_match = 0
     total_no_match = 0
@@ -418,9 +338,10 @@ def author_country_study_country_rel():
     print(f'[*] match: {total_match}\n no match: {total_no_match}\n     global: {global_}')
 
     # plot bars in stack manner
+    fig = plt.figure()
     plt.bar(['match', 'no match'], [total_match, total_no_match], color='r')
     plt.ylabel('count')
-    plt.show()
+    output_matplotlib(fig, 'author_study_country_match')
 
 def dpsir_twitter_vs_cs():
     '''
@@ -431,21 +352,12 @@ def dpsir_twitter_vs_cs():
 
     :return:
     '''
-    twitter_dpsir_query = """select dpsir 
-                                from literature 
-                                where (decision_r_1 = '1' or decision_r_2 = '1') 
-                                and subtype != 'Review' 
-                                and ugc_source ilike '%twitter%'
-                                and dpsir is not NULL;"""
-    cs_dpsir_query = """select dpsir 
-                                from literature 
-                                where (decision_r_1 = '1' or decision_r_2 = '1') 
-                                and subtype != 'Review' 
-                                and (ugc_source ilike '%citizen%' or ugc_source ilike '%crowd%')
-                                and dpsir is not NULL;"""
     conn = connect_db()
-    twitter_results = query_result_return(conn, twitter_dpsir_query)
-    cs_results = query_result_return(conn, cs_dpsir_query)
+    papers = load_included_papers(conn)
+    papers = papers[papers['dpsir'].notna()]
+    # ugc sources are canonical, e.g. every crowd sourced or citizen science project is 'citizen science'
+    twitter_results = papers.loc[papers['ugc_sources'].map(lambda sources: 'twitter' in sources), 'dpsir'].to_numpy()
+    cs_results = papers.loc[papers['ugc_sources'].map(lambda sources: 'citizen science' in sources), 'dpsir'].to_numpy()
     twitter_c = Counter(twitter_results.flatten())
     cs_c = Counter(cs_results.flatten())
     # plot stacked bar plot on relative numbers of DPSIR contributions, not considering 'dont know' classifications
@@ -480,11 +392,12 @@ def dpsir_twitter_vs_cs():
     # ax.set_xticklabels(x_labels)
     labels = [item.get_text() for item in ax.get_xticklabels()]
     print(labels)
-    plt.show()
+    output_matplotlib(fig, 'dpsir_twitter_vs_cs')
 
 
 
 if __name__ == '__main__':
     # dpsir_twitter_vs_cs()
     study_country_with_match_no_match_dist()
-    # DPSIR_per_paper_type_sankeyplot()
\ No newline at end of file
+    # DPSIR_per_paper_type_sankeyplot()
+    close_db()
\ No newline at end of file
@@ -0,0 +1,76 @@
+import pandas as pd
+from ugc_sources import TERM_CITIZEN_SCIENCE
+'''
+count tables of the included papers (see included_papers.load_included_papers) for the figures. The ugc source lists
+are exploded once into one row per (paper, ugc source) and counted with groupby/crosstab, sources outside the most
+common ones are counted as 'other'. Counts keep the order in which the keys first appear in the papers, like the
+Counters and dicts the figure functions used before.
+'''
+OTHER = 'other'
+
+
+def explode_sources(papers, columns):
+    '''
+    :param papers: DataFrame with a 'ugc_sources' column of lists
+    :param columns: columns of the paper to keep next to each source
+    :return: DataFrame with one row per ugc source of a paper ('ugc_source' column), papers without source are dropped
+    '''
+    long = papers[['ugc_sources'] + list(columns)].explode('ugc_sources').rename(columns={'ugc_sources': 'ugc_source'})
+    return long[long['ugc_source'].notna()]
+
+def most_common_sources(long, n, always=(TERM_CITIZEN_SCIENCE,)):
+    '''
+    :return: the n most common ugc sources (ties in order of first appearance, like Counter.most_common) followed by
+             the sources of always that are not among them
+    '''
+    counts = long.groupby('ugc_source', sort=False).size().sort_values(ascending=False, kind='stable')
+    top = list(counts.index[:n])
+    return top + [source for source in always if source not in top]
+
+def bucket_sources(long, top):
+    '''
+    :return: copy of long whose sources outside of top are replaced by 'other'
+    '''
+    long = long.copy()
+    long['ugc_source'] = long['ugc_source'].where(long['ugc_source'].isin(top), OTHER)
+    return long
+
+def pair_counts(long, columns):
+    '''
+    :return: DataFrame of the distinct value combinations of columns with their 'count', in order of first appearance
+    '''
+    return long.groupby(list(columns), sort=False).size().reset_index(name='count')
+
+def crosstab(long, index, columns, index_order=None, column_order=None):
+    '''
+    :param index_order: row labels of the table (missing combinations are 0), defaults to the order of first appearance
+    :param column_order: column labels of the table, defaults to the order of first appearance
+    :return: DataFrame with the number of rows per index x columns value
+    '''
+    table = long.groupby([index, columns], sort=False).size().unstack(fill_value=0)
+    if index_order is None:
+        index_order = long[index].drop_duplicates()
+    if column_order is None:
+        column_order = long[columns].drop_duplicates()
+    return table.reindex(index=list(index_order), columns=list(column_order), fill_value=0).astype(int)
+
+def top_per_group(long, group, n):
+    '''
+    :return: pair counts of group x ugc source restricted to the n most common sources per group value (ties in order
+             of first appearance)
+    '''
+    counts = pair_counts(long, [group, 'ugc_source'])
+    return counts.sort_values('count', ascending=False, kind='stable').groupby(group, sort=False).head(n)
+
+def dpsir_classes(papers, column, first_only=False):
+    '''
+    :param first_only: only keep the first of several ';' separated DPSIR classes of a paper
+    :return: DataFrame with the upper case 'dpsir' class and the column of each paper, 'dk' (don't know) is dropped
+    '''
+    dpsir = papers['dpsir']
+    if first_only:
+        dpsir = dpsir.str.lower().str.replace(' ', '', regex=False).str.split(';').str[0]
+    classes = pd.DataFrame({'dpsir': dpsir, column: papers[column]}).dropna()
+    classes = classes[classes['dpsir'] != 'dk']
+    classes['dpsir'] = classes['dpsir'].str.upper()
+    return classes
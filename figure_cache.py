@@ -0,0 +1,127 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+import inspect
+import pandas as pd
+import figure_output
+import figure_aggregations
+from db_querier import connect_db
+from included_papers import load_included_papers
+from ugc_sources import UGC_ALIASES
+'''
+build cache of the headless renderer (render_figures.py). Every figure is fingerprinted by its inputs: the hash of the
+sql results it is built from, the modification time of the files it reads (search term file, treemap csvs), the ugc
+alias table and its style (source code of the module of the plot function with its helpers and layout constants, of
+figure_output.py, output formats, image size and output directory). A figure is only rendered again if its fingerprint
+changed since its outputs were written, or if one of the outputs is missing.
+
+The count tables of the figures are stored as Parquet files (cached_aggregate) keyed by their data inputs and the code
+computing them only, so a figure whose styling changed is re-rendered from the stored counts without querying and
+aggregating the papers again. Interactive runs of the figure scripts do not use the cache (ENABLED).
+'''
+CACHE_DIR = './figure_cache'
+MANIFEST_FILE = 'manifest.json'
+# set by render_figures.py
+ENABLED = False
+# name -> function(conn) returning the sql result of a data source as DataFrame
+DATA_SOURCES = {
+    'included_papers': load_included_papers,
+}
+# hash of each data source, its query is only run once per process
+RESULT_HASHES = {}
+
+
+def fingerprint(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str, sort_keys=True).encode('utf-8')).hexdigest()
+
+def frame_hash(frame):
+    '''
+    :return: hash of the column names and values of the DataFrame
+    '''
+    # lists (ugc_sources) and mixed values are hashed by their text
+    text_columns = {column: str for column in frame.columns if frame[column].dtype == object}
+    values = pd.util.hash_pandas_object(frame.astype(text_columns), index=False).to_numpy()
+    return fingerprint(list(frame.columns), hashlib.sha256(values.tobytes()).hexdigest())
+
+def result_hash(source):
+    '''
+    :param source: key of DATA_SOURCES
+    '''
+    if source not in RESULT_HASHES:
+        RESULT_HASHES[source] = frame_hash(DATA_SOURCES[source](connect_db()))
+    return RESULT_HASHES[source]
+
+def file_stamp(path):
+    if not os.path.isfile(path):
+        return (path, None)
+    return (path, os.path.getmtime(path))
+
+def data_fingerprint(sources, files, params=None):
+    '''
+    fingerprint of the data inputs of a figure or aggregate: sql results, files, ugc alias table, aggregation code and
+    parameters
+    '''
+    return fingerprint([result_hash(source) for source in sources], [file_stamp(path) for path in files], UGC_ALIASES,
+                       inspect.getsource(figure_aggregations), params)
+
+def figure_fingerprint(function, sources, files):
+    '''
+    :param function: plot function of the figure, the source code of its module holds the style parameters and the
+                     helpers it calls
+    '''
+    # outputs written to another directory do not make the figure current
+    return fingerprint(data_fingerprint(sources, files), inspect.getsource(inspect.getmodule(function)),
+                       inspect.getsource(figure_output), figure_output.FORMATS, figure_output.IMAGE_WIDTH,
+                       figure_output.IMAGE_HEIGHT, os.path.abspath(figure_output.OUTPUT_DIR))
+
+def load_manifest():
+    '''
+    :return: dict of figure name -> {'fingerprint': ..., 'outputs': [paths written by the figure]}
+    '''
+    path = os.path.join(CACHE_DIR, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CACHE_DIR, MANIFEST_FILE), 'wt', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+def is_current(manifest, name, figure_fingerprint):
+    '''
+    :return: True if the figure was rendered with this fingerprint and all its outputs still exist
+    '''
+    entry = manifest.get(name)
+    if entry is None or entry['fingerprint'] != figure_fingerprint:
+        return False
+    return len(entry['outputs']) > 0 and all(os.path.isfile(path) for path in entry['outputs'])
+
+def cached_aggregate(name, build, params=None, sources=('included_papers',), files=()):
+    '''
+    :param name: name of the aggregate (file name in CACHE_DIR)
+    :param build: function computing the aggregate as DataFrame from the data sources (its source code is part of the
+                  fingerprint)
+    :param params: parameters of the aggregation (part of the fingerprint)
+    :return: the aggregate, read from its Parquet file if the data inputs and build did not change
+    '''
+    if not ENABLED:
+        return build()
+    key = fingerprint(data_fingerprint(sources, files, params), inspect.getsource(build))[:16]
+    path = os.path.join(CACHE_DIR, f'{name}-{key}.parquet')
+    if os.path.isfile(path):
+        return pd.read_parquet(path)
+    aggregate = build()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # aggregates of older inputs are not needed anymore
+    for old_path in glob.glob(os.path.join(CACHE_DIR, f'{name}-*.parquet')):
+        os.remove(old_path)
+    aggregate.to_parquet(path)
+    return aggregate
+
+def clear_cache():
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    RESULT_HASHES.clear()
@@ -0,0 +1,112 @@
+import os
+from multiprocessing import util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import plotly.io as pio
+'''
+where and how the figures of create_figures.py and dpsir_analysis.py are written. Interactive runs of the scripts show
+every figure and write it as html to OUTPUT_DIR. The headless renderer (render_figures.py) turns SHOW off, sets the
+formats and exports the images through a pool of processes. Each of them runs a Kaleido sync server (Kaleido v1 starts
+and closes a Chromium for every export otherwise) that is kept between its exports and closed when the pool shuts down,
+so the slow image exports of a figure set run in parallel while the next figures are built.
+'''
+OUTPUT_DIR = './plots'
+# html and any image format of plotly.io.write_image (png, jpg, svg, pdf, ...)
+FORMATS = ['html']
+# open every figure in the browser / matplotlib window
+SHOW = True
+# default size of exported plotly images in pixels
+IMAGE_WIDTH = 1900
+IMAGE_HEIGHT = 800
+# pool of the image exports (see start_export_pool), None exports in the calling process
+EXPORT_POOL = None
+# (path, future) of the exports submitted to the pool
+PENDING = []
+# paths of all files written (or submitted to the pool), the build cache records them per figure
+WRITTEN = []
+
+
+def figure_path(name, extension):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    return os.path.join(OUTPUT_DIR, f'{name}.{extension}')
+
+def start_kaleido():
+    '''
+    initializer of the export pool: starts the Chromium of this worker once, the exports of plotly.io use it while it
+    runs. A failing start breaks the pool, wait_for_exports then reports every export as failed
+    '''
+    import kaleido
+    kaleido.start_sync_server(silence_warnings=True)
+    # pool workers exit without running atexit, the finalizers of multiprocessing are run
+    util.Finalize(None, kaleido.stop_sync_server, exitpriority=10)
+
+def export_image(figure_json, path, format, width, height):
+    pio.write_image(pio.from_json(figure_json), path, format=format, width=width, height=height)
+    return path
+
+def start_export_pool(max_workers=None):
+    '''
+    export the images of the following output_figure calls in max_workers processes (one per core by default)
+    '''
+    global EXPORT_POOL
+    # fail here instead of in every export if Kaleido is missing
+    import kaleido
+    EXPORT_POOL = ProcessPoolExecutor(max_workers=max_workers, initializer=start_kaleido)
+
+def wait_for_exports():
+    '''
+    wait for the images submitted to the export pool and shut it down (closing the Kaleido servers of the workers)
+
+    :return: list of the paths that could not be exported
+    '''
+    global EXPORT_POOL
+    failed = []
+    futures = {future: path for path, future in PENDING}
+    for future in as_completed(futures):
+        try:
+            print(f'[+] {future.result()}')
+        except Exception as e:
+            print(f'[-] {futures[future]}: {str(e).strip()}')
+            failed.append(futures[future])
+    PENDING.clear()
+    if EXPORT_POOL is not None:
+        EXPORT_POOL.shutdown()
+        EXPORT_POOL = None
+    return failed
+
+def output_figure(fig, name, width=IMAGE_WIDTH, height=IMAGE_HEIGHT):
+    '''
+    show the plotly figure (if SHOW) and write it as OUTPUT_DIR/name.<format> in all FORMATS
+
+    :param width: size of exported images in pixels
+    :param height:
+    '''
+    if SHOW:
+        fig.show()
+    for format in FORMATS:
+        path = figure_path(name, format)
+        WRITTEN.append(path)
+        if format == 'html':
+            fig.write_html(path)
+            print(f'[+] {path}')
+        elif EXPORT_POOL is not None:
+            PENDING.append((path, EXPORT_POOL.submit(export_image, fig.to_json(), path, format, width, height)))
+        else:
+            fig.write_image(path, format=format, width=width, height=height)
+            print(f'[+] {path}')
+
+def output_matplotlib(fig, name):
+    '''
+    write the matplotlib figure as OUTPUT_DIR/name.<format> in the image FORMATS (png if there are none), then show (if
+    SHOW) or close it
+    '''
+    import matplotlib.pyplot as plt
+    formats = [format for format in FORMATS if format != 'html'] or ['png']
+    for format in formats:
+        path = figure_path(name, format)
+        WRITTEN.append(path)
+        fig.savefig(path, format=format, bbox_inches='tight')
+        print(f'[+] {path}')
+    if SHOW:
+        plt.show()
+    else:
+        plt.close(fig)
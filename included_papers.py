@@ -0,0 +1,186 @@
+import os
+import datetime
+import pandas as pd
+from sqlalchemy import MetaData, Table, Column, String, Date, Integer, inspect, insert
+from db_connection import get_analysis_engine
+from db_querier import connect_db, query_dataframe
+from schema_migration import INCLUDED_FILTER
+from ugc_sources import split_ugc_sources
+import search_term_index
+'''
+materialised table of the included (non review) papers of the analysis database. Per paper it stores what the figure
+functions derived from the literature table before: the sdg search term extracted from the query, the sdg target of
+that term, the year and the canonical ugc sources (citizen science and name variants like 'sina weibo' / 'weibo'
+homogenised, ';' joined) next to the DPSIR class and the sdg column. Rebuild it after the screening data changed:
+
+    python included_papers.py
+
+The figures read the table once per process into a shared snapshot (load_included_papers), which can be kept as a
+Parquet or Feather file (PATH_SNAPSHOT) to render the figures without querying the papers again. The file carries the
+build time of the table and is only used while the table was not rebuilt since.
+'''
+INCLUDED_PAPERS_TABLE = 'included_papers'
+# one row with the time the included_papers table was last built
+BUILD_TABLE = 'included_papers_build'
+# column of the snapshot file holding the build time of the table it was read from
+SNAPSHOT_BUILT_COLUMN = 'snapshot_built'
+SOURCE_QUERY = f"select eid, title, date, sdg, query, source, ugc_source, dpsir from literature where {INCLUDED_FILTER};"
+# search terms with their sdg targets (the extended list incl. the terms added manually during the screening)
+PATH_SEARCH_TERMS = './sdg_search_terms_extended_w_manual_terms.txt'
+# optional .parquet or .feather file of the snapshot, read instead of the table if it exists
+PATH_SNAPSHOT = None
+# included papers shared by all figures of the process, loaded on first use
+SNAPSHOT = None
+
+metadata = MetaData()
+included_papers_table = Table(INCLUDED_PAPERS_TABLE, metadata,
+                              Column('eid', String, primary_key=True),
+                              Column('title', String),
+                              Column('date', Date),
+                              Column('year', Integer),
+                              Column('sdg', String),
+                              Column('source', String),
+                              Column('sdg_term', String),
+                              Column('target', String),
+                              Column('ugc_sources', String),
+                              Column('dpsir', String))
+build_table = Table(BUILD_TABLE, metadata, Column('built', String))
+
+
+def load_search_terms_per_target(PATH_SEARCH_TERMS = './sdg_search_terms_extended_w_manual_terms.txt', sections=['<SDG3>', '<SDG11>']):
+    '''
+    load the used search terms for ugc terms and sdg target related terms. they are used to be compared with the results to
+    evaluate for which targets applicable papers were found and were a possible research gab for UGC exists.
+
+    :param PATH_SEARCH_TERMS:
+    :param sections:
+    :return: dict of search term -> sdg target
+    '''
+    return search_term_index.load_search_terms_per_target(PATH_SEARCH_TERMS, sections)
+
+def build_included_papers(conn):
+    '''
+    :return: DataFrame with one row per included paper
+    '''
+    papers = query_dataframe(conn, SOURCE_QUERY)
+    papers['date'] = pd.to_datetime(papers['date'])
+    # plain python values (None instead of pd.NA) for the string functions
+    raw = papers.astype(object).where(papers.notna(), None)
+    search_terms_per_target_dict = load_search_terms_per_target(PATH_SEARCH_TERMS)
+    sdg_terms = search_term_index.sdg_terms(raw['query'], raw['source'])
+    return pd.DataFrame({
+        'eid': papers['eid'],
+        'title': papers['title'],
+        'date': papers['date'],
+        'year': papers['date'].dt.year.astype('Int64'),
+        'sdg': papers['sdg'],
+        'source': papers['source'],
+        'sdg_term': sdg_terms,
+        # terms that were manually added during the iteration of found LR have no target
+        'target': [search_terms_per_target_dict.get(term) for term in sdg_terms],
+        'ugc_sources': [';'.join(split_ugc_sources(ugc_source)) for ugc_source in raw['ugc_source']],
+        'dpsir': papers['dpsir'],
+    })
+
+def refresh_included_papers(conn):
+    '''
+    rebuild the included_papers table from literature
+
+    :return: number of included papers
+    '''
+    papers = build_included_papers(conn)
+    # end the read transaction of conn, the table is replaced through another connection of the pool
+    conn.commit()
+    engine = get_analysis_engine()
+    included_papers_table.drop(engine, checkfirst=True)
+    included_papers_table.create(engine)
+    build_table.drop(engine, checkfirst=True)
+    build_table.create(engine)
+    rows = papers.astype(object).where(papers.notna(), None)
+    rows['date'] = [date.date() if date is not None else None for date in rows['date']]
+    with engine.begin() as connection:
+        if len(rows):
+            connection.execute(insert(included_papers_table), rows.to_dict('records'))
+        connection.execute(insert(build_table), {'built': datetime.datetime.now().isoformat()})
+    print(f'[+] {INCLUDED_PAPERS_TABLE}: {len(papers)} papers')
+    clear_snapshot()
+    return len(papers)
+
+def query_included_papers(conn):
+    '''
+    :return: DataFrame of the included_papers table (built on first use), ugc_sources as lists
+    '''
+    if not inspect(get_analysis_engine()).has_table(INCLUDED_PAPERS_TABLE):
+        refresh_included_papers(conn)
+    papers = query_dataframe(conn, f'select * from {INCLUDED_PAPERS_TABLE};')
+    papers['ugc_sources'] = [ugc_sources.split(';') if ugc_sources else [] for ugc_sources in papers['ugc_sources'].fillna('')]
+    return papers
+
+def table_build(conn):
+    '''
+    :return: build time of the included_papers table, None if it was built before the build time was recorded
+    '''
+    if not inspect(get_analysis_engine()).has_table(BUILD_TABLE):
+        return None
+    builds = query_dataframe(conn, f'select built from {BUILD_TABLE};')
+    if len(builds) == 0:
+        return None
+    return builds['built'].iloc[0]
+
+def write_snapshot(papers, path, built):
+    '''
+    :param built: build time of the table the papers were read from
+    '''
+    papers = papers.assign(**{SNAPSHOT_BUILT_COLUMN: built})
+    if path.endswith('.feather'):
+        papers.to_feather(path)
+    else:
+        papers.to_parquet(path, index=False)
+    print(f'[+] snapshot of {len(papers)} included papers written to {path}')
+
+def read_snapshot(path):
+    '''
+    :return: (DataFrame of the papers, build time of the table they were read from)
+    '''
+    if path.endswith('.feather'):
+        papers = pd.read_feather(path)
+    else:
+        papers = pd.read_parquet(path)
+    built = papers.pop(SNAPSHOT_BUILT_COLUMN).iloc[0] if len(papers) and SNAPSHOT_BUILT_COLUMN in papers else None
+    # arrow list columns are read as arrays
+    papers['ugc_sources'] = [list(ugc_sources) for ugc_sources in papers['ugc_sources']]
+    return papers, built
+
+def load_included_papers(conn):
+    '''
+    the included papers are queried once (or read from PATH_SNAPSHOT if the table was not rebuilt since the file was
+    written) and shared by all later calls
+
+    :return: copy of the snapshot of the included papers, ugc_sources as lists
+    '''
+    global SNAPSHOT
+    if SNAPSHOT is None:
+        if PATH_SNAPSHOT is not None and os.path.isfile(PATH_SNAPSHOT):
+            papers, built = read_snapshot(PATH_SNAPSHOT)
+            if built is not None and built == table_build(conn):
+                print(f'[*] {len(papers)} included papers read from {PATH_SNAPSHOT}')
+                SNAPSHOT = papers
+            else:
+                print(f'[*] {PATH_SNAPSHOT} is older than the {INCLUDED_PAPERS_TABLE} table')
+        if SNAPSHOT is None:
+            SNAPSHOT = query_included_papers(conn)
+            if PATH_SNAPSHOT is not None:
+                write_snapshot(SNAPSHOT, PATH_SNAPSHOT, table_build(conn))
+    return SNAPSHOT.copy()
+
+def clear_snapshot():
+    '''
+    the next load_included_papers queries the table again (a snapshot file is removed)
+    '''
+    global SNAPSHOT
+    SNAPSHOT = None
+    if PATH_SNAPSHOT is not None and os.path.isfile(PATH_SNAPSHOT):
+        os.remove(PATH_SNAPSHOT)
+
+if __name__ == '__main__':
+    refresh_included_papers(connect_db())
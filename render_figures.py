@@ -0,0 +1,108 @@
+import sys
+import argparse
+import matplotlib
+# no display needed, must be selected before pyplot is imported by the figure scripts
+matplotlib.use('Agg')
+import db_connection
+import figure_cache
+import figure_output
+import included_papers
+import create_figures
+import dpsir_analysis
+from db_querier import query_dataframe
+'''
+renders the figures of the paper without opening them, e.g.:
+
+    python render_figures.py --output-dir ./final_plots --formats html png svg
+    python render_figures.py --figures sankey stackedbar dpsir_sankey --formats pdf --workers 4
+    python render_figures.py --snapshot ./included_papers.parquet
+
+All figures are built from one snapshot of the included papers (one query, or only a check of the table's build time
+if the --snapshot file is up to date).
+Figures are written as OUTPUT_DIR/<figure name>.<format>, images are exported in a pool of Kaleido processes (one per
+core by default) while the next figures are built. Figures whose inputs did not change since the last run are skipped
+(see figure_cache.py), --force renders everything again. Exits with 1 if a figure or an export failed.
+'''
+PAPERS = ['included_papers']
+SEARCH_TERMS = [included_papers.PATH_SEARCH_TERMS]
+# name -> (plot function, data sources of figure_cache.DATA_SOURCES, files read by the figure)
+FIGURES = {
+    'overview': (create_figures.plot_ugc_sources_overview, PAPERS, []),
+    'by_year': (create_figures.plot_included_papers_by_year, PAPERS, []),
+    'top_per_year': (create_figures.plot_top_ugc_sources_per_year, PAPERS, []),
+    'by_topic': (create_figures.plot_ugc_sources_by_topic, PAPERS, SEARCH_TERMS),
+    'sankey': (create_figures.plot_ugc_sources_by_topic_revamped_sankeyplot, PAPERS, []),
+    'stackedbar': (create_figures.plot_ugc_sources_by_topic_revamped_stackedbar, PAPERS, SEARCH_TERMS),
+    'sources_by_year': (create_figures.plot_ugc_sources_by_year, PAPERS, []),
+    'initial_treemap': (create_figures.plot_initial_query_treemap, [], [create_figures.PATH_TREEMAP_ALL_TERMS]),
+    'final_treemap': (create_figures.plot_final_query_treemap, [], [create_figures.PATH_TREEMAP_INCLUDED_TERMS]),
+    'dpsir_sankey': (dpsir_analysis.DPSIR_per_paper_type_sankeyplot, PAPERS, []),
+    'dpsir_stackedbar': (dpsir_analysis.DPSIR_per_paper_type_stackedbar, PAPERS, SEARCH_TERMS),
+    'study_country': (dpsir_analysis.study_country_with_match_no_match_dist, ['study_country'], []),
+    'author_country': (dpsir_analysis.author_country_study_country_rel, ['study_country'], []),
+    'dpsir_twitter_vs_cs': (dpsir_analysis.dpsir_twitter_vs_cs, PAPERS, []),
+}
+figure_cache.DATA_SOURCES['study_country'] = lambda conn: query_dataframe(conn, dpsir_analysis.STUDY_COUNTRY_QUERY)
+# figures of the paper, rendered if no --figures are given
+PAPER_FIGURES = ['sankey', 'stackedbar', 'sources_by_year', 'dpsir_sankey', 'dpsir_stackedbar', 'study_country']
+
+
+def render_figures(names):
+    '''
+    :param names: keys of FIGURES
+    :return: list of the figures (names) and image exports (paths) that failed
+    '''
+    failed = []
+    manifest = figure_cache.load_manifest()
+    rendered = {}
+    for name in names:
+        function, sources, files = FIGURES[name]
+        try:
+            fingerprint = figure_cache.figure_fingerprint(function, sources, files)
+            if figure_cache.is_current(manifest, name, fingerprint):
+                print(f'[*] {name} unchanged')
+                continue
+            print(f'[*] {name}')
+            start = len(figure_output.WRITTEN)
+            function()
+            rendered[name] = {'fingerprint': fingerprint, 'outputs': figure_output.WRITTEN[start:]}
+        except Exception as e:
+            print(f'[-] {name}: {e}')
+            failed.append(name)
+    failed_exports = figure_output.wait_for_exports()
+    # figures with a failed export are rendered again by the next run
+    for name, entry in rendered.items():
+        if not any(path in failed_exports for path in entry['outputs']):
+            manifest[name] = entry
+    figure_cache.save_manifest(manifest)
+    return failed + failed_exports
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='render the figures of the analysis without showing them')
+    parser.add_argument('--figures', nargs='+', choices=list(FIGURES), default=PAPER_FIGURES)
+    parser.add_argument('--output-dir', default=figure_output.OUTPUT_DIR)
+    parser.add_argument('--formats', nargs='+', default=['html', 'png'], help='html and/or image formats of plotly (png, jpg, svg, pdf, ...)')
+    parser.add_argument('--workers', type=int, default=None, help='Kaleido processes of the image exports, defaults to one per core')
+    parser.add_argument('--cache-dir', default=figure_cache.CACHE_DIR, help='fingerprints and cached aggregates of the figures')
+    parser.add_argument('--force', action='store_true', help='clear the cache and render all figures')
+    parser.add_argument('--snapshot', default=None, help='.parquet or .feather file of the included papers, read instead of the table while the table was not rebuilt, written otherwise')
+    args = parser.parse_args()
+
+    included_papers.PATH_SNAPSHOT = args.snapshot
+    figure_cache.ENABLED = True
+    figure_cache.CACHE_DIR = args.cache_dir
+    if args.force:
+        figure_cache.clear_cache()
+    figure_output.SHOW = False
+    figure_output.OUTPUT_DIR = args.output_dir
+    figure_output.FORMATS = args.formats
+    if any(format != 'html' for format in args.formats):
+        figure_output.start_export_pool(args.workers)
+    # shared by the create_figures functions, dpsir_analysis connects by itself (same shared connection)
+    create_figures.conn = create_figures.connect_db()
+    failed = render_figures(args.figures)
+    db_connection.close_db()
+    if failed:
+        print(f"[-] failed: {', '.join(failed)}")
+        sys.exit(1)
+    print(f'[+] {len(args.figures)} figures up to date in {args.output_dir}')
@@ -0,0 +1,110 @@
+import argparse
+from sqlalchemy import MetaData, Table, Column, String, ForeignKey, Index, inspect, text, select, insert, func
+from db_connection import get_engine, analysis_db_url
+from ugc_sources import split_ugc_sources
+'''
+schema migration of the screened literature table (analysis database). Adds
+- partial indexes for the inclusion filter of the analyses, (decision_r_1 = '1' or decision_r_2 = '1') and
+  subtype != 'Review', and for the annotated study areas
+- link tables with one row per value of the semicolon joined screening columns (ugc sources, DPSIR classes, author and
+  study area countries, keywords), so counts and group-bys run inside the database, e.g.
+
+    select s.ugc_source, count(*) from literature_ugc_source s join literature l using (eid)
+    where (l.decision_r_1 = '1' or l.decision_r_2 = '1') and l.subtype != 'Review' group by s.ugc_source;
+
+The screening columns stay the source of the annotations, run the refresh after they were edited:
+
+    python schema_migration.py            # create indexes and link tables, then fill them
+    python schema_migration.py --refresh  # only refill the link tables
+'''
+# where clause of the included papers, used verbatim by the analysis queries so the partial index applies
+INCLUDED_FILTER = "(decision_r_1 = '1' or decision_r_2 = '1') and subtype != 'Review'"
+# link table: (literature column, value column, function splitting a column value into the stored values or None to
+# store the trimmed values), ugc sources are stored by their canonical names as counted by the analyses
+LINKED_COLUMNS = {
+    'literature_ugc_source': ('ugc_source', 'ugc_source', split_ugc_sources),
+    'literature_dpsir': ('dpsir', 'dpsir', None),
+    'literature_author_country': ('author_country_list', 'country', None),
+    'literature_study_country': ('study_area_country', 'country', None),
+    'literature_keyword': ('keywords', 'keyword', None),
+}
+# partial index: (where clause, columns it needs)
+PARTIAL_INDEXES = {
+    'literature_included_idx': (INCLUDED_FILTER, ['decision_r_1', 'decision_r_2', 'subtype']),
+    'literature_study_area_idx': ('study_area_country is not null', ['study_area_country']),
+}
+
+metadata = MetaData()
+
+
+def link_table(name, value_column):
+    return Table(name, metadata,
+                 Column('eid', String, ForeignKey('literature.eid', ondelete='CASCADE'), primary_key=True),
+                 Column(value_column, String, primary_key=True),
+                 Index(f'{name}_{value_column}_idx', value_column),
+                 extend_existing=True)
+
+LINK_TABLES = {name: link_table(name, value_column) for name, (column, value_column, split) in LINKED_COLUMNS.items()}
+
+
+def literature_columns(engine):
+    return set(column['name'] for column in inspect(engine).get_columns('literature'))
+
+def available_links(engine):
+    # only the screening columns that exist in this database, e.g. the harvesting database has none of them
+    columns = literature_columns(engine)
+    return {name: link for name, link in LINKED_COLUMNS.items() if link[0] in columns}
+
+def migrate(engine):
+    '''
+    create the partial indexes and link tables (idempotent) and fill the link tables
+    '''
+    columns = literature_columns(engine)
+    with engine.begin() as conn:
+        for name, (where, required) in PARTIAL_INDEXES.items():
+            if all(column in columns for column in required):
+                conn.execute(text(f'create index if not exists {name} on literature (eid) where {where}'))
+                print(f'[+] index {name}')
+    links = available_links(engine)
+    # the literature table is referenced by the link tables, reflect it into the metadata
+    Table('literature', metadata, autoload_with=engine, extend_existing=True)
+    metadata.create_all(engine, tables=[LINK_TABLES[name] for name in links])
+    refresh_link_tables(engine)
+
+def refresh_link_tables(engine):
+    '''
+    refill the link tables from the semicolon joined screening columns of literature
+
+    :return: number of rows per link table
+    '''
+    counts = {}
+    with engine.begin() as conn:
+        for name, (column, value_column, split) in available_links(engine).items():
+            conn.execute(LINK_TABLES[name].delete())
+            if engine.dialect.name == 'postgresql' and split is None:
+                conn.execute(text(f"""insert into {name} (eid, {value_column})
+                                      select distinct eid, trim(v) from literature, unnest(string_to_array({column}, ';')) as v
+                                      where {column} is not null and trim(v) != ''"""))
+            else:
+                # split in python for databases without array functions and for the canonical ugc source names
+                rows = set()
+                for eid, values in conn.execute(text(f'select eid, {column} from literature where {column} is not null')):
+                    for value in (split(values) if split is not None else [value.strip() for value in values.split(';')]):
+                        if value:
+                            rows.add((eid, value))
+                if rows:
+                    conn.execute(insert(LINK_TABLES[name]), [{'eid': eid, value_column: value} for eid, value in rows])
+            counts[name] = conn.execute(select(func.count()).select_from(LINK_TABLES[name])).scalar()
+            print(f'[+] {name}: {counts[name]} rows')
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='add indexes and normalised link tables to the literature table')
+    parser.add_argument('--refresh', action='store_true', help='only refill the link tables')
+    parser.add_argument('--db', default=None, help='sqlalchemy connection string, defaults to the analysis database')
+    args = parser.parse_args()
+    engine = get_engine(args.db or analysis_db_url())
+    if args.refresh:
+        refresh_link_tables(engine)
+    else:
+        migrate(engine)
@@ -1,35 +1,41 @@
 import time
-import json
-import requests
+import asyncio
+import datetime
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 from sqlalchemy import or_
-from dbclasses import ScopusEntry, connect_to_db
+from db_connection import close_db
+from dbclasses import ScopusEntry, EntryWriter, CheckpointJournal, WatermarkStore, update_abstracts, iter_chunks, connect_to_db
+from scopus_scheduler import RequestScheduler
+from scopus_session import build_session, timed_get, STATS
+from scopus_cache import ResponseCache
+import search_term_index
 '''
 way to get references:
 https://api.elsevier.com/content/abstract/EID:[]?apiKey=[]&view=REF
 
 '''
 PATH_API_KEY = './scopus_key.txt'
+# base url of the scopus api, can be pointed to a local stand-in server (see scopus_stub_server.py)
+SCOPUS_API_URL = 'https://api.elsevier.com'
+# paces all requests of this module, see scopus_scheduler.py
+SCHEDULER = RequestScheduler()
+# maximal page size of the search api (STANDARD view), used by the cursor pagination
+MAX_COUNT = 200
+# scopus does not return results beyond this start index with offset pagination
+MAX_OFFSET = 5000
+# size of the keep-alive connection pool, should be at least the max_concurrency of query_pipeline_async
+POOL_SIZE = 10
+# pooled session shared by all requests of this module, created on first use (see scopus_session.py)
+SESSION = None
+# on-disk response cache, set CACHE.mode = 'offline' to replay runs without using quota (see scopus_cache.py)
+CACHE = ResponseCache('./scopus_cache')
 
 # read search terms
 def load_search_terms(PATH_SEARCH_TERMS = './search_terms_adapted.txt', sections=['<UGC>', '<SDG3>', '<SDG11>']):
-    current_section = None
-    search_terms = {}
-    # assign empty lists to all sections of the file
-    for section in sections:
-        search_terms[section] = []
-    with open(PATH_SEARCH_TERMS, 'rt') as f:
-        content = f.readlines()
-        for line in content:
-            line = line.strip('\n')
-            if line in sections:
-                current_section = line
-                continue
-            else:
-                # check if a section is assigned (only true when reading the file header)
-                if current_section is not None and line is not '':
-                    search_terms[current_section].append(line)
-    return search_terms
+    # parsed once per file version, see search_term_index
+    return search_term_index.load_search_terms(PATH_SEARCH_TERMS, sections)
 
 
 # read api key
@@ -68,58 +74,307 @@ def build_query_treemap_plot(search_field, ugc_term, sdg_term):
     query = f'{search_field}(({ugc_term}) AND ({sdg_term}))'
     return query
 
+def build_search_request(query, start_index=0, count=None, cursor=None):
+    if cursor is not None:
+        # cursors contain characters like '+', '/' and '=' which have to be escaped
+        return f"{SCOPUS_API_URL}/content/search/scopus?query={query}&count={count}&cursor={quote(cursor, safe='')}"
+    if count is not None:
+        return f"{SCOPUS_API_URL}/content/search/scopus?query={query}&start={start_index}&count={count}"
+    return f"{SCOPUS_API_URL}/content/search/scopus?query={query}&start={start_index}"
+
+def get_session():
+    global SESSION
+    if SESSION is None:
+        SESSION = build_session(POOL_SIZE)
+    return SESSION
+
 def query_core(API_KEY, request):
-    resp = requests.get(request,
-                 headers={'Accept': 'application/json',
-                          'X-ELS-APIKey': API_KEY})
-    # retrieve rate limit and remaining requests from request header
-    rate_limit = int(resp.headers['x-ratelimit-limit'])
-    rate_remaining = int(resp.headers['x-ratelimit-remaining'])
-    if rate_remaining < 5000:
+    # stored abstract urls may still point to the plain http endpoint, which only redirects
+    if request.startswith('http://api.elsevier.com'):
+        request = 'https://' + request[len('http://'):]
+    cached = CACHE.get(request)
+    if cached is not None:
+        return cached, SCHEDULER.rate_remaining
+    session = get_session()
+    resp = SCHEDULER.call(lambda: timed_get(session, request, {'X-ELS-APIKey': API_KEY}))
+    CACHE.put(request, resp)
+    # rate limit and remaining requests as last reported in the response headers (tracked by the scheduler)
+    rate_limit = SCHEDULER.rate_limit
+    rate_remaining = SCHEDULER.rate_remaining
+    if rate_remaining is not None and rate_remaining < 5000:
         print(f"[*] alert: only {rate_remaining} from {rate_limit} requests")
     # print(f'\r[*] {rate_remaining} of {rate_limit} requests remaining', end='')
     return resp, rate_remaining
 
-def query_for_treemap_plot(search_terms, output_path='./treemap_data.csv', search_fields=['TITLE', 'KEY']):
+def build_query_treemap_merged(search_fields, ugc_term, sdg_term):
+    '''
+    one query over all search fields. It counts every paper once (union) instead of once per matching search field
+    '''
+    if sorted(search_fields) == ['ABS', 'KEY', 'TITLE']:
+        return build_query_treemap_plot('TITLE-ABS-KEY', ugc_term, sdg_term)
+    return ' OR '.join(build_query_treemap_plot(search_field, ugc_term, sdg_term) for search_field in search_fields)
+
+def plan_treemap_queries(search_terms, search_fields=['TITLE', 'KEY'], merge_fields=False):
+    '''
+    plan the count queries of the treemap data. Combinations that occur repeatedly (e.g. a term listed under several
+    SDGs) are only queried once.
+
+    :param merge_fields: query all search fields at once. NOTE: this counts the union of the papers found in the search
+                         fields, by default the results of the search fields are summed up like the original treemap data
+    :return: (cells, queries) cells is a list of (ugc term, sdg term, query), queries the list of distinct queries
+    '''
+    cells = []
+    for ugc_term in search_terms['<UGC>']:
+        for sdg in search_terms:
+            if sdg != '<UGC>':
+                for sdg_term in search_terms[sdg]:
+                    if merge_fields:
+                        cells.append((ugc_term, sdg_term, build_query_treemap_merged(search_fields, ugc_term, sdg_term)))
+                    else:
+                        for search_field in search_fields:
+                            cells.append((ugc_term, sdg_term, build_query_treemap_plot(search_field, ugc_term, sdg_term)))
+    # the same cell can be planned several times if an sdg term is listed under several SDGs
+    cells = list(dict.fromkeys(cells))
+    queries = list(dict.fromkeys(query for ugc_term, sdg_term, query in cells))
+    return cells, queries
+
+def query_total_results(API_KEY, query):
+    # count=1 since only 'opensearch:totalResults' is needed
+    request = f"{SCOPUS_API_URL}/content/search/scopus?query={query}&count=1"
+    resp = query_core(API_KEY, request)
+    json_ = resp[0].json()
+    if 'search-results' not in json_.keys():
+        print(f'\n[-] key search-results not found for query: {query}\n')
+        return 0
+    return int(json_['search-results']['opensearch:totalResults'])
+
+def query_for_treemap_plot(search_terms, output_path='./treemap_data.csv', search_fields=['TITLE', 'KEY'], merge_fields=False, max_workers=8):
     '''
     query each possible combination of UGC and SDG3, SDG11 search terms and return their total results. This dataset is
     needed to construct the sunburst treemap diagramm
     NOTE: the treemap is then generated in a jupyter notebook
-    :param search_queries:
-    :param session:
+    The distinct count queries (see plan_treemap_queries) are sent concurrently and the matrix is assembled at once.
+    :param search_terms:
+    :param output_path:
+    :param search_fields:
+    :param merge_fields: one query over all search fields per combination (union instead of sum, see plan_treemap_queries)
+    :param max_workers: number of concurrent count requests
     :return:
     '''
     print(f'Generating treemap data with the search fields: {search_fields}')
-    df = pd.DataFrame()
     # relevant parameter in json resp is: 'opensearch:totalResults'
     API_KEY = load_api_key()
-    for index, ugc_term in enumerate(search_terms['<UGC>'], 1):
-        for index, sdg in enumerate(search_terms, 1):
-            if sdg != '<UGC>':
-                for index2, sdg_term in enumerate(search_terms[sdg], 1):
-                    # summerise total results over ALL search fields
-                    total_results = 0
-                    print('-' * 30)
-                    for index3, search_field in enumerate(search_fields, 1):
-                        query = build_query_treemap_plot(search_field, ugc_term, sdg_term)
-                        print(f'Query {index3}: {query}')
-                        request = f"http://api.elsevier.com/content/search/scopus?query={query}"
-                        resp = query_core(API_KEY, request)
-                        json_ = json.loads(resp[0].text)
-                        total_results = total_results + int(json_['search-results']['opensearch:totalResults'])
-                        print(f'Results {search_field}: {total_results}')
-                    print(f'Total results: {total_results}')
-                    df.loc[ugc_term, sdg_term] = int(total_results)
-                    # extract DOI number as unique identifier to store in dictionary -> directly deals with duplicates
-                    # 1. check for key 'search-results'
-                    if 'search-results' not in json_.keys():
-                        print(
-                            '\n[-] key search-results not found. Going to next query (no more pages of current query considered)\n')
-                        break
+    cells, queries = plan_treemap_queries(search_terms, search_fields, merge_fields)
+    print(f'[*] {len(queries)} distinct count queries for {len(set((ugc_term, sdg_term) for ugc_term, sdg_term, query in cells))} treemap cells')
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        total_results = dict(zip(queries, executor.map(lambda query: query_total_results(API_KEY, query), queries)))
+    # summerise total results over ALL search fields
+    df = pd.DataFrame(cells, columns=['ugc_term', 'sdg_term', 'query'])
+    df['total_results'] = df['query'].map(total_results)
+    df = df.pivot_table(index='ugc_term', columns='sdg_term', values='total_results', aggfunc='sum', sort=False)
+    # keep the order of the search term file
+    df = df.reindex(index=pd.unique(df.index), columns=pd.unique(df.columns))
+    df.index.name = None
+    df.columns.name = None
     print(f'exporting df to csv here: {output_path}')
     df.to_csv(output_path, sep=';')
+    STATS.print_summary()
+    CACHE.print_summary()
+
+# declarative mapping of the search result entries onto the ScopusEntry columns: (column, key in the entry)
+SEARCH_ENTRY_FIELDS = (
+    ('eid', 'eid'),
+    ('doi', 'prism:doi'),
+    ('title', 'dc:title'),
+    ('subtype', 'subtypeDescription'),
+    ('date', 'prism:coverDate'), #format YYYY-MM-DD
+    ('author', 'dc:creator'),
+    ('openaccess', 'openaccessFlag'),
+    ('publicationname', 'prism:publicationName'),
+)
+# links of an entry: (column, @ref of the link)
+SEARCH_ENTRY_LINKS = (
+    ('abstracturl', 'self'), # abstract api call
+    ('paperurl', 'scopus'),
+)
+
+class SearchRecord:
+    '''
+    compact record of one search result entry, holding only the ScopusEntry fields
+    '''
+    __slots__ = tuple(column for column, key in SEARCH_ENTRY_FIELDS + SEARCH_ENTRY_LINKS)
+
+    def __init__(self, result):
+        for column, key in SEARCH_ENTRY_FIELDS:
+            setattr(self, column, result.get(key))
+        links = {element['@ref']: element['@href'] for element in result.get('link', []) if element.get('@_fa') == 'true'}
+        for column, ref in SEARCH_ENTRY_LINKS:
+            setattr(self, column, links.get(ref))
+
+    def as_dict(self):
+        return {column: getattr(self, column) for column in self.__slots__}
+
+def parse_search_page(json):
+    '''
+    generator over the entries of a scopus search result page
+
+    :return: yields a SearchRecord per entry
+    '''
+    for result in json['search-results']['entry']:
+        # check if emtpy result
+        if result.get('error') == 'Result set was empty':
+            return
+        if 'eid' not in result:
+            continue
+        yield SearchRecord(result)
+
+def next_page_cursor(json, count):
+    '''
+    :return: cursor of the page following this cursor paginated page, None if this was the last page
+    '''
+    # a partial (or empty) page is the last one
+    if int(json['search-results']['opensearch:itemsPerPage']) < count:
+        return None
+    return json['search-results'].get('cursor', {}).get('@next')
+
+def warn_truncated(query, nr_results):
+    print(f"\n[-] only the first {MAX_OFFSET} of {nr_results} results of {query} can be retrieved with offset pagination, use pagination='cursor'\n")
+
+def iterate_pages(API_KEY, query, start_index=0, pagination='offset', count=MAX_COUNT, cursor='*'):
+    '''
+    generator over the result pages of one query
+
+    offset pagination advances 'start' by 'opensearch:itemsPerPage' and is limited to the first 5000 results by scopus.
+    cursor pagination follows 'cursor/@next' with the maximal page size and has no depth limit.
+
+    :param query: query embedded in its search field
+    :param start_index: first result for offset pagination
+    :param pagination: 'offset' or 'cursor'
+    :param count: page size for cursor pagination (max. 200 for the STANDARD view)
+    :param cursor: cursor to start (or resume) from for cursor pagination, '*' is the first page
+    :return: yields (request, json, next_cursor) per page, next_cursor is None for offset pagination and on the last page
+    '''
+    while True:
+        if pagination == 'cursor':
+            request = build_search_request(query, count=count, cursor=cursor)
+        else:
+            request = build_search_request(query, start_index)
+        resp = query_core(API_KEY, request)
+        json = resp[0].json()
+        # 1. check for key 'search-results'
+        if 'search-results' not in json.keys():
+            print('\n[-] key search-results not found. Going to next query (no more pages of current query considered)\n')
+            return
+        nr_results = int(json['search-results']['opensearch:totalResults'])
+        results_per_page = int(json['search-results']['opensearch:itemsPerPage'])
+        if pagination == 'cursor':
+            next_cursor = next_page_cursor(json, count)
+            yield request, json, next_cursor
+            if next_cursor is None:
+                return
+            cursor = next_cursor
+        else:
+            yield request, json, None
+            # increase the start index for potential pagination
+            start_index = start_index + results_per_page
+            if results_per_page == 0 or start_index >= nr_results:
+                return
+            if start_index + results_per_page > MAX_OFFSET:
+                warn_truncated(query, nr_results)
+                return
+
+def resume_position(journal, unit, pagination, start_index=0):
+    '''
+    :return: (start index, cursor) from which an unfinished query is continued
+    '''
+    row = journal.get(unit)
+    if row is None:
+        return start_index, '*'
+    if pagination == 'cursor':
+        return start_index, row.cursor or '*'
+    if row.page_size:
+        # continue with the first page that was not finished
+        for page_start in range(0, row.total, row.page_size):
+            if not journal.is_done(f'{unit}#{page_start}'):
+                return page_start, '*'
+        return row.total, '*'
+    return start_index, '*'
+
+def checkpoint_page(journal, unit, json, pagination, next_cursor=None):
+    '''
+    record a stored result page of a query in the checkpoint journal
+    '''
+    if pagination == 'cursor':
+        journal.record(unit, 'query', cursor=next_cursor)
+        return
+    row = journal.get(unit)
+    page_size = None
+    if row is None or row.page_size is None:
+        page_size = int(json['search-results']['opensearch:itemsPerPage'])
+    journal.record(unit, 'query', total=int(json['search-results']['opensearch:totalResults']), page_size=page_size, commit=False)
+    journal.record(f"{unit}#{json['search-results']['opensearch:startIndex']}", 'page', done=True)
+
+def query_status(journal, unit, pagination):
+    '''
+    :return: 'complete' if every result page of the query was stored, 'truncated' if offset pagination stored every page
+             it can reach (the first MAX_OFFSET results of a larger query), 'incomplete' if pages are missing (e.g. after
+             an error response)
+    '''
+    row = journal.get(unit)
+    if row is None:
+        return 'incomplete'
+    if pagination == 'cursor':
+        # the cursor is cleared by the last page
+        return 'complete' if row.cursor is None else 'incomplete'
+    if not row.total:
+        return 'complete'
+    if not row.page_size:
+        return 'incomplete'
+    for page_start in range(0, min(row.total, MAX_OFFSET - row.page_size + 1), row.page_size):
+        if not journal.is_done(f'{unit}#{page_start}'):
+            return 'incomplete'
+    return 'truncated' if row.total > MAX_OFFSET else 'complete'
 
-def query_pipeline(search_queries, session, start_index=0, search_fields=['TITLE', 'KEY']):
+def finish_query(journal, watermarks, unit, pagination, cover_date, harvested):
+    '''
+    mark a query as done in the journal and advance its high-water mark, depending on query_status
+
+    :return: False if the query is incomplete, it stays open and a resumed run requests its missing pages
+    '''
+    status = query_status(journal, unit, pagination)
+    if status == 'incomplete':
+        print(f'[-] {unit} is incomplete, resume the run to request the missing pages')
+        return False
+    # a truncated query keeps its old mark, so the next delta still covers the results that could not be retrieved
+    if status == 'complete':
+        watermarks.record(unit, cover_date, harvested)
+    journal.record(unit, 'query', done=True)
+    return True
+
+def delta_restriction(watermark, delta='loaddate'):
+    '''
+    restriction that limits a query to the records that are new since its last harvest
+
+    :param watermark: HarvestWatermark of the query, None if it was never harvested completely
+    :param delta: 'loaddate' (LOAD-DATE AFT, records added to scopus since the last harvest, including late indexed older
+                  publications) or 'pubyear' (PUBYEAR >, records published in or after the year of the latest cover date)
+    :return: string appended to the query, empty for a full harvest
+    '''
+    if watermark is None:
+        return ''
+    if delta == 'pubyear':
+        if watermark.cover_date is None:
+            return ''
+        return f' AND PUBYEAR > {watermark.cover_date.year - 1}'
+    # one day of overlap, records loaded on the day of the last harvest but after it ran are not missed
+    return f" AND LOAD-DATE AFT {watermark.harvested - datetime.timedelta(days=1):%Y%m%d}"
+
+def latest_cover_date(cover_date, record):
+    if record.date is not None and (cover_date is None or record.date > cover_date):
+        return record.date
+    return cover_date
+
+def query_pipeline(search_queries, session, start_index=0, search_fields=['TITLE', 'KEY'], batch_size=200, pagination='offset', count=MAX_COUNT, resume=True, run='harvest', writer=None, incremental=False, delta='loaddate', watermarks=None):
     '''
     function to return the metadata of all research documents inside the scopus database retrieved via constructed queries relevant
     to UGC in combination to SDG3 and SDG11 and their respective targets
@@ -127,187 +382,319 @@ def query_pipeline(search_queries, session, start_index=0, search_fields=['TITLE
     :param search_queries:
     :param session:
     :param start_index:
-    :return:
+    :param batch_size: maximal number of rows written per insert statement (rows are flushed at least once per page)
+    :param pagination: 'offset' (start index, max. 5000 results per query) or 'cursor' (no depth limit, fewer requests)
+    :param count: page size for cursor pagination
+    :param resume: continue an interrupted run from the harvest_checkpoint table, finished queries and pages are skipped.
+                   If False the checkpoints of the run are discarded first
+    :param run: name of the run in the harvest_checkpoint table, the checkpoints are removed once the run completed
+    :param writer: EntryWriter the results are written to, by default one for the literature table
+    :param incremental: only request records that are new since the last completed harvest of each query (see
+                        delta_restriction) and upsert them. Every completely retrieved query updates its high-water mark
+                        in the harvest_watermark table, also in a full harvest
+    :param delta: 'loaddate' or 'pubyear', restriction used by incremental harvests
+    :param watermarks: WatermarkStore of the high-water marks, by default the harvest_watermark table
+    :return: number of incomplete queries (missing pages, e.g. after error responses), the checkpoints of the run are
+             kept if there are any
     '''
     # what fields should be searched? keywords e.g. KEY(oscillator) in json authkeywords; title e.g. TITLE("neuropsychological evidence"); abstract e.g. ABS(dopamine)
     # search_fields = ['TITLE', 'KEY'] #, 'ABS'
     API_KEY = load_api_key()
-    results = {}
-    total_records = 0
-    dublicates = 0
+    if writer is None:
+        writer = EntryWriter(session, batch_size, upsert=incremental)
+    journal = CheckpointJournal(session, run)
+    if watermarks is None:
+        watermarks = WatermarkStore(session)
+    if not resume:
+        journal.reset()
+    elif journal.units:
+        print(f'[*] resuming run {run}: {len(journal.done_units("query"))} queries already completed')
     start = time.time()
+    harvested = datetime.date.today()
+    incomplete = 0
     for search_field in search_fields:
         for sdg in search_queries:
             records = 0
             print(f'\n[*] searching literature in {search_field} for {sdg}\n')
             for query in search_queries[sdg]:
-                to_paginate = False
+                # embed query in given search field
                 query = f'{search_field}(' + query + ')'
-                while True:
-                    # embed query in given search field
-                    request = f"http://api.elsevier.com/content/search/scopus?query={query}&start={start_index}"
-                    resp = query_core(API_KEY, request)
-
-                    json = resp[0].json()
-                    # extract DOI number as unique identifier to store in dictionary -> directly deals with duplicates
-                    # 1. check for key 'search-results'
-                    if 'search-results' not in json.keys():
-                        print('\n[-] key search-results not found. Going to next query (no more pages of current query considered)\n')
-                        break
-                    # try:
-                    #     test = json['search-results']['entry']
-                    # except Exception as e:
-                    #     pass
-                    for result in json['search-results']['entry']:
-                        # check if emtpy result
-                        if 'error' in result.keys():
-                            if result['error'] == 'Result set was empty':
-                                break
-                        # db_store()
-                        eid = result['eid']
-                        try:
-                            doi = result['prism:doi']
-                        except:
-                            doi = None
-                        try:
-                            title = result['dc:title']
-                        except:
-                            title = None
-                        try:
-                            subtype = result['subtypeDescription']
-                        except:
-                            subtype = None
-                        try:
-                            date = result['prism:coverDate'] #format YYYY-MM-DD
-                        except:
-                            date = None
-                        try:
-                            author = result['dc:creator']
-                        except:
-                            author = None # or skip the entry alltogether since not in-scope without author
-                        try:
-                            publication_name = result['prism:publicationName']
-                        except:
-                            publication_name = None
-                        open_access = result['openaccessFlag']
-
-                        # retrieve relevant links
-                        paper_url = None
-                        abstract_url = None
-                        for element in result['link']:
-                            # retrieve abstract api call
-                            if element['@ref'] == 'self' and element['@_fa'] == 'true':
-                                abstract_url = element['@href']
-                            # retrieve paper url
-                            if element['@ref'] == 'scopus' and element['@_fa'] == 'true':
-                                paper_url = element['@href']
-
-                        # set status if paper was already processed by the author for the systematic literature review (is False by default, therefore obsolete here)
-                        processed = False
-
-                        results[eid] = {
-                            'doi': doi,
-                            'title': title,
-                            'subtype': subtype,
-                            'date': date,
-                            'author': author,
-                            'openaccess': open_access,
-                            'publicationname': publication_name,
-                            'paperurl': paper_url,
-                            'abstracturl': abstract_url,
-                            'request': request,
-                            'source': 'scopus',
-                            'searchfield': search_field,
-                            'query': query,
-                            'sdg': sdg
-                        }
-                        # save to database
-                        entry = ScopusEntry(eid,
-                                            doi,
-                                            title,
-                                            subtype,
-                                            date,
-                                            author,
-                                            open_access,
-                                            publication_name,
-                                            paper_url,
-                                            abstract_url,
-                                            request,
-                                            'scopus',
-                                            search_field,
-                                            query,
-                                            sdg,
-                                            processed)
-                        try:
-                            session.add(entry)
-                            session.commit()
-                            records += 1
-                            total_records += 1
-                        except Exception as e:
-                            # print(f'\n[-] db error: {e}\n')
-                            dublicates += 1
-                            session.rollback()
-                    # deal with pagination
-                    nr_results = int(json['search-results']['opensearch:totalResults'])
-                    results_per_page = int(json['search-results']['opensearch:itemsPerPage'])
-                    # increase the start index for potential pagination
-                    start_index = start_index + results_per_page
-
-                    if start_index < nr_results:
-                        to_paginate = True
-                        continue
-                    else:
-                        break
+                unit = f'{sdg}|{query}'
+                if journal.is_done(unit):
+                    continue
+                # the records keep the unrestricted query, only the requests are restricted
+                search_query = query + delta_restriction(watermarks.get(unit), delta) if incremental else query
+                cover_date = None
+                query_start, cursor = resume_position(journal, unit, pagination, start_index)
+                pages = iterate_pages(API_KEY, search_query, query_start, pagination, count, cursor)
+                for request, json_, next_cursor in pages:
+                    inserted_before = writer.inserted
+                    for record in parse_search_page(json_):
+                        cover_date = latest_cover_date(cover_date, record)
+                        # buffer for the database
+                        writer.add(record.as_dict(), request, search_field, query, sdg)
+                    # save page to database
+                    writer.flush()
+                    records += writer.inserted - inserted_before
+                    checkpoint_page(journal, unit, json_, pagination, next_cursor)
+                if not finish_query(journal, watermarks, unit, pagination, cover_date, harvested):
+                    incomplete += 1
                 # reset start index for next query
                 start_index = 0
             print(f'\n[+] {records} retrieved for {sdg} in search field {search_field}\n')
+    if incomplete:
+        print(f'[-] {incomplete} queries are incomplete, the checkpoints of run {run} are kept for a resumed run')
+    else:
+        # the run completed, a new run starts from the beginning again
+        journal.reset()
     end = time.time()
     duration = round((end - start) / 60, 2)
-    print(f'\n[+] total records retrieved: {total_records}\n[+] dublicates/potential db errors: {dublicates}\n[*] scopus search completed in {duration} min')
+    print(f'\n[+] total records retrieved: {writer.inserted}\n[+] dublicates: {writer.duplicates}\n[*] scopus search completed in {duration} min')
+    if writer.upsert:
+        print(f'[+] updated records: {writer.updated}')
+    STATS.print_summary()
+    CACHE.print_summary()
+    return incomplete
 
-def get_abstract_keywords(session):
+def query_pipeline_async(search_queries, session, search_fields=['TITLE', 'KEY'], max_concurrency=10, batch_size=200, pagination='offset', count=MAX_COUNT, resume=True, run='harvest', incremental=False, delta='loaddate'):
+    '''
+    asyncio based variant of query_pipeline. All (search field x SDG x query) combinations and their result pages are
+    requested concurrently, with at most max_concurrency requests in flight at the same time. The first page of each
+    query reveals 'opensearch:totalResults', after which all remaining pages of that query are requested at once.
+    Results are written to the same literature table as query_pipeline. Database writes only happen on the event loop
+    thread, therefore the (not thread safe) session can be shared.
+    With cursor pagination the pages of one query have to be requested one after another, different queries still run
+    concurrently.
+
+    :param search_queries: output of build_query_api
+    :param session: sqlalchemy session from connect_to_db
+    :param search_fields:
+    :param max_concurrency: maximal number of simultaneous requests to the scopus api
+    :param batch_size: maximal number of rows written per insert statement (rows are flushed at least once per page)
+    :param pagination: 'offset' or 'cursor', see query_pipeline
+    :param count: page size for cursor pagination
+    :param resume: continue an interrupted run, see query_pipeline
+    :param run: name of the run in the harvest_checkpoint table
+    :param incremental: only request records that are new since the last harvest, see query_pipeline
+    :param delta: 'loaddate' or 'pubyear', see delta_restriction
+    :return:
+    '''
+    start = time.time()
+    counts = asyncio.run(_harvest_async(search_queries, session, search_fields, max_concurrency, batch_size, pagination, count, resume, run, incremental, delta))
+    for (search_field, sdg), records in counts['records'].items():
+        print(f'\n[+] {records} retrieved for {sdg} in search field {search_field}')
+    end = time.time()
+    duration = round((end - start) / 60, 2)
+    print(f"\n[+] total records retrieved: {counts['total_records']}\n[+] dublicates: {counts['dublicates']}\n[*] scopus search completed in {duration} min")
+    if incremental:
+        print(f"[+] updated records: {counts['updated']}")
+    if counts['incomplete']:
+        print(f"[-] {counts['incomplete']} queries are incomplete, the checkpoints of run {run} are kept for a resumed run")
+    STATS.print_summary()
+    CACHE.print_summary()
+
+async def _harvest_async(search_queries, session, search_fields, max_concurrency, batch_size, pagination, count, resume, run, incremental=False, delta='loaddate'):
+    API_KEY = load_api_key()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    writer = EntryWriter(session, batch_size, upsert=incremental)
+    journal = CheckpointJournal(session, run)
+    watermarks = WatermarkStore(session)
+    if not resume:
+        journal.reset()
+    elif journal.units:
+        print(f'[*] resuming run {run}: {len(journal.done_units("query"))} queries already completed')
+    counts = {'records': {}, 'total_records': 0, 'dublicates': 0, 'updated': 0, 'incomplete': 0}
+    harvested = datetime.date.today()
+    # latest cover date per query
+    cover_dates = {}
+
+    async def fetch_page(request):
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            resp = await loop.run_in_executor(executor, query_core, API_KEY, request)
+        return resp[0].json()
+
+    def store_page(json, request, search_field, query, sdg):
+        inserted_before = writer.inserted
+        unit = f'{sdg}|{query}'
+        for record in parse_search_page(json):
+            cover_dates[unit] = latest_cover_date(cover_dates.get(unit), record)
+            writer.add(record.as_dict(), request, search_field, query, sdg)
+        writer.flush()
+        counts['records'][(search_field, sdg)] += writer.inserted - inserted_before
+
+    async def harvest_query_cursor(search_field, sdg, query, search_query, unit):
+        cursor = resume_position(journal, unit, 'cursor')[1]
+        while cursor is not None:
+            request = build_search_request(search_query, count=count, cursor=cursor)
+            json = await fetch_page(request)
+            if 'search-results' not in json.keys():
+                print(f'\n[-] key search-results not found for query: {query}\n')
+                return
+            store_page(json, request, search_field, query, sdg)
+            cursor = next_page_cursor(json, count)
+            checkpoint_page(journal, unit, json, 'cursor', cursor)
+
+    async def harvest_query_offset(search_field, sdg, query, search_query, unit):
+        row = journal.get(unit)
+        if row is None or not row.page_size or not journal.is_done(f'{unit}#0'):
+            request = build_search_request(search_query, 0)
+            json = await fetch_page(request)
+            if 'search-results' not in json.keys():
+                print(f'\n[-] key search-results not found for query: {query}\n')
+                return
+            store_page(json, request, search_field, query, sdg)
+            checkpoint_page(journal, unit, json, 'offset')
+            row = journal.get(unit)
+        nr_results = row.total
+        results_per_page = row.page_size
+        if results_per_page == 0:
+            return
+        # request all remaining (unfinished) pages of this query concurrently
+        if nr_results > MAX_OFFSET:
+            warn_truncated(query, nr_results)
+        last_start = min(nr_results, MAX_OFFSET - results_per_page + 1)
+        requests_ = [build_search_request(search_query, start_index) for start_index in range(results_per_page, last_start, results_per_page)
+                     if not journal.is_done(f'{unit}#{start_index}')]
+        pages = [asyncio.ensure_future(fetch_page(request)) for request in requests_]
+        try:
+            for request, page in zip(requests_, pages):
+                json = await page
+                if 'search-results' not in json.keys():
+                    print(f'\n[-] key search-results not found for page: {request}\n')
+                    continue
+                store_page(json, request, search_field, query, sdg)
+                checkpoint_page(journal, unit, json, 'offset')
+        finally:
+            # e.g. on QuotaExhaustedError, pages that are not stored yet are fetched again by the next run
+            for page in pages:
+                page.cancel()
+
+    async def harvest_query(search_field, sdg, query):
+        query = f'{search_field}(' + query + ')'
+        unit = f'{sdg}|{query}'
+        if journal.is_done(unit):
+            return
+        search_query = query + delta_restriction(watermarks.get(unit), delta) if incremental else query
+        if pagination == 'cursor':
+            await harvest_query_cursor(search_field, sdg, query, search_query, unit)
+        else:
+            await harvest_query_offset(search_field, sdg, query, search_query, unit)
+        if not finish_query(journal, watermarks, unit, pagination, cover_dates.get(unit), harvested):
+            counts['incomplete'] += 1
+
+    tasks = []
+    for search_field in search_fields:
+        for sdg in search_queries:
+            counts['records'][(search_field, sdg)] = 0
+            for query in search_queries[sdg]:
+                tasks.append(asyncio.ensure_future(harvest_query(search_field, sdg, query)))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # stop the remaining queries if one of them failed
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        executor.shutdown(wait=False)
+    if not counts['incomplete']:
+        # the run completed, a new run starts from the beginning again
+        journal.reset()
+    counts['total_records'] = writer.inserted
+    counts['dublicates'] = writer.duplicates
+    counts['updated'] = writer.updated
+    return counts
+
+def parse_abstract_response(json):
+    '''
+    :return: (abstract, keyword string) of an abstract retrieval response, keywords are joined by ';'
+    '''
+    try:
+        abstract = json['abstracts-retrieval-response']['coredata']['dc:description']
+    except Exception as e:
+        abstract = None
+    try:
+        keywords = json['abstracts-retrieval-response']['authkeywords']['author-keyword']
+        # convert keywords to string
+        keyword_string = ''
+        for item in keywords:
+            keyword_string += f"{item['$']};"
+    except Exception as e:
+        keyword_string = ''
+    return abstract, keyword_string
+
+def fetch_abstract(API_KEY, eid, abstract_url):
+    # request = f"https://api.elsevier.com/content/abstract/EID:{eid}?apiKey={API_KEY}&view=REF"
+    resp = query_core(API_KEY, abstract_url)
+    abstract, keyword_string = parse_abstract_response(resp[0].json())
+    return {'eid': eid, 'abstract': abstract, 'keywords': keyword_string}
+
+def store_abstracts(session, journal, batch):
+    # store abstracts and keywords in db together with the checkpoints of the batch
+    if not batch:
+        return
+    for row in batch:
+        journal.record(row['eid'], 'abstract', done=True, commit=False)
+    update_abstracts(session, batch)
+
+def get_abstract_keywords(session, resume=True, run='abstracts', max_workers=8, batch_size=100, chunk_size=1000):
+    '''
+    retrieve abstract and author keywords of all articles which do not have them yet. The abstracts are requested by
+    a pool of max_workers threads and written back with one UPDATE statement per batch_size articles. The articles are
+    read in chunks of chunk_size rows, memory does not grow with the size of the literature table
+
+    :param session:
+    :param resume: skip articles that an interrupted run already processed (also those without abstract), see query_pipeline
+    :param run: name of the run in the harvest_checkpoint table
+    :param max_workers: number of concurrent abstract requests
+    :param batch_size: number of articles written per UPDATE statement
+    :param chunk_size: number of articles read from the database at once
+    :return:
+    '''
     API_KEY = load_api_key()
     no_abstract = 0
+    journal = CheckpointJournal(session, run)
+    if not resume:
+        journal.reset()
+    finished = journal.done_units('abstract')
+    if finished:
+        print(f'[*] resuming run {run}: {len(finished)} articles already processed')
     # get all rows from which not yet abstracts have been retrieved
     to_get = session.query(ScopusEntry.eid, ScopusEntry.abstracturl). \
                 filter(or_(ScopusEntry.abstract == None, ScopusEntry.keywords == None)). \
                 filter(ScopusEntry.subtype == 'Article')
+    # upper bound, articles of an interrupted run that got no abstract are counted but skipped
+    total = to_get.count()
+    index = 0
 
-    for index, item in enumerate(to_get, 1):
-        eid = item.eid
-        abstract_url = item.abstracturl
-        # embed query in given search field
-        # request = f"https://api.elsevier.com/content/abstract/EID:{eid}?apiKey={API_KEY}&view=REF"
-        request = abstract_url
-        resp = query_core(API_KEY, request)
+    batch = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk in iter_chunks(to_get, ScopusEntry.eid, chunk_size):
+            futures = [executor.submit(fetch_abstract, API_KEY, item.eid, item.abstracturl) for item in chunk if item.eid not in finished]
+            try:
+                for future in as_completed(futures):
+                    row = future.result()
+                    index += 1
+                    if row['abstract'] is None:
+                        no_abstract += 1
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        store_abstracts(session, journal, batch)
+                        batch = []
+                    print(f"\r{index} of {total} data downloaded", end='')
+            finally:
+                # e.g. on QuotaExhaustedError, requests that did not start yet are dropped
+                for future in futures:
+                    future.cancel()
+            store_abstracts(session, journal, batch)
+            batch = []
 
-        json = resp[0].json()
-        try:
-            abstract = json['abstracts-retrieval-response']['coredata']['dc:description']
-        except Exception as e:
-            no_abstract += 1
-            abstract = None
-        try:
-            keywords = json['abstracts-retrieval-response']['authkeywords']['author-keyword']
-            # convert keywords to string
-            keyword_string = ''
-            for item in keywords:
-                keyword_string += f"{item['$']};"
-        except Exception as e:
-            keyword_string = ''
-
-        # store abstract in db
-        session.query(ScopusEntry). \
-            filter(ScopusEntry.eid == eid). \
-            update({'abstract': abstract})
-        # store keywords in db
-        session.query(ScopusEntry). \
-            filter(ScopusEntry.eid == eid). \
-            update({'keywords': keyword_string})
-        session.commit()
-        print(f"\r{index} of {to_get.count()} data downloaded", end='')
-
-    print(f'For {no_abstract} articles no abstract was found')
+    # the run completed, a new run starts from the beginning again
+    journal.reset()
+    print(f'\nFor {no_abstract} articles no abstract was found')
+    STATS.print_summary()
+    CACHE.print_summary()
 
 if __name__ == '__main__':
     # s = connect_to_db()
@@ -316,6 +703,7 @@ if __name__ == '__main__':
     query_pipeline(search_queries, s)
     get_abstract_keywords(s)
     query_for_treemap_plot(search_terms, output_path='./20220825_treemap_adapted_searchterms_no_abs.csv', search_fields=['TITLE', 'KEY']) #, 'ABS'
+    close_db()
 
     # df = pd.read_csv('./treemap_data_ex_cc_wellbeing_health.csv', sep=';')
     # pass
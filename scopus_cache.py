@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from urllib.parse import urlsplit, parse_qsl, urlencode
+import requests
+from requests.structures import CaseInsensitiveDict
+'''
+content addressed on-disk cache of scopus api responses. Responses are stored under the sha256 of the normalised request
+url (host, path and sorted query parameters, scheme independent, api key removed), so identical search and abstract calls of
+query_for_treemap_plot, query_pipeline and get_abstract_keywords are only sent once within the time to live.
+
+modes:
+    'readwrite': serve hits from the cache, send misses to the api and store their response
+    'offline': replay only from the cache regardless of the time to live, a miss raises CacheMissError (no quota is used)
+    'off': bypass the cache
+'''
+# response headers kept with a cached body
+CACHED_HEADERS = ['Content-Type', 'x-ratelimit-limit', 'x-ratelimit-remaining', 'X-RateLimit-Reset']
+
+
+class CacheMissError(Exception):
+    pass
+
+
+def cache_key(url):
+    parts = urlsplit(url)
+    params = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() != 'apikey')
+    # responses of other hosts (e.g. scopus_stub_server) must not be served for the api
+    normalised = f'{parts.netloc.lower()}{parts.path}?{urlencode(params)}'
+    return hashlib.sha256(normalised.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cache_dir='./scopus_cache', ttl=7 * 24 * 3600, max_bytes=2 * 1024 ** 3, mode='readwrite'):
+        '''
+        :param cache_dir: directory of the cached responses
+        :param ttl: seconds after which a cached response is considered stale and requested again
+        :param max_bytes: size bound of the cache directory, least recently used responses are evicted beyond it
+        :param mode: 'readwrite', 'offline' or 'off'
+        '''
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.size = None
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    def get(self, url):
+        '''
+        :return: cached requests.Response or None on a miss
+        '''
+        if self.mode == 'off':
+            return None
+        path = self.path(cache_key(url))
+        try:
+            with open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        # offline replay serves stale responses as well
+        fresh = self.mode == 'offline' or self.ttl is None or (entry is not None and time.time() - entry['time'] <= self.ttl)
+        if entry is not None and fresh:
+            # touch the file for the least recently used eviction
+            os.utime(path)
+            with self.lock:
+                self.hits += 1
+            resp = requests.Response()
+            resp.status_code = entry['status']
+            resp.headers = CaseInsensitiveDict(entry['headers'])
+            resp._content = entry['body'].encode('utf-8')
+            resp.encoding = 'utf-8'
+            resp.url = entry['url']
+            return resp
+        with self.lock:
+            self.misses += 1
+        if self.mode == 'offline':
+            raise CacheMissError(f'{url} is not cached (offline mode)')
+        return None
+
+    def put(self, url, resp):
+        if self.mode != 'readwrite' or resp.status_code != 200:
+            return
+        path = self.path(cache_key(url))
+        entry = {
+            'url': url,
+            'time': time.time(),
+            'status': resp.status_code,
+            'headers': {header: resp.headers[header] for header in CACHED_HEADERS if header in resp.headers},
+            'body': resp.text
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, concurrent readers never see partial entries. Its name is unique across the
+        # threads and the shard processes sharing the cache directory
+        with tempfile.NamedTemporaryFile('wt', encoding='utf-8', dir=os.path.dirname(path), prefix=os.path.basename(path) + '.',
+                                         suffix='.tmp', delete=False) as f:
+            json.dump(entry, f)
+        os.replace(f.name, path)
+        with self.lock:
+            if self.size is None:
+                self.size = self.scan_size()
+            else:
+                self.size += os.path.getsize(path)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def files(self):
+        for root, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.json'):
+                    yield os.path.join(root, name)
+
+    def scan_size(self):
+        return sum(os.path.getsize(path) for path in self.files())
+
+    def evict(self):
+        # remove least recently used responses until the cache is at 90% of its size bound
+        entries = sorted(((os.path.getmtime(path), os.path.getsize(path), path) for path in self.files()))
+        self.size = sum(entry[1] for entry in entries)
+        for mtime, size, path in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            os.remove(path)
+            self.size -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            for path in list(self.files()):
+                os.remove(path)
+            self.size = 0
+
+    def print_summary(self):
+        if self.mode == 'off':
+            return
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0
+        print(f'[*] response cache ({self.mode}): {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), {self.evictions} evicted')
@@ -0,0 +1,149 @@
+import time
+import random
+import threading
+import requests
+from email.utils import parsedate_to_datetime
+'''
+request scheduler for the scopus api. Every call of scopus_api.query_core passes through the shared scheduler, which
+- paces requests with a token bucket (max_rate requests per second, bursts of up to burst requests)
+- tracks the remaining weekly quota (x-ratelimit-remaining / x-ratelimit-reset headers) and stops with
+  QuotaExhaustedError before quota_reserve requests are used. With spread_quota the pace is additionally lowered so that
+  the usable quota lasts until it resets
+- retries 429 and 5xx responses with exponential backoff and full jitter, honouring Retry-After / X-RateLimit-Reset,
+  requests that timed out (requests.Timeout, see scopus_session.TIMEOUT) are retried with the same backoff
+'''
+
+
+class QuotaExhaustedError(Exception):
+    '''
+    raised when the remaining api quota falls to the reserve or a 429 asks to wait longer than max_wait seconds
+    '''
+    def __init__(self, message, reset=None):
+        super().__init__(message)
+        self.reset = reset
+
+
+class RequestScheduler:
+    def __init__(self, max_rate=6, burst=6, quota_reserve=500, max_retries=6, backoff_base=1, backoff_cap=60, max_wait=900, spread_quota=False):
+        '''
+        :param max_rate: maximal sustained requests per second (scopus search allows ~9/s per key)
+        :param burst: size of the token bucket
+        :param quota_reserve: requests of the weekly quota that are never used by the scheduler
+        :param max_retries: retries of a request answered with 429 or 5xx or timed out before giving up
+        :param backoff_base: base delay in seconds of the exponential backoff
+        :param backoff_cap: maximal backoff delay in seconds
+        :param max_wait: longest Retry-After / reset wait in seconds that is slept through, longer waits raise QuotaExhaustedError
+        :param spread_quota: pace requests so that the usable quota is spread until x-ratelimit-reset
+        '''
+        self.max_rate = max_rate
+        self.burst = burst
+        self.quota_reserve = quota_reserve
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_wait = max_wait
+        self.spread_quota = spread_quota
+        self.rate = max_rate
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.rate_limit = None
+        self.rate_remaining = None
+        self.rate_reset = None
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # block until a token is available
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.rate_remaining is not None and self.rate_remaining <= self.quota_reserve:
+                    raise QuotaExhaustedError(f'only {self.rate_remaining} of {self.rate_limit} requests remaining (reserve: {self.quota_reserve})', self.rate_reset)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def update(self, headers):
+        '''
+        adapt the pace to the rate limit headers of the last response
+        '''
+        with self.lock:
+            if 'x-ratelimit-limit' in headers:
+                self.rate_limit = int(headers['x-ratelimit-limit'])
+            if 'x-ratelimit-remaining' in headers:
+                self.rate_remaining = int(headers['x-ratelimit-remaining'])
+            if 'x-ratelimit-reset' in headers:
+                self.rate_reset = float(headers['x-ratelimit-reset'])
+            target_rate = self.max_rate
+            if self.spread_quota and self.rate_remaining is not None and self.rate_reset is not None:
+                usable = max(self.rate_remaining - self.quota_reserve, 0)
+                seconds_to_reset = self.rate_reset - time.time()
+                if seconds_to_reset > 0:
+                    # spread the usable quota until it resets
+                    target_rate = max(min(self.max_rate, usable / seconds_to_reset), 1 / self.backoff_cap)
+            # recover additively after being slowed down by a 429
+            self.rate = min(target_rate, self.rate + self.max_rate / 10)
+
+    def retry_delay(self, resp, attempt):
+        '''
+        delay before retrying a throttled (429) or failed (5xx) response
+        '''
+        delay = None
+        retry_after = resp.headers.get('Retry-After')
+        if retry_after is not None:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+        elif resp.status_code == 429 and 'x-ratelimit-reset' in resp.headers:
+            delay = float(resp.headers['x-ratelimit-reset']) - time.time()
+        if delay is not None and delay > self.max_wait:
+            raise QuotaExhaustedError(f'api asks to wait {round(delay)} s before the next request', time.time() + delay)
+        backoff = self.backoff(attempt)
+        if delay is None:
+            return backoff
+        return max(delay, 0) + backoff
+
+    def backoff(self, attempt):
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def call(self, send):
+        '''
+        send a request through the scheduler
+
+        :param send: callable without arguments that performs the request and returns a requests.Response
+        :return: the response
+        '''
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            try:
+                resp = send()
+            except requests.Timeout as e:
+                # a stalled connection gets no status, it is retried like a 5xx response
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                with self.lock:
+                    self.retries += 1
+                print(f'\n[-] {type(e).__name__}, retry {attempt + 1} of {self.max_retries} in {round(delay, 1)} s')
+                time.sleep(delay)
+                continue
+            if resp.status_code != 429 and resp.status_code < 500:
+                self.update(resp.headers)
+                return resp
+            if attempt == self.max_retries:
+                break
+            delay = self.retry_delay(resp, attempt)
+            with self.lock:
+                self.retries += 1
+                if resp.status_code == 429:
+                    # slow down the sustained pace after being throttled
+                    self.rate = max(self.rate / 2, 1 / self.backoff_cap)
+            print(f'\n[-] status {resp.status_code}, retry {attempt + 1} of {self.max_retries} in {round(delay, 1)} s')
+            time.sleep(delay)
+        return resp
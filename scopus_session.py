@@ -0,0 +1,114 @@
+import time
+import threading
+import statistics
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+'''
+pooled http session shared by all calls of scopus_api.py. Connections are kept alive and reused instead of paying a new
+TCP and TLS handshake per request. The time spent on opening connections and the latency of every request are recorded
+in STATS to see how much of a harvest is handshake overhead.
+'''
+# (connect, read) timeout in seconds of every request. A stalled connection raises requests.Timeout, which the scheduler
+# retries, instead of blocking its worker and the workers waiting for a pooled connection (pool_block)
+TIMEOUT = (10, 60)
+
+
+class RequestStats:
+    def __init__(self):
+        self.latencies = []
+        self.connect_times = []
+        self.lock = threading.Lock()
+
+    def record_request(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def record_connect(self, seconds):
+        with self.lock:
+            self.connect_times.append(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.latencies = []
+            self.connect_times = []
+
+    def summary(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            connect_times = list(self.connect_times)
+        if not latencies:
+            return {'requests': 0, 'connections': len(connect_times), 'connect_total': sum(connect_times)}
+        return {
+            'requests': len(latencies),
+            'latency_total': sum(latencies),
+            'latency_mean': statistics.mean(latencies),
+            'latency_median': statistics.median(latencies),
+            'latency_p95': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+            'latency_max': latencies[-1],
+            'connections': len(connect_times),
+            'connect_total': sum(connect_times),
+            'connect_mean': statistics.mean(connect_times) if connect_times else 0,
+        }
+
+    def print_summary(self):
+        s = self.summary()
+        if not s['requests']:
+            print('[*] no requests recorded')
+            return
+        share = s['connect_total'] / s['latency_total'] * 100 if s['latency_total'] else 0
+        print(f"[*] {s['requests']} requests, latency mean {s['latency_mean'] * 1000:.0f} ms, median {s['latency_median'] * 1000:.0f} ms, "
+              f"p95 {s['latency_p95'] * 1000:.0f} ms, max {s['latency_max'] * 1000:.0f} ms\n"
+              f"[*] {s['connections']} connections opened, handshakes took {s['connect_total']:.2f} s "
+              f"({share:.1f}% of the total request time of {s['latency_total']:.2f} s)")
+
+STATS = RequestStats()
+
+
+# connection classes that time the TCP connect (and TLS handshake for https)
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        STATS.record_connect(time.perf_counter() - start)
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        STATS.record_connect(time.perf_counter() - start)
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+def build_session(pool_size=10, compression=True):
+    '''
+    create a requests session with a keep-alive connection pool
+
+    :param pool_size: maximal number of open connections per host, should be at least the number of concurrent requests
+    :param compression: negotiate gzip/deflate compressed responses
+    :return: requests.Session
+    '''
+    session = requests.Session()
+    # pool_block: wait for a free connection instead of opening throwaway connections beyond pool_size
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+    adapter.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Accept': 'application/json',
+                            'Accept-Encoding': 'gzip, deflate' if compression else 'identity'})
+    return session
+
+def timed_get(session, url, headers, timeout=None):
+    '''
+    :param timeout: (connect, read) timeout in seconds, defaults to TIMEOUT
+    '''
+    start = time.perf_counter()
+    resp = session.get(url, headers=headers, timeout=TIMEOUT if timeout is None else timeout)
+    STATS.record_request(time.perf_counter() - start)
+    return resp
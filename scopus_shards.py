@@ -0,0 +1,133 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import scopus_api
+from scopus_scheduler import RequestScheduler
+from db_connection import reset_after_fork
+from dbclasses import ShardEntry, EntryWriter, CheckpointJournal, WatermarkStore, DeferredWatermarks, connect_to_db, merge_shards
+'''
+sharded harvest of the scopus search results. The (search field, sdg) combinations of query_pipeline are independent,
+so every combination becomes a shard that is harvested by query_pipeline in its own worker process with
+- its own database session (connect_to_db) and http session
+- an equal share of the request rate of scopus_api.SCHEDULER (the weekly quota is shared, every worker sees the
+  remaining quota in the response headers)
+- its own checkpoint run '<run>#<shard>', so an interrupted sharded run resumes per shard. The finished shards are
+  recorded under the run '<run>#shards', none of these runs is the run of a serial query_pipeline with the same name
+The shards write into the staging table literature_shard. Once all shards finished, merge_shards moves the rows into
+literature and keeps for an eid found by several shards the row of the first shard in the serial order. The high-water
+marks of the queries are only advanced after the merge (marks of shards finished by an earlier, interrupted run are not
+advanced, their next incremental harvest requests more than needed), e.g.:
+
+    search_queries = scopus_api.build_query_api(scopus_api.load_search_terms())
+    harvest_sharded(search_queries, max_workers=4)
+'''
+
+
+def plan_shards(search_queries, search_fields=['TITLE', 'KEY']):
+    '''
+    :return: list of (search_field, sdg) in the order query_pipeline processes them, the index is the shard number
+    '''
+    return [(search_field, sdg) for search_field in search_fields for sdg in search_queries]
+
+def harvest_shard(shard, search_field, sdg, queries, settings):
+    '''
+    harvest one shard, runs in a worker process
+
+    :param settings: api url, rate share, quota reserve, cache mode and pipeline arguments of the parent process
+    :return: (shard, rows staged, duplicates within the shard, pending watermarks of DeferredWatermarks)
+    '''
+    # the module globals of the parent are not inherited by spawned workers and the pooled connections of forked
+    # workers must not be shared with the parent
+    scopus_api.SCOPUS_API_URL = settings['api_url']
+    scopus_api.SCHEDULER = RequestScheduler(max_rate=settings['max_rate'], burst=max(1, round(settings['max_rate'])), quota_reserve=settings['quota_reserve'])
+    scopus_api.SESSION = None
+    scopus_api.CACHE.mode = settings['cache_mode']
+    scopus_api.STATS.reset()
+    reset_after_fork()
+    session = connect_to_db()
+    writer = EntryWriter(session, settings['batch_size'], table=ShardEntry.__table__, shard=shard)
+    # the staged rows may still be discarded, the marks are recorded by the parent after the merge
+    watermarks = DeferredWatermarks(session)
+    try:
+        incomplete = scopus_api.query_pipeline({sdg: queries}, session, search_fields=[search_field], batch_size=settings['batch_size'],
+                                               pagination=settings['pagination'], count=settings['count'], resume=settings['resume'],
+                                               run=f"{settings['run']}#{shard}", writer=writer,
+                                               incremental=settings['incremental'], delta=settings['delta'], watermarks=watermarks)
+    finally:
+        session.close()
+    if incomplete:
+        raise RuntimeError(f'{incomplete} queries are incomplete')
+    return shard, writer.inserted, writer.duplicates, watermarks.pending
+
+def harvest_sharded(search_queries, search_fields=['TITLE', 'KEY'], max_workers=None, batch_size=200, pagination='offset', count=scopus_api.MAX_COUNT, resume=True, run='harvest', incremental=False, delta='loaddate'):
+    '''
+    sharded counterpart of scopus_api.query_pipeline, same results in the literature table
+
+    :param max_workers: number of worker processes, defaults to the number of cores (at most one per shard)
+    :param resume: continue the shards of an interrupted run, rows already staged are kept. If False the staging
+                   table and the checkpoints of the shards are discarded first
+    :param run: name of the sharded run, its checkpoints are kept apart from those of query_pipeline(run=run)
+    :param incremental: only request records that are new since the last harvest, see scopus_api.query_pipeline
+    :param delta: 'loaddate' or 'pubyear', see scopus_api.delta_restriction
+    :return:
+    '''
+    shards = plan_shards(search_queries, search_fields)
+    max_workers = min(len(shards), max_workers or os.cpu_count())
+    settings = {
+        'api_url': scopus_api.SCOPUS_API_URL,
+        # the request rate is split evenly between the workers
+        'max_rate': scopus_api.SCHEDULER.max_rate / max_workers,
+        'quota_reserve': scopus_api.SCHEDULER.quota_reserve,
+        'cache_mode': scopus_api.CACHE.mode,
+        'batch_size': batch_size,
+        'pagination': pagination,
+        'count': count,
+        'resume': resume,
+        'run': run,
+        'incremental': incremental,
+        'delta': delta,
+    }
+    session = connect_to_db()
+    # finished shards of the run, their own checkpoints are removed by query_pipeline when they complete
+    journal = CheckpointJournal(session, f'{run}#shards')
+    if not resume:
+        journal.reset()
+        session.query(ShardEntry).delete()
+        session.commit()
+    pending = [shard for shard in range(len(shards)) if not journal.is_done(f'shard {shard}')]
+    if len(pending) < len(shards):
+        print(f'[*] resuming run {run}: {len(shards) - len(pending)} shards already completed')
+    print(f'[*] harvesting {len(shards)} shards with {max_workers} worker processes ({settings["max_rate"]:.2f} requests/s each)')
+    start = time.time()
+    failed = []
+    # high-water marks of the shards finished in this run
+    pending_watermarks = []
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = {executor.submit(harvest_shard, shard, search_field, sdg, search_queries[sdg], settings): shard
+                   for shard, (search_field, sdg) in enumerate(shards) if shard in pending}
+        for future in as_completed(futures):
+            shard = futures[future]
+            search_field, sdg = shards[shard]
+            try:
+                _, staged, duplicates, watermarks = future.result()
+                pending_watermarks += watermarks
+                journal.record(f'shard {shard}', 'shard', done=True)
+                print(f'[+] shard {shard} ({search_field} {sdg}) finished: {staged} records, {duplicates} dublicates within the shard')
+            except Exception as e:
+                failed.append(shard)
+                print(f'[-] shard {shard} ({search_field} {sdg}) failed: {e!r}')
+    if failed:
+        # the staged rows are kept, the next run with resume=True continues the failed shards
+        print(f'[-] {len(failed)} of {len(shards)} shards failed, literature is not updated until all shards finished')
+        session.close()
+        return
+    inserted, updated, duplicates = merge_shards(session, upsert=incremental)
+    watermark_store = WatermarkStore(session)
+    for unit, cover_date, harvested in pending_watermarks:
+        watermark_store.record(unit, cover_date, harvested)
+    journal.reset()
+    session.close()
+    duration = round((time.time() - start) / 60, 2)
+    print(f'\n[+] total records retrieved: {inserted}\n[+] dublicates: {duplicates}\n[*] sharded scopus search completed in {duration} min')
+    if incremental:
+        print(f'[+] updated records: {updated}')
@@ -0,0 +1,210 @@
+import re
+import time
+import json
+import zlib
+import base64
+import random
+import argparse
+import datetime
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+'''
+local stand-in for the scopus search and abstract retrieval api which returns deterministic fake results in the same
+json structure as https://api.elsevier.com/content/search/scopus and /content/abstract. Used to test the harvesting
+functions of scopus_api.py without spending quota, e.g.:
+
+    python scopus_stub_server.py --port 8080 --latency 0.2 --per-second 9 --error-rate 0.05
+
+    import scopus_api
+    scopus_api.SCOPUS_API_URL = 'http://127.0.0.1:8080'
+'''
+ITEMS_PER_PAGE = 25
+# largest page size (STANDARD view) and deepest offset the real api allows
+MAX_COUNT = 200
+MAX_OFFSET = 5000
+# size of the pool of fake documents, different queries return overlapping documents (-> duplicates)
+EID_POOL = 20000
+
+
+def total_results_for(query):
+    # stable number of results per query, queries containing 'broad' exceed the offset limit
+    if 'broad' in query:
+        return 6000 + zlib.crc32(query.encode('utf-8')) % 1000
+    return zlib.crc32(query.encode('utf-8')) % 300
+
+def encode_cursor(start):
+    # opaque cursor with characters that need url escaping, like the real ones
+    return base64.b64encode(f'stub-cursor:{start}:?>'.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    if cursor == '*':
+        return 0
+    return int(base64.b64decode(cursor).decode('utf-8').split(':')[1])
+
+def split_restriction(query):
+    # incremental harvests append ' AND LOAD-DATE AFT yyyymmdd' or ' AND PUBYEAR > yyyy' to the query
+    match = re.search(r' AND (LOAD-DATE AFT|PUBYEAR >) (\d+)$', query)
+    if match is None:
+        return query, None
+    return query[:match.start()], (match.group(1), match.group(2))
+
+def entry_number(query, index):
+    return (zlib.crc32(query.encode('utf-8')) + index) % EID_POOL
+
+def load_date(number):
+    # documents were added to the stub one per day over the last ten years
+    return datetime.date.today() - datetime.timedelta(days=number % 3650)
+
+def matches_restriction(number, restriction):
+    if restriction is None:
+        return True
+    field, value = restriction
+    if field == 'PUBYEAR >':
+        return 2005 + number % 17 > int(value)
+    return load_date(number) > datetime.datetime.strptime(value, '%Y%m%d').date()
+
+def build_entry(query, index, base_url):
+    number = entry_number(query, index)
+    eid = f'2-s2.0-{85000000000 + number}'
+    return {
+        'eid': eid,
+        'prism:doi': f'10.0000/stub.{number}',
+        'dc:title': f'Stub paper {number}',
+        'subtypeDescription': 'Article' if number % 5 else 'Review',
+        'prism:coverDate': f'{2005 + number % 17}-{1 + number % 12:02d}-01',
+        'dc:creator': f'Author {number % 97}',
+        'prism:publicationName': f'Journal {number % 31}',
+        'openaccessFlag': bool(number % 2),
+        'link': [
+            {'@_fa': 'true', '@ref': 'self', '@href': f'{base_url}/content/abstract/eid/{eid}'},
+            {'@_fa': 'true', '@ref': 'scopus', '@href': f'https://www.scopus.com/inward/record.uri?eid={eid}'},
+        ]
+    }
+
+def search_response(query, start, count, base_url, cursor=None):
+    base_query, restriction = split_restriction(query)
+    indices = [index for index in range(total_results_for(base_query)) if matches_restriction(entry_number(base_query, index), restriction)]
+    total_results = len(indices)
+    stop = min(start + count, total_results)
+    if start < stop:
+        entries = [build_entry(base_query, index, base_url) for index in indices[start:stop]]
+    else:
+        entries = [{'@_fa': 'true', 'error': 'Result set was empty'}]
+    response = {
+        'search-results': {
+            'opensearch:totalResults': str(total_results),
+            'opensearch:startIndex': str(start),
+            'opensearch:itemsPerPage': str(max(stop - start, 0)),
+            'opensearch:Query': {'@role': 'request', '@searchTerms': query, '@startPage': str(start)},
+            'entry': entries
+        }
+    }
+    if cursor is not None:
+        # the real api always returns a next cursor, even after the last page
+        response['search-results']['cursor'] = {'@current': cursor, '@next': encode_cursor(start + count)}
+    return response
+
+
+def abstract_response(eid):
+    number = int(eid.split('-')[-1]) - 85000000000
+    coredata = {'eid': eid, 'dc:title': f'Stub paper {number}'}
+    # some articles come without abstract or keywords
+    if number % 7:
+        coredata['dc:description'] = f'Abstract of stub paper {number} about user-generated content.'
+    response = {'abstracts-retrieval-response': {'coredata': coredata}}
+    if number % 3:
+        response['abstracts-retrieval-response']['authkeywords'] = {
+            'author-keyword': [{'@_fa': 'true', '$': f'keyword {number % k}'} for k in (5, 11, 13)]}
+    return response
+
+
+class ScopusStubHandler(BaseHTTPRequestHandler):
+    # keep-alive connections like the real api
+    protocol_version = 'HTTP/1.1'
+    latency = 0
+    rate_limit = 20000
+    # throttling like the real api: more than per_second requests within one second are answered with 429
+    per_second = None
+    # share of requests answered with 503
+    error_rate = 0
+    # seconds until the weekly quota resets
+    reset_after = 7 * 24 * 3600
+    started = time.time()
+    requests_served = 0
+    throttled = 0
+    failed = 0
+    recent = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if self.latency:
+            time.sleep(self.latency)
+        with ScopusStubHandler.lock:
+            now = time.time()
+            ScopusStubHandler.recent = [t for t in ScopusStubHandler.recent if now - t < 1] + [now]
+            if self.per_second is not None and len(ScopusStubHandler.recent) > self.per_second:
+                ScopusStubHandler.throttled += 1
+                self.send_json({'error-response': {'error-code': 'TOO_MANY_REQUESTS'}}, status=429, extra_headers={'Retry-After': '1'})
+                return
+            if random.random() < self.error_rate:
+                ScopusStubHandler.failed += 1
+                self.send_json({'service-error': {'status': {'statusCode': 'GENERAL_SYSTEM_ERROR'}}}, status=503)
+                return
+            ScopusStubHandler.requests_served += 1
+        base_url = f'http://{self.headers["Host"]}'
+        if url.path == '/content/search/scopus':
+            query = params.get('query', [''])[0]
+            count = min(int(params.get('count', [str(ITEMS_PER_PAGE)])[0]), MAX_COUNT)
+            if 'cursor' in params:
+                cursor = params['cursor'][0]
+                self.send_json(search_response(query, decode_cursor(cursor), count, base_url, cursor))
+                return
+            start = int(params.get('start', ['0'])[0])
+            if start + count > MAX_OFFSET:
+                self.send_json({'service-error': {'status': {'statusCode': 'INVALID_INPUT', 'statusText': 'Exceeds the maximum number allowed for the service level'}}}, status=400)
+                return
+            self.send_json(search_response(query, start, count, base_url))
+        elif url.path.startswith('/content/abstract/eid/'):
+            self.send_json(abstract_response(url.path.split('/')[-1]))
+        else:
+            self.send_json({'service-error': {'status': {'statusCode': 'RESOURCE_NOT_FOUND'}}}, status=404)
+
+    def send_json(self, body, status=200, extra_headers={}):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('x-ratelimit-limit', str(self.rate_limit))
+        self.send_header('x-ratelimit-remaining', str(max(self.rate_limit - ScopusStubHandler.requests_served, 0)))
+        self.send_header('X-RateLimit-Reset', str(int(self.started + self.reset_after)))
+        for header, value in extra_headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_stub_server(port=8080, latency=0, per_second=None, error_rate=0, rate_limit=20000):
+    ScopusStubHandler.latency = latency
+    ScopusStubHandler.per_second = per_second
+    ScopusStubHandler.error_rate = error_rate
+    ScopusStubHandler.rate_limit = rate_limit
+    ScopusStubHandler.started = time.time()
+    server = ThreadingHTTPServer(('127.0.0.1', port), ScopusStubHandler)
+    print(f'[*] scopus stub server listening on http://127.0.0.1:{port}')
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local stand-in for the scopus search and abstract api')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help='simulated network latency per request in seconds')
+    parser.add_argument('--per-second', type=int, default=None, help='requests per second before answering with 429')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests answered with 503')
+    parser.add_argument('--rate-limit', type=int, default=20000, help='weekly quota reported in x-ratelimit-limit')
+    args = parser.parse_args()
+    run_stub_server(args.port, args.latency, args.per_second, args.error_rate, args.rate_limit).serve_forever()
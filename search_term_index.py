@@ -0,0 +1,125 @@
+import os
+import re
+from functools import lru_cache
+from collections import namedtuple
+from types import MappingProxyType
+'''
+parsed search term files, shared by the harvest (scopus_api.load_search_terms) and the analyses (search terms per sdg
+target). A file is parsed once into a read-only index and reused until it is modified on disk. File format:
+
+    <SDG3>                                 section header, the lines up to the next header are its search terms
+    (outdoor OR nature) AND recreation
+    target 3.6                             the following terms of the section belong to sdg target 3.6
+    death AND (road OR traffic)
+
+The stored queries of the harvested papers are built by scopus_api.build_query_api and wrapped in the search field,
+FIELD((sdg term) AND ((ugc term 1) OR ... (ugc term n))), query_sdg_term slices the sdg term back out of them.
+'''
+SECTION_PATTERN = re.compile(r'<[^<>]+>')
+TARGET_PATTERN = re.compile(r'target\s+(\S+)')
+# parsed index per (absolute path, modification time)
+INDEXES = {}
+# the sdg term of a stored query ends where the ugc terms begin (first ugc term of the harvest)
+QUERY_UGC_MARKER = ') AND ((citizen science collective sens*)'
+# papers of the later iterations were added manually, their query column holds the sdg term itself
+SOURCE_MANUAL = 'webofknowledge'
+
+# section_terms: section -> tuple of all lines of the section (as used for the queries, target lines included)
+# term_target: term -> sdg target, term_section: term -> section, target_terms: sdg target -> tuple of terms
+SearchTermIndex = namedtuple('SearchTermIndex', ['section_terms', 'term_target', 'term_section', 'target_terms'])
+
+
+def parse_search_terms(path):
+    '''
+    :param path: search term file
+    :return: SearchTermIndex of the file
+    '''
+    section_terms = {}
+    term_target = {}
+    term_section = {}
+    target_terms = {}
+    current_section = None
+    active_target = None
+    with open(path, 'rt') as f:
+        for line in f:
+            line = line.strip('\n')
+            if SECTION_PATTERN.fullmatch(line):
+                current_section = line
+                # targets do not carry over into the next section
+                active_target = None
+                section_terms.setdefault(current_section, [])
+                continue
+            # lines before the first section are the file header
+            if current_section is None or line == '':
+                continue
+            section_terms[current_section].append(line)
+            target = TARGET_PATTERN.fullmatch(line)
+            if target is not None:
+                active_target = target.group(1)
+                target_terms.setdefault(active_target, [])
+                continue
+            term_section[line] = current_section
+            if active_target is not None:
+                # relate search term to its target
+                term_target[line] = active_target
+                target_terms[active_target].append(line)
+    return SearchTermIndex(
+        section_terms=MappingProxyType({section: tuple(terms) for section, terms in section_terms.items()}),
+        term_target=MappingProxyType(term_target),
+        term_section=MappingProxyType(term_section),
+        target_terms=MappingProxyType({target: tuple(terms) for target, terms in target_terms.items()}),
+    )
+
+def load_search_term_index(path):
+    '''
+    :return: SearchTermIndex of the file, parsed again only if the file was modified since the last call
+    '''
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    if key not in INDEXES:
+        # drop the index of an older version of the file
+        for old_key in [old_key for old_key in INDEXES if old_key[0] == key[0]]:
+            del INDEXES[old_key]
+        INDEXES[key] = parse_search_terms(path)
+    return INDEXES[key]
+
+def load_search_terms(path, sections):
+    '''
+    :return: dict of section -> list of its search terms (new lists, the caller may change them)
+    '''
+    index = load_search_term_index(path)
+    return {section: list(index.section_terms.get(section, ())) for section in sections}
+
+def load_search_terms_per_target(path, sections):
+    '''
+    :return: dict of search term -> sdg target for the terms of the given sections that belong to a target
+    '''
+    index = load_search_term_index(path)
+    return {term: target for term, target in index.term_target.items() if index.term_section[term] in sections}
+
+@lru_cache(maxsize=None)
+def query_sdg_term(query):
+    '''
+    :param query: stored query of a harvested paper, e.g. KEY((urban* AND green*) AND ((citizen science collective sens*) OR ...))
+    :return: the sdg term of the query (urban* AND green*), None if the query does not have this structure
+    '''
+    if query is None:
+        return None
+    start = query.find('((')
+    field = query[:start]
+    if start < 1 or not all('A' <= char <= 'Z' for char in field):
+        return None
+    start += 2
+    # the term does not span lines
+    line_end = query.find('\n', start)
+    end = query.rfind(QUERY_UGC_MARKER, start, len(query) if line_end == -1 else line_end)
+    if end <= start:
+        return None
+    return query[start:end]
+
+def sdg_terms(queries, sources):
+    '''
+    :param queries: stored queries of the papers
+    :param sources: data source of the papers (scopus, webofknowledge)
+    :return: list with the sdg term of each paper, every distinct query is only sliced once
+    '''
+    return [query if source == SOURCE_MANUAL else query_sdg_term(query) for query, source in zip(queries, sources)]
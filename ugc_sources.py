@@ -0,0 +1,71 @@
+import re
+from functools import lru_cache
+'''
+canonical names of the annotated ugc sources. Sources that appear in different variations and names are homogenised,
+e.g. 'sina weibo', 'weibo' and 'sina' all become 'sina weibo', and every crowd sourced or citizen science project
+becomes 'citizen science'. The aliases are matched by one compiled regex and the result is memoised per raw source.
+'''
+TERM_CITIZEN_SCIENCE = 'citizen science'
+# (canonical name, alias substrings) in priority order, a source containing aliases of several entries takes the
+# canonical name of the first one (e.g. 'wikiloc' contains 'wiki' and becomes 'geo wiki')
+UGC_ALIASES = [
+    (TERM_CITIZEN_SCIENCE, ['citizen', 'crowed', 'crowd']),
+    ('sina weibo', ['weibo', 'sina']),
+    ('google trends', ['google', 'trend', 'search']),
+    ('geo wiki', ['geo', 'wiki']),
+    ('openstreetmap (osm)', ['openstreet']),
+    ('strava', ['strava']),
+    ('facebook', ['facebook']),
+    ('tencent', ['tencent']),
+    ('twitter', ['twitter']),
+    ('healthmap', ['healthmap']),
+    ('flickr', ['flickr']),
+    ('wikiloc', ['wikiloc']),
+    ('wikidata', ['wikidata']),
+]
+# citizen science is recognised regardless of case, the other aliases are matched on the lower case source
+CASE_INSENSITIVE = {TERM_CITIZEN_SCIENCE}
+
+
+def compile_aliases(aliases):
+    '''
+    one named group per canonical name inside a lookahead, so the regex reports at every position of the source the
+    first entry of the table that matches there (matches of different entries may overlap)
+    '''
+    groups = []
+    for index, (canonical, substrings) in enumerate(aliases):
+        alternation = '|'.join(re.escape(substring) for substring in substrings)
+        if canonical in CASE_INSENSITIVE:
+            alternation = f'(?i:{alternation})'
+        groups.append(f'(?P<alias{index}>{alternation})')
+    return re.compile(f"(?=(?:{'|'.join(groups)}))")
+
+UGC_PATTERN = compile_aliases(UGC_ALIASES)
+
+
+@lru_cache(maxsize=None)
+def canonical_ugc_source(source):
+    '''
+    :param source: one annotated ugc source (stripped)
+    :return: canonical name of the source, the source itself if no alias matches
+    '''
+    best = None
+    for match in UGC_PATTERN.finditer(source):
+        index = int(match.lastgroup[len('alias'):])
+        if best is None or index < best:
+            best = index
+            if best == 0:
+                break
+    if best is None:
+        return source
+    return UGC_ALIASES[best][0]
+
+def split_ugc_sources(ugc_source):
+    '''
+    :param ugc_source: ';' joined ugc sources as annotated in the literature table
+    :return: list of canonical ugc sources, empty entries are dropped
+    '''
+    if ugc_source is None:
+        return []
+    sources = [source.strip() for source in ugc_source.lower().replace(' ', '').split(';')]
+    return [canonical_ugc_source(source) for source in sources if source != '']